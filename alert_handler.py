@@ -4,19 +4,56 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 import time
 import logging
-
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('alert_handler.log'),
-        logging.StreamHandler()
-    ]
-)
+import unicodedata
+import metrics
+from retry_policy import PortalValidationError
 
 logger = logging.getLogger(__name__)
 
+# Texto visible de los contenedores donde el portal muestra los errores de
+# validación del servidor (una sola llamada al navegador)
+_ERRORES_SCRIPT = """
+    var textos = [];
+    document.querySelectorAll('#mensajes_error, .error, .errores, .mensajeError').forEach(function (el) {
+        var texto = (el.innerText || el.textContent || '').trim();
+        if (texto && el.offsetParent !== null) { textos.push(texto); }
+    });
+    return textos;
+"""
+
+# Botón del comprobante ya generado: tras confirmar, su presencia indica éxito
+IMPRIMIR_XPATH = "//input[@type='button'][contains(@value, 'Imprimir')]"
+
+# Palabras del mensaje de error (sin tildes) -> campo de FacturaData
+_CAMPOS_POR_PALABRA = [
+    ('cuit', 'cuit'),
+    ('documento', 'cuit'),
+    ('condicion frente al iva', 'cond_iva'),
+    ('condicion de iva', 'cond_iva'),
+    ('fecha', 'fecha'),
+    ('vencimiento', 'fecha'),
+    ('periodo', 'periodo'),
+    ('precio', 'importe'),
+    ('importe', 'importe'),
+    ('monto', 'importe'),
+    ('descripcion', 'rendicion'),
+]
+
+
+def campos_con_error(mensaje):
+    """
+    Campos de FacturaData a los que se refiere un mensaje de error del portal.
+
+    Returns:
+        list: nombres de campo, sin repetir, en el orden de _CAMPOS_POR_PALABRA
+    """
+    texto = unicodedata.normalize('NFKD', mensaje.lower()).encode('ascii', 'ignore').decode()
+    campos = []
+    for palabra, campo in _CAMPOS_POR_PALABRA:
+        if palabra in texto and campo not in campos:
+            campos.append(campo)
+    return campos
+
 class AlertHandler:
     """
     Clase para manejar diferentes tipos de alertas y confirmaciones en la aplicación AFIP.
@@ -51,14 +88,16 @@ class AlertHandler:
             ]
             
             # Intentar cada estrategia
+            contador = metrics.current().confirmation_strategy
             for strategy in strategies:
                 try:
                     if strategy(driver):
                         logger.info(f"Confirmación manejada exitosamente usando {strategy.__name__}")
+                        contador.inc(strategy=strategy.__name__, result='ok')
                         return True
                 except Exception as e:
                     logger.debug(f"Estrategia {strategy.__name__} falló: {str(e)}")
-                    continue
+                contador.inc(strategy=strategy.__name__, result='fallo')
             
             logger.warning("Todas las estrategias de manejo de confirmación fallaron")
             return False
@@ -113,24 +152,76 @@ class AlertHandler:
         except Exception:
             return False
     
-    def handle_error_alert(self, driver):
+    def handle_error_alert(self, driver, timeout=None):
         """
         Maneja alertas de error específicas.
         
         Args:
             driver: WebDriver de Selenium
+            timeout: segundos de espera de la alerta (por defecto wait_time;
+                     0 solo mira si ya hay una abierta)
             
         Returns:
             tuple: (bool, str) - Éxito del manejo y mensaje de error si existe
         """
         try:
-            alert = WebDriverWait(driver, self.wait_time).until(EC.alert_is_present())
+            if timeout == 0:
+                alert = driver.switch_to.alert
+            else:
+                alert = WebDriverWait(driver, timeout or self.wait_time).until(EC.alert_is_present())
             alert_text = alert.text
             alert.accept()
             logger.warning(f"Alerta de error detectada: {alert_text}")
             return True, alert_text
-        except TimeoutException:
+        except (TimeoutException, NoAlertPresentException):
             return False, None
         except Exception as e:
             logger.error(f"Error manejando alerta de error: {str(e)}")
-            return False, str(e)
\ No newline at end of file
+            return False, str(e)
+
+    def check_validation_error(self, driver, factura=None, step=None, success_xpath=None):
+        """
+        Detecta si el portal rechazó los datos del paso recién enviado.
+
+        Se llama después de validarCampos() / confirmar() y no espera: mira si
+        quedó abierta una alerta (validación del navegador) y, si no, busca el
+        texto de error de la página (validación del servidor) con una sola
+        llamada. Así un dato rechazado corta la factura al instante en lugar
+        de agotar los timeouts del paso siguiente.
+
+        Args:
+            driver: WebDriver de Selenium
+            factura: FacturaData en curso, para indicar el valor rechazado (opcional)
+            step: paso del asistente, para el mensaje (opcional)
+            success_xpath: elemento que indica que el paso salió bien (p. ej.
+                           IMPRIMIR_XPATH tras confirmar); si está presente no se
+                           buscan textos de error, que pueden ser falsos positivos
+
+        Raises:
+            PortalValidationError: con el mensaje del portal y los campos de
+                FacturaData a los que se refiere
+        """
+        hay_alerta, mensaje = self.handle_error_alert(driver, timeout=0)
+        if not hay_alerta:
+            if success_xpath:
+                try:
+                    if driver.find_elements(By.XPATH, success_xpath):
+                        return
+                except Exception as e:
+                    logger.debug(f"No se pudo buscar el indicador de éxito: {str(e)}")
+            try:
+                textos = driver.execute_script(_ERRORES_SCRIPT) or []
+            except Exception as e:
+                logger.debug(f"No se pudo buscar errores en la página: {str(e)}")
+                textos = []
+            mensaje = " | ".join(textos)
+        if not mensaje:
+            return
+
+        campos = campos_con_error(mensaje)
+        valores = ", ".join(f"{campo}={getattr(factura, campo, None)!r}" for campo in campos) if factura is not None else ""
+        detalle = f"El portal rechazó el paso {step or 'actual'}: {mensaje}"
+        if valores:
+            detalle += f" ({valores})"
+        logger.warning(detalle)
+        raise PortalValidationError(detalle, campos)
\ No newline at end of file
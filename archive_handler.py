@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+from json_state import file_lock, read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+# Carpeta por defecto del archivo de comprobantes emitidos
+ARCHIVO_DEFAULT = Path.home() / "Comprobantes_archivo"
+
+
+def normalizar_rendicion(rendicion):
+    """
+    Normaliza el número de rendición tal como viene del Excel.
+
+    pandas suele leer los números como float, por lo que '11426' llega como
+    '11426.0'. Solo se elimina el sufijo '.0' exacto (rstrip('.0') también
+    borraría los ceros finales de rendiciones como '11420').
+    """
+    texto = str(rendicion).strip()
+    if texto.endswith('.0'):
+        texto = texto[:-2]
+    return texto
+
+
+def clave_factura(factura):
+    """
+    Devuelve la clave de índice de una factura: cliente, rendición y periodo.
+
+    Args:
+        factura: Objeto FacturaData
+
+    Returns:
+        str: clave normalizada 'CLIENTE|RENDICION|PERIODO'
+    """
+    return "|".join([
+        str(factura.cliente).strip().upper(),
+        normalizar_rendicion(factura.rendicion),
+        str(factura.periodo).strip().upper()
+    ])
+
+
+def nombre_archivo_factura(factura):
+    """Nombre legible con el que se publica el PDF en la carpeta destino"""
+    nombre = (f"{factura.cliente} x Honorarios {factura.periodo} - "
+              f"Rendición N° {normalizar_rendicion(factura.rendicion)}.pdf")
+    return nombre.replace('/', '-').replace('\\', '-')
+
+
+class ComprobanteArchive:
+    """
+    Archivo de comprobantes emitidos con almacenamiento direccionado por contenido.
+
+    Los PDF se guardan en objects/<hash[:2]>/<hash>.pdf (sha256 del contenido) y
+    un índice JSON, cargado en memoria al iniciar, permite saber en tiempo
+    constante si una rendición ya fue facturada antes de emitir otra vez.
+
+    Varios procesos pueden compartir el mismo archivo: cada escritura relee el
+    índice bajo bloqueo y agrega sus entradas a las de los demás, y las
+    consultas recargan el índice si otro proceso lo modificó.
+    """
+
+    def __init__(self, root=ARCHIVO_DEFAULT):
+        """
+        Inicializa el archivo.
+
+        Args:
+            root: carpeta raíz del archivo (se crea si no existe)
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.index_path = self.root / "index.json"
+        self._index = {}
+        self._mtime = None
+        self._load_index()
+        if self._index:
+            logger.info(f"Índice de comprobantes cargado: {len(self._index)} entradas")
+
+    def _index_mtime(self):
+        try:
+            return self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_index(self):
+        """Carga el índice desde disco, si existe"""
+        self._mtime = self._index_mtime()
+        self._index = read_json(self.index_path, "el índice de comprobantes")
+
+    def _refresh(self):
+        """Recarga el índice si otro proceso lo modificó desde la última lectura"""
+        if self._index_mtime() != self._mtime:
+            self._load_index()
+
+    def _save_entry(self, clave, entrada):
+        """
+        Registra una entrada en el índice en disco.
+
+        Bajo bloqueo se relee el índice, así se conservan las entradas que otro
+        proceso haya guardado desde la última lectura, y se escribe de forma
+        atómica (archivo temporal + reemplazo).
+        """
+        with file_lock(self.index_path):
+            self._load_index()
+            self._index[clave] = entrada
+            write_json(self.index_path, self._index)
+            self._mtime = self._index_mtime()
+
+    def __len__(self):
+        self._refresh()
+        return len(self._index)
+
+    def is_invoiced(self, factura):
+        """
+        Indica si la rendición de la factura ya tiene un comprobante archivado.
+
+        Args:
+            factura: Objeto FacturaData
+
+        Returns:
+            bool: True si ya fue facturada
+        """
+        return self.lookup(clave_factura(factura)) is not None
+
+    def get(self, factura):
+        """Devuelve la entrada del índice para la factura o None"""
+        return self.lookup(clave_factura(factura))
+
+    def lookup(self, clave):
+        """Devuelve la entrada del índice para una clave de clave_factura o None"""
+        self._refresh()
+        return self._index.get(clave)
+
+    @staticmethod
+    def _hash_file(path):
+        """Calcula el sha256 de un archivo leyendo por bloques"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def object_path(self, sha256):
+        """Ruta del objeto direccionado por contenido"""
+        return self.objects_dir / sha256[:2] / f"{sha256}.pdf"
+
+    def store(self, pdf_path, factura, destino_folder=None, move=True, nombre=None):
+        """
+        Archiva el PDF de un comprobante y lo registra en el índice.
+
+        Args:
+            pdf_path: ruta del PDF descargado
+            factura: Objeto FacturaData del comprobante
+            destino_folder: carpeta donde publicar una copia con nombre legible
+            move: si es True el PDF original se elimina tras archivarlo
+            nombre: nombre legible del PDF publicado (por defecto nombre_archivo_factura)
+
+        Returns:
+            dict: entrada del índice registrada
+        """
+        sha256 = self._hash_file(pdf_path)
+        objeto = self.object_path(sha256)
+
+        if objeto.exists():
+            logger.info(f"Contenido ya archivado ({sha256[:12]}), se reutiliza el objeto")
+            if move:
+                os.remove(pdf_path)
+        else:
+            objeto.parent.mkdir(parents=True, exist_ok=True)
+            if move:
+                shutil.move(pdf_path, objeto)
+            else:
+                shutil.copy2(pdf_path, objeto)
+
+        publicado = None
+        if destino_folder:
+            publicado = self._publish(objeto, sha256, destino_folder, nombre or nombre_archivo_factura(factura))
+
+        entrada = {
+            'sha256': sha256,
+            'objeto': str(objeto.relative_to(self.root)),
+            'cliente': factura.cliente,
+            'cuit': factura.cuit,
+            'rendicion': normalizar_rendicion(factura.rendicion),
+            'periodo': factura.periodo,
+            'publicado': str(publicado) if publicado else None,
+            'archivado': datetime.now().isoformat(timespec='seconds')
+        }
+        self._save_entry(clave_factura(factura), entrada)
+        logger.info(f"Comprobante archivado para {factura.cliente}: {entrada['objeto']}")
+        return entrada
+
+    def link(self, factura, entrada):
+        """
+        Registra otra rendición del mismo comprobante (agrupado) en el índice.
+
+        La nueva entrada apunta al mismo objeto y PDF publicado que entrada.
+
+        Args:
+            factura: Objeto FacturaData de la rendición incluida en el comprobante
+            entrada: entrada del índice devuelta por store para el comprobante
+
+        Returns:
+            dict: entrada del índice registrada
+        """
+        vinculada = dict(entrada,
+                         cliente=factura.cliente,
+                         cuit=factura.cuit,
+                         rendicion=normalizar_rendicion(factura.rendicion),
+                         periodo=factura.periodo,
+                         archivado=datetime.now().isoformat(timespec='seconds'))
+        vinculada.setdefault('grupo', entrada.get('rendicion'))
+        self._save_entry(clave_factura(factura), vinculada)
+        logger.info(f"Rendición {vinculada['rendicion']} de {factura.cliente} vinculada al comprobante {entrada['objeto']}")
+        return vinculada
+
+    def _publish(self, objeto, sha256, destino_folder, nombre):
+        """
+        Publica una copia del objeto con nombre legible en la carpeta destino.
+
+        Si ya existe un archivo con ese nombre y el mismo contenido no se hace
+        nada; si el contenido es distinto no se pisa, se agrega un sufijo (n).
+        """
+        os.makedirs(destino_folder, exist_ok=True)
+        destino = Path(destino_folder) / nombre
+        base, ext = os.path.splitext(nombre)
+
+        n = 1
+        while destino.exists():
+            if self._hash_file(destino) == sha256:
+                return destino
+            n += 1
+            destino = Path(destino_folder) / f"{base} ({n}){ext}"
+
+        if n > 1:
+            logger.warning(f"Ya existía otro comprobante con el nombre '{nombre}', se publica como '{destino.name}'")
+
+        shutil.copy2(objeto, destino)
+        return destino
@@ -0,0 +1,126 @@
+"""
+Benchmark del modo con ventana contra el modo headless liviano.
+
+Para cada modo abre varias sesiones de Chrome con BrowserManager, recorre una
+lista de URLs y mide el tiempo de cada transición de página (driver.get hasta
+document.readyState == 'complete') y la memoria residente de la sesión.
+
+Las URLs se recorren en la pestaña inicial y en una pestaña abierta con
+window.open, como la de Comprobantes en Línea donde transcurre el asistente:
+la configuración CDP (p. ej. el bloqueo de recursos) se aplica por pestaña.
+
+Uso:
+    python benchmarks/bench_browser_modes.py [--sessions 3] [--url URL ...] [--output resultado.json]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from browser_manager import BrowserManager  # noqa: E402
+
+DEFAULT_URLS = [
+    "https://auth.afip.gob.ar/contribuyente_/login.xhtml",
+    "https://www.afip.gob.ar/sitio/externos/default.asp",
+]
+
+MODES = {
+    'headed': dict(headless=False, block_resources=False),
+    'headless_light': dict(headless=True, block_resources=True),
+}
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure_transitions(driver, urls, rounds):
+    """Recorre las URLs en la pestaña actual y devuelve el tiempo de cada transición"""
+    transitions = []
+    for _ in range(rounds):
+        for url in urls:
+            t0 = time.perf_counter()
+            driver.get(url)
+            while driver.execute_script("return document.readyState") != "complete":
+                time.sleep(0.05)
+            transitions.append(time.perf_counter() - t0)
+    return transitions
+
+
+def run_session(mode_kwargs, urls, rounds):
+    """Abre una sesión, recorre las URLs en la pestaña inicial y en una nueva y devuelve tiempos y memoria"""
+    browser = BrowserManager(**mode_kwargs)
+    inicio = time.perf_counter()
+    driver, _ = browser.setup_driver()
+    startup = time.perf_counter() - inicio
+
+    try:
+        transitions = measure_transitions(driver, urls, rounds)
+        # Pestaña nueva, como la que abre 'Comprobantes en Línea' en iniciar_sesion
+        driver.execute_script("window.open('about:blank');")
+        driver.switch_to.window(driver.window_handles[-1])
+        browser.apply_to_current_tab(driver)
+        new_tab = measure_transitions(driver, urls, rounds)
+        memory = browser.memory_usage()
+    finally:
+        browser.close_browser()
+
+    return {'startup_s': startup, 'transitions_s': transitions, 'new_tab_s': new_tab, 'rss_bytes': memory}
+
+
+def summarize(sessions):
+    """Resume los resultados de todas las sesiones de un modo"""
+    transitions = [t for s in sessions for t in s['transitions_s']]
+    new_tab = [t for s in sessions for t in s['new_tab_s']]
+    memories = [s['rss_bytes'] for s in sessions if s['rss_bytes']]
+    return {
+        'sessions': len(sessions),
+        'startup_mean_s': statistics.mean(s['startup_s'] for s in sessions),
+        'transition_p50_s': percentile(transitions, 50),
+        'transition_p95_s': percentile(transitions, 95),
+        'transition_max_s': max(transitions) if transitions else None,
+        'new_tab_p50_s': percentile(new_tab, 50),
+        'new_tab_p95_s': percentile(new_tab, 95),
+        'rss_mean_mb': statistics.mean(memories) / 2**20 if memories else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=3, help="Sesiones por modo")
+    parser.add_argument('--rounds', type=int, default=3, help="Vueltas sobre la lista de URLs por sesión")
+    parser.add_argument('--url', action='append', dest='urls', help="URL a recorrer (repetible)")
+    parser.add_argument('--mode', action='append', choices=list(MODES), help="Modo a medir (por defecto ambos)")
+    parser.add_argument('--output', help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    urls = args.urls or DEFAULT_URLS
+    results = {}
+    for mode in args.mode or list(MODES):
+        sessions = [run_session(MODES[mode], urls, args.rounds) for _ in range(args.sessions)]
+        results[mode] = summarize(sessions)
+
+    print(f"{'modo':<16}{'inicio':>10}{'p50':>10}{'p95':>10}{'max':>10}"
+          f"{'nueva p50':>11}{'nueva p95':>11}{'RSS MB':>10}")
+    for mode, r in results.items():
+        rss = f"{r['rss_mean_mb']:.0f}" if r['rss_mean_mb'] else '-'
+        print(f"{mode:<16}{r['startup_mean_s']:>10.2f}{r['transition_p50_s']:>10.3f}"
+              f"{r['transition_p95_s']:>10.3f}{r['transition_max_s']:>10.3f}"
+              f"{r['new_tab_p50_s']:>11.3f}{r['new_tab_p95_s']:>11.3f}{rss:>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'urls': urls, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
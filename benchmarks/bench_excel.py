@@ -0,0 +1,142 @@
+"""
+Microbenchmarks de ExcelHandler: carga, pendientes, validación y marcado.
+
+Genera Excel sintéticos (1k, 10k y 100k filas por defecto) y mide por
+separado, con tiempo y pico de memoria (tracemalloc):
+
+    load_excel                 carga con pandas + openpyxl
+    get_facturas_pendientes    armado de FacturaData de las filas pendientes
+    validate_factura_data      validación de todas las facturas pendientes
+    marcar_como_realizada      N llamadas consecutivas (cada una guarda el libro)
+
+Otras implementaciones del ledger con la misma interfaz se comparan lado a
+lado con --impl modulo:Clase (repetible).
+
+La salida por consola de ExcelHandler se descarta durante las mediciones
+(--keep-output para incluirla).
+
+Uso:
+    python benchmarks/bench_excel.py --sizes 1000 10000 --marks 20 --impl mi_ledger:SqliteLedger
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from ledger_sintetico import crear_ledger  # noqa: E402
+
+
+def load_impl(spec):
+    """Importa una implementación indicada como 'modulo:Clase'"""
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def default_impls():
+    from excel_handler import ExcelHandler
+    return {'ExcelHandler': ExcelHandler}
+
+
+def measure(fn, keep_output=False):
+    """Ejecuta fn y devuelve (resultado, segundos, pico de memoria en bytes)"""
+    salida = contextlib.nullcontext() if keep_output else contextlib.redirect_stdout(io.StringIO())
+    tracemalloc.start()
+    try:
+        with salida:
+            inicio = time.perf_counter()
+            resultado = fn()
+            segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resultado, segundos, pico
+
+
+def bench_impl(cls, template, workdir, marks, keep_output):
+    """Mide todas las operaciones de una implementación sobre una copia del Excel"""
+    path = Path(workdir) / f"{cls.__name__}_{Path(template).name}"
+    shutil.copy(template, path)
+    ledger = cls(str(path))
+    r = {}
+
+    ok, r['load_s'], r['load_peak_mb'] = measure(ledger.load_excel, keep_output)
+    if not ok:
+        raise RuntimeError(f"{cls.__name__} no pudo cargar {path}")
+
+    facturas, r['pendientes_s'], r['pendientes_peak_mb'] = measure(ledger.get_facturas_pendientes, keep_output)
+    r['pendientes'] = len(facturas)
+
+    _, r['validate_s'], r['validate_peak_mb'] = measure(
+        lambda: [ledger.validate_factura_data(f) for f in facturas], keep_output)
+    r['validate_per_row_us'] = r['validate_s'] / max(1, len(facturas)) * 1e6
+
+    tiempos = []
+    salida = contextlib.nullcontext() if keep_output else contextlib.redirect_stdout(io.StringIO())
+    tracemalloc.start()
+    try:
+        with salida:
+            for factura in facturas[:marks]:
+                inicio = time.perf_counter()
+                ledger.marcar_como_realizada(factura)
+                tiempos.append(time.perf_counter() - inicio)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    r['marcar_calls'] = len(tiempos)
+    r['marcar_mean_s'] = statistics.mean(tiempos) if tiempos else None
+    r['marcar_max_s'] = max(tiempos) if tiempos else None
+    r['marcar_peak_mb'] = pico
+
+    for clave in [k for k in r if k.endswith('_peak_mb')]:
+        r[clave] = r[clave] / 2**20
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks de carga, validación y marcado del Excel")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--marks', type=int, default=20, help="Llamadas a marcar_como_realizada por tamaño")
+    parser.add_argument('--impl', action='append', default=[], help="Implementación extra 'modulo:Clase'")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep-output', action='store_true', help="No descartar los print de las implementaciones")
+    parser.add_argument('--output', help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    impls = default_impls()
+    for spec in args.impl:
+        impls[spec] = load_impl(spec)
+
+    resultados = {}
+    with tempfile.TemporaryDirectory(prefix="bench_excel_") as workdir:
+        for filas in args.sizes:
+            template = crear_ledger(Path(workdir) / f"ledger_{filas}.xlsx", filas, seed=args.seed)
+            for nombre, cls in impls.items():
+                r = bench_impl(cls, template, workdir, args.marks, args.keep_output)
+                resultados.setdefault(str(filas), {})[nombre] = r
+
+    cabecera = f"{'filas':>7} {'implementación':<24}{'load':>9}{'pend.':>9}{'valid.':>9}{'marcar':>9}{'pico MB':>9}"
+    print(cabecera)
+    for filas, por_impl in resultados.items():
+        for nombre, r in por_impl.items():
+            pico = max(v for k, v in r.items() if k.endswith('_peak_mb'))
+            print(f"{filas:>7} {nombre[:23]:<24}{r['load_s']:>9.3f}{r['pendientes_s']:>9.3f}"
+                  f"{r['validate_s']:>9.3f}{(r['marcar_mean_s'] or 0):>9.3f}{pico:>9.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark de punta a punta del flujo de facturación contra el portal simulado.
+
+Para cada tamaño de Excel sintético (10, 100 y 1000 filas por defecto) inicia
+PortalSimulado, abre Chrome headless con BrowserManager, inicia sesión y corre
+main.facturar sobre el Excel. Reporta facturas por minuto, histogramas de
+latencia por etapa (checkpoints de StepProfiler), comandos WebDriver por
+factura y pico de memoria (proceso Python y navegador).
+
+Cada corrida se guarda en benchmarks/results/ y se compara con la línea base
+de benchmarks/baselines/pipeline.json (se actualiza con --save-baseline).
+
+Nota: el flujo conserva sus esperas fijas (unos 40 s por factura), así que el
+tamaño de 1000 filas lleva horas; usar --sizes para elegir.
+
+Uso:
+    python benchmarks/bench_pipeline.py --sizes 10 100 --latency 0.05
+"""
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from ledger_sintetico import crear_ledger  # noqa: E402
+from portal_simulado import PortalSimulado  # noqa: E402
+from step_profiler import StepProfiler, percentile  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "pipeline.json"
+BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+REGRESSION_THRESHOLD = 0.10
+
+
+def histogram(values):
+    """Histograma acumulado por buckets de segundos (estilo Prometheus)"""
+    counts = {f"le_{b}": sum(1 for v in values if v <= b) for b in BUCKETS}
+    counts['le_inf'] = len(values)
+    return counts
+
+
+class MemorySampler:
+    """Muestrea en segundo plano la memoria del navegador y guarda el máximo"""
+
+    def __init__(self, browser, interval=1.0):
+        self.browser = browser
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.browser.memory_usage()
+            if rss:
+                self.peak = max(self.peak, rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_size(filas, args, workdir):
+    """Corre el flujo completo sobre un Excel de 'filas' filas"""
+    import main as flujo
+    from archive_handler import ComprobanteArchive
+    from browser_manager import BrowserManager
+    from excel_handler import ExcelHandler
+
+    workdir = Path(workdir)
+    ledger = crear_ledger(workdir / f"ledger_{filas}.xlsx", filas, seed=args.seed)
+    downloads = workdir / "descargas"
+    downloads.mkdir()
+
+    t0 = time.perf_counter()
+    handler = ExcelHandler(ledger)
+    handler.load_excel()
+    ledger_load_s = time.perf_counter() - t0
+
+    portal = PortalSimulado(latency=args.latency, jitter=args.jitter,
+                            failure_rate=args.failure_rate, seed=args.seed)
+    profiler = StepProfiler()
+    browser = BrowserManager(headless=not args.headed, download_dir=str(downloads))
+
+    with portal:
+        driver, _ = browser.setup_driver()
+        profiler.instrument_driver(driver)
+        try:
+            with MemorySampler(browser) as memoria:
+                flujo.iniciar_sesion(driver, "20000000001", "simulada", portal.login_url, browser=browser)
+                inicio = time.perf_counter()
+                flujo.facturar(driver, excel_path=ledger, profiler=profiler,
+                               downloads_folder=str(downloads),
+                               destino_folder=str(workdir / "destino"),
+                               archive=ComprobanteArchive(workdir / "archivo"))
+                elapsed = time.perf_counter() - inicio
+        finally:
+            browser.close_browser()
+        emitidos = len(portal.comprobantes)
+
+    por_etapa = {}
+    for r in profiler.records:
+        por_etapa.setdefault(r['step'], []).append(r['wall_s'])
+    exitosas = [i for i in profiler.invoices if i['ok']]
+
+    return {
+        'rows': filas,
+        'issued': emitidos,
+        'succeeded': len(exitosas),
+        'elapsed_s': elapsed,
+        'invoices_per_min': len(exitosas) / elapsed * 60 if elapsed else 0,
+        'ledger_load_s': ledger_load_s,
+        'invoice_p50_s': percentile([i['wall_s'] for i in exitosas], 50),
+        'invoice_p95_s': percentile([i['wall_s'] for i in exitosas], 95),
+        'webdriver_commands_per_invoice': (sum(i['commands'] for i in exitosas) / len(exitosas)
+                                           if exitosas else None),
+        'stages': {
+            etapa: {'p50_s': percentile(v, 50), 'p95_s': percentile(v, 95), 'max_s': max(v),
+                    'histogram': histogram(v)}
+            for etapa, v in sorted(por_etapa.items())
+        },
+        'peak_rss_python_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_browser_mb': memoria.peak / 2**20 if memoria.peak else None,
+        'portal_requests': portal.requests,
+    }
+
+
+def compare(result, baseline):
+    """Devuelve las métricas que empeoraron más que el umbral respecto de la línea base"""
+    regresiones = []
+    for size, actual in result['sizes'].items():
+        previo = baseline.get('sizes', {}).get(size)
+        if not previo:
+            continue
+        checks = [
+            ('invoices_per_min', True),
+            ('invoice_p95_s', False),
+            ('webdriver_commands_per_invoice', False),
+        ]
+        for metrica, mayor_es_mejor in checks:
+            a, b = actual.get(metrica), previo.get(metrica)
+            if not a or not b:
+                continue
+            cambio = (b - a) / b if mayor_es_mejor else (a - b) / b
+            if cambio > REGRESSION_THRESHOLD:
+                regresiones.append(f"{size} filas: {metrica} {b:.2f} -> {a:.2f} ({cambio:+.0%})")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta del flujo de facturación")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.05, help="Latencia del portal simulado (s)")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--headed', action='store_true', help="Correr con ventana")
+    parser.add_argument('--save-baseline', action='store_true', help="Guardar el resultado como línea base")
+    args = parser.parse_args()
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {k: v for k, v in vars(args).items() if k != 'save_baseline'},
+        'sizes': {}
+    }
+    for filas in args.sizes:
+        with tempfile.TemporaryDirectory(prefix=f"bench_{filas}_") as workdir:
+            r = run_size(filas, args, workdir)
+        result['sizes'][str(filas)] = r
+        print(f"{filas:>6} filas: {r['invoices_per_min']:.2f} fact/min, "
+              f"p95 {r['invoice_p95_s'] or 0:.1f}s, "
+              f"{r['webdriver_commands_per_invoice'] or 0:.0f} comandos/factura, "
+              f"RSS navegador {r['peak_rss_browser_mb'] or 0:.0f} MB")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    salida = RESULTS_DIR / f"pipeline_{datetime.now():%Y%m%d_%H%M%S}.json"
+    salida.write_text(json.dumps(result, indent=2), encoding='utf-8')
+    print(f"Resultado guardado en {salida}")
+
+    if BASELINE_PATH.exists():
+        regresiones = compare(result, json.loads(BASELINE_PATH.read_text(encoding='utf-8')))
+        for r in regresiones:
+            print(f"REGRESIÓN: {r}")
+        if not regresiones:
+            print("Sin regresiones respecto de la línea base")
+
+    if args.save_baseline:
+        BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_PATH.write_text(json.dumps(result, indent=2), encoding='utf-8')
+        print(f"Línea base actualizada: {BASELINE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
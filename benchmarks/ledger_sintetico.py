@@ -0,0 +1,58 @@
+"""
+Generación de Excel sintéticos con la misma forma que facturador_template.xlsx.
+
+Columnas: Cliente, CUIT, Cond_IVA, Importe, IVA, TOTAL, Rendicion, Fecha,
+Periodo, Realizado.
+"""
+import random
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+COLUMNAS = ['Cliente', 'CUIT', 'Cond_IVA', 'Importe', 'IVA', 'TOTAL',
+            'Rendicion', 'Fecha', 'Periodo', 'Realizado']
+CONDICIONES = ['RI', 'M', 'CF', 'E']
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+         'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+
+def cuit_sintetico(rng):
+    """CUIT de 11 dígitos con prefijo de persona o empresa"""
+    return f"{rng.choice(['20', '23', '27', '30', '33'])}{rng.randrange(10**8):08d}{rng.randrange(10)}"
+
+
+def crear_ledger(path, filas, seed=0, clientes=None, realizadas=0.0):
+    """
+    Crea un Excel sintético.
+
+    Args:
+        path: ruta del archivo a crear
+        filas: cantidad de filas de facturas
+        seed: semilla para que el archivo sea reproducible
+        clientes: cantidad de clientes distintos (por defecto filas // 5, mínimo 1)
+        realizadas: fracción de filas ya marcadas como realizadas
+
+    Returns:
+        str: la ruta creada
+    """
+    rng = random.Random(seed)
+    clientes = clientes or max(1, filas // 5)
+    padron = [(f"CLIENTE SINTETICO {i:05d}", cuit_sintetico(rng), rng.choice(CONDICIONES))
+              for i in range(clientes)]
+    base = datetime(2024, 12, 1)
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(COLUMNAS)
+    for i in range(filas):
+        cliente, cuit, cond_iva = padron[i % clientes]
+        importe = round(rng.uniform(1000, 250000), 2)
+        iva = round(importe * 0.21, 2) if cond_iva not in ('RI', 'M') else 0
+        fecha = base + timedelta(days=rng.randrange(28))
+        ws.append([
+            cliente, cuit, cond_iva, importe, iva, round(importe + iva, 2),
+            10000 + i, fecha, f"{MESES[fecha.month - 1]} {fecha.year}",
+            '✓' if rng.random() < realizadas else None
+        ])
+    wb.save(path)
+    return str(path)
@@ -7,26 +7,44 @@ from selenium.webdriver.support import expected_conditions as EC
 import random
 import time
 import logging
-
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('browser_manager.log'),
-        logging.StreamHandler()
-    ]
-)
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Recursos que no hacen falta para completar el asistente de facturación
+BLOCKED_URL_PATTERNS = [
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*hotjar.com*', '*facebook.net*'
+]
+
 class BrowserManager:
     """
     Clase para manejar la configuración y gestión del navegador Chrome.
     Proporciona métodos para inicializar y configurar el navegador de manera segura.
     """
     
-    def __init__(self):
+    def __init__(self, headless=False, block_resources=None, download_dir=None,
+                 max_memory_mb=2048, max_session_age=45 * 60, max_error_rate=0.3, error_window=10):
+        """
+        Inicializa el administrador del navegador.
+
+        Args:
+            headless: si es True Chrome se ejecuta sin ventana (modo lote)
+            block_resources: bloquea imágenes, fuentes y analítica (por defecto igual a headless)
+            download_dir: carpeta de descargas de los PDF (obligatoria en la práctica en headless)
+            max_memory_mb: memoria de Chrome a partir de la cual conviene reciclarlo
+            max_session_age: segundos de sesión a partir de los cuales conviene reciclarlo
+            max_error_rate: proporción de facturas fallidas (en error_window) que dispara el reciclado
+            error_window: cantidad de facturas recientes consideradas para la tasa de error
+        """
+        self.headless = headless
+        self.block_resources = headless if block_resources is None else block_resources
+        self.download_dir = download_dir
         self.user_agents = [
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -36,6 +54,17 @@ class BrowserManager:
         ]
         self.driver = None
         self.wait = None
+        self.started_at = None
+        self.max_memory_mb = max_memory_mb
+        self.max_session_age = max_session_age
+        self.max_error_rate = max_error_rate
+        self.recent_results = deque(maxlen=error_window)
+        self.recycles = 0
+        self._recycle_reason = None
+        self._standby_login = None
+        self._standby_check = None
+        self._standby = None
+        self._standby_executor = None
 
     def setup_driver(self, wait_time=10):
         """
@@ -48,21 +77,14 @@ class BrowserManager:
             tuple: (WebDriver, WebDriverWait)
         """
         try:
-            logger.info("Iniciando configuración del navegador...")
-            
-            options = self._configure_chrome_options()
-            service = Service(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=options)
-            
-            # Configurar el tamaño de la ventana y maximizar
-            driver.set_window_size(1920, 1080)
-            driver.maximize_window()
+            driver = self._launch()
             
             # Configurar wait global
             wait = WebDriverWait(driver, wait_time)
             
             self.driver = driver
             self.wait = wait
+            self.started_at = time.monotonic()
             
             logger.info("Navegador configurado exitosamente")
             return driver, wait
@@ -71,23 +93,76 @@ class BrowserManager:
             logger.error(f"Error configurando el navegador: {str(e)}")
             raise
 
-    def _configure_chrome_options(self):
+    @property
+    def user_agent(self):
+        """User-agent del navegador actual (None si no hay navegador)"""
+        return getattr(self.driver, 'launch_user_agent', None)
+
+    def _launch(self):
+        """
+        Inicia un Chrome configurado, sin asignarlo como navegador actual.
+
+        El user-agent elegido queda en el propio driver (launch_user_agent): la
+        reserva se lanza en otro hilo y no debe cambiar el del navegador actual.
+        """
+        logger.info("Iniciando configuración del navegador...")
+
+        user_agent = random.choice(self.user_agents)
+        options = self._configure_chrome_options(user_agent)
+        service = Service(ChromeDriverManager().install())
+        driver = webdriver.Chrome(service=service, options=options)
+        driver.launch_user_agent = user_agent
+
+        # Configurar el tamaño de la ventana (en headless no hay ventana que maximizar)
+        driver.set_window_size(1920, 1080)
+        if not self.headless:
+            driver.maximize_window()
+
+        self.apply_to_current_tab(driver)
+        return driver
+
+    def _configure_chrome_options(self, user_agent):
         """
         Configura las opciones de Chrome para evitar detección de automatización.
+
+        Args:
+            user_agent: user-agent con el que se lanza este navegador
         
         Returns:
             ChromeOptions: Opciones configuradas
         """
         options = webdriver.ChromeOptions()
-        user_agent = random.choice(self.user_agents)
         
         # Configuraciones básicas
         options.add_argument(f'user-agent={user_agent}')
         options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_argument('--start-maximized')
         options.add_argument('--disable-extensions')
         options.add_argument('--disable-popup-blocking')
         options.add_argument('--disable-infobars')
+
+        if self.headless:
+            # Mismo tamaño de ventana que el modo con ventana para no cambiar la huella
+            options.add_argument('--headless=new')
+            options.add_argument('--window-size=1920,1080')
+            options.add_argument('--disable-gpu')
+            options.add_argument('--disable-dev-shm-usage')
+        else:
+            options.add_argument('--start-maximized')
+
+        # Consola del navegador disponible con driver.get_log('browser') para diagnóstico
+        options.set_capability('goog:loggingPrefs', {'browser': 'ALL'})
+
+        prefs = {}
+        if self.download_dir:
+            prefs.update({
+                'download.default_directory': str(self.download_dir),
+                'download.prompt_for_download': False,
+                'plugins.always_open_pdf_externally': True
+            })
+        if self.block_resources:
+            prefs['profile.managed_default_content_settings.images'] = 2
+        if prefs:
+            options.add_experimental_option('prefs', prefs)
         
         # Configuraciones experimentales
         options.add_experimental_option('excludeSwitches', ['enable-automation'])
@@ -95,6 +170,289 @@ class BrowserManager:
         
         return options
 
+    def apply_to_current_tab(self, driver=None):
+        """
+        Aplica por CDP la configuración anti-detección, descargas y bloqueo de recursos.
+
+        Se aplica igual en ambos modos para que la sesión headless presente el
+        mismo user-agent (sin 'HeadlessChrome') y el mismo navigator.webdriver.
+        Los comandos CDP solo afectan a la pestaña actual: hay que repetirlo
+        después de cambiar a una pestaña nueva (p. ej. la de Comprobantes en Línea).
+
+        Args:
+            driver: WebDriver a configurar (por defecto el navegador actual)
+        """
+        driver = driver or self.driver
+        # El mismo user-agent con que se lanzó este driver, no el del último lanzado
+        driver.execute_cdp_cmd('Network.setUserAgentOverride', {"userAgent": driver.launch_user_agent})
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
+            'source': "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+        })
+
+        if self.headless and self.download_dir:
+            driver.execute_cdp_cmd('Page.setDownloadBehavior', {
+                'behavior': 'allow',
+                'downloadPath': str(self.download_dir)
+            })
+
+        if self.block_resources:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+            logger.info("Bloqueo de recursos no esenciales activado")
+
+    def session_age(self):
+        """Segundos desde que se inició el navegador actual (None si no hay navegador)"""
+        if self.driver is None or self.started_at is None:
+            return None
+        return time.monotonic() - self.started_at
+
+    def memory_usage(self):
+        """
+        Devuelve la memoria residente (bytes) de chromedriver y todos sus procesos hijos.
+
+        Usa psutil si está instalado; si no, lee /proc (solo Linux). El árbol
+        se recorre en cada llamada: Chrome abre procesos de renderizado nuevos
+        con cada pestaña y sitio, y deben contarse para reciclar a tiempo.
+
+        Returns:
+            int o None si no se puede medir
+        """
+        if not self.driver:
+            return None
+        pid = self.driver.service.process.pid
+        try:
+            import psutil
+            proc = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [proc] + proc.children(recursive=True))
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"No se pudo medir la memoria del navegador: {str(e)}")
+            return None
+
+        if not os.path.isdir('/proc'):
+            return None
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        total = 0
+        for actual in self._process_tree(pid):
+            try:
+                with open(f'/proc/{actual}/statm') as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, ValueError, IndexError):
+                pass
+        return total
+
+    @staticmethod
+    def _children(pid):
+        """
+        Hijos directos de pid según /proc/<pid>/task/*/children.
+
+        Returns:
+            list de pids, o None si el kernel no expone ese archivo
+        """
+        hijos = []
+        try:
+            tareas = os.listdir(f'/proc/{pid}/task')
+        except OSError:
+            return []
+        for tid in tareas:
+            try:
+                with open(f'/proc/{pid}/task/{tid}/children') as f:
+                    hijos.extend(int(h) for h in f.read().split())
+            except FileNotFoundError:
+                if not os.path.exists(f'/proc/{pid}/task/{tid}'):
+                    continue
+                return None
+            except (OSError, ValueError):
+                continue
+        return hijos
+
+    @classmethod
+    def _process_tree(cls, pid):
+        """
+        Pids de pid y todos sus descendientes, leídos de /proc.
+
+        Recorre solo el árbol de chromedriver; si el kernel no expone los
+        hijos de cada proceso se recorre /proc completo.
+        """
+        arbol, pendientes = [], [pid]
+        while pendientes:
+            actual = pendientes.pop()
+            hijos = cls._children(actual)
+            if hijos is None:
+                return cls._process_tree_full(pid)
+            arbol.append(actual)
+            pendientes.extend(hijos)
+        return arbol
+
+    @staticmethod
+    def _process_tree_full(pid):
+        """Pids de pid y todos sus descendientes, buscando el padre de cada proceso en /proc"""
+        hijos = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                hijos.setdefault(ppid, []).append(int(entry))
+            except (OSError, ValueError, IndexError):
+                continue
+        arbol, pendientes = [], [pid]
+        while pendientes:
+            actual = pendientes.pop()
+            arbol.append(actual)
+            pendientes.extend(hijos.get(actual, []))
+        return arbol
+
+    def record_result(self, ok):
+        """Registra el resultado de una factura emitida con este navegador"""
+        self.recent_results.append(bool(ok))
+
+    def health(self):
+        """
+        Estado de salud del navegador actual.
+
+        Returns:
+            dict: memory_mb, session_age (segundos) y error_rate (None si no se puede medir)
+        """
+        memoria = self.memory_usage()
+        resultados = self.recent_results
+        return {
+            'memory_mb': memoria / (1024 * 1024) if memoria is not None else None,
+            'session_age': self.session_age(),
+            'error_rate': (resultados.count(False) / len(resultados)) if resultados else None
+        }
+
+    def needs_recycle(self):
+        """
+        Indica si conviene reciclar el navegador antes de la próxima factura.
+
+        Returns:
+            str con el motivo, o None si el navegador está sano
+        """
+        if self._recycle_reason:
+            return self._recycle_reason
+        estado = self.health()
+        if self.max_memory_mb and estado['memory_mb'] is not None and estado['memory_mb'] > self.max_memory_mb:
+            return f"memoria {estado['memory_mb']:.0f} MB > {self.max_memory_mb} MB"
+        if self.max_session_age and estado['session_age'] is not None and estado['session_age'] > self.max_session_age:
+            return f"sesión de {estado['session_age']:.0f} s > {self.max_session_age} s"
+        # La tasa de error solo cuenta con la ventana completa, para no reciclar por una falla aislada
+        if (self.max_error_rate is not None and len(self.recent_results) == self.recent_results.maxlen
+                and estado['error_rate'] > self.max_error_rate):
+            return f"tasa de error {estado['error_rate']:.0%} > {self.max_error_rate:.0%}"
+        return None
+
+    def request_recycle(self, reason):
+        """Pide reciclar el navegador antes de la próxima factura (p. ej. sesión expirada)"""
+        self._recycle_reason = reason
+
+    def start_standby(self, login, check=None):
+        """
+        Mantiene una sesión de reserva lista para reemplazar a la actual.
+
+        La reserva se abre e inicia sesión en segundo plano y queda esperando en
+        el menú principal; recycle() la usa en lugar de abrir un navegador
+        desde cero. Ocupa la memoria de un segundo Chrome.
+
+        Args:
+            login: función que recibe un driver nuevo y lo deja en el menú principal
+            check: función que recibe el driver de reserva y confirma que la
+                   sesión sigue activa antes de usarlo (opcional)
+        """
+        self._standby_login = login
+        self._standby_check = check
+        self._standby_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reserva')
+        self._prepare_standby()
+
+    def _prepare_standby(self):
+        """Lanza en segundo plano la construcción de una nueva sesión de reserva"""
+        self._standby = self._standby_executor.submit(self._build_standby)
+
+    def _build_standby(self):
+        driver = self._launch()
+        try:
+            self._standby_login(driver)
+        except Exception:
+            self._quit_quietly(driver)
+            raise
+        logger.info("Sesión de reserva lista")
+        return driver, time.monotonic()
+
+    def has_standby(self):
+        """Indica si hay una sesión de reserva lista para usar"""
+        futuro = self._standby
+        return futuro is not None and futuro.done() and futuro.exception() is None
+
+    def _take_standby(self):
+        """
+        Devuelve la sesión de reserva si está lista y activa, o None.
+
+        No espera a una reserva que todavía se está construyendo.
+        """
+        futuro = self._standby
+        if futuro is None or not futuro.done():
+            return None
+        self._standby = None
+        try:
+            driver, started_at = futuro.result()
+        except Exception as e:
+            logger.warning(f"La sesión de reserva no se pudo preparar: {str(e)}")
+            return None
+        if self._standby_check and not self._standby_check(driver):
+            logger.warning("La sesión de reserva expiró, se descarta")
+            self._quit_quietly(driver)
+            return None
+        return driver, started_at
+
+    @staticmethod
+    def _quit_quietly(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def recycle(self, login=None):
+        """
+        Reemplaza el navegador actual por uno nuevo.
+
+        Si hay una sesión de reserva lista se cambia a ella al instante y el
+        navegador anterior se cierra en segundo plano; si no, se abre uno nuevo
+        y se inicia sesión.
+
+        Args:
+            login: función que recibe el driver nuevo y lo deja autenticado en el
+                   menú principal (opcional)
+
+        Returns:
+            WebDriver nuevo
+        """
+        anterior = self.driver
+        self.recent_results.clear()
+        self._recycle_reason = None
+
+        reserva = self._take_standby() if self._standby_executor else None
+        if reserva is not None:
+            self.driver, self.started_at = reserva
+            self.wait = WebDriverWait(self.driver, 10)
+            if anterior is not None:
+                # Un Chrome colgado puede tardar en cerrar: no bloquear al worker
+                threading.Thread(target=self._quit_quietly, args=(anterior,), daemon=True).start()
+            logger.info("Se cambió a la sesión de reserva")
+        else:
+            self.close_browser()
+            self.driver = None
+            driver, _ = self.setup_driver()
+            if login:
+                login(driver)
+
+        if self._standby_executor and self._standby is None:
+            self._prepare_standby()
+        self.recycles += 1
+        logger.info(f"Navegador reciclado ({self.recycles} en esta ejecución)")
+        return self.driver
+
     def navigate_to(self, url, retry_count=3):
         """
         Navega a una URL de forma segura con reintentos.
@@ -174,10 +532,22 @@ class BrowserManager:
         try:
             if self.driver:
                 self.driver.quit()
+                self.started_at = None
                 logger.info("Navegador cerrado exitosamente")
         except Exception as e:
             logger.error(f"Error cerrando el navegador: {str(e)}")
 
+    def close_standby(self):
+        """Cierra la sesión de reserva (esperando si todavía se está preparando)"""
+        if self._standby_executor is None:
+            return
+        futuro, self._standby = self._standby, None
+        self._standby_executor.shutdown(wait=True)
+        self._standby_executor = None
+        if futuro is not None and futuro.exception() is None:
+            self._quit_quietly(futuro.result()[0])
+            logger.info("Sesión de reserva cerrada")
+
     def __enter__(self):
         """Soporte para uso con 'with' statement"""
         self.setup_driver()
@@ -185,6 +555,7 @@ class BrowserManager:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Cierra el navegador al salir del contexto"""
+        self.close_standby()
         self.close_browser()
 
     def take_screenshot(self, filename):
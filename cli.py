@@ -0,0 +1,244 @@
+"""
+Línea de comandos de la facturación.
+
+    python cli.py issue [--workers N] [--limit N] [--rows 5,7-9] [--headless]
+    python cli.py validate [LEDGER]
+    python cli.py dry-run [--workers N] [--limit N] [--rows ...]
+    python cli.py resume
+    python cli.py bench [pipeline|excel|browser-modes] [-- opciones del benchmark]
+
+Todos los subcomandos aceptan las opciones de configuración (--config,
+--profile, --empresa, --cuit, ...; ver config.py). Selenium y pandas se
+importan recién dentro del subcomando que los usa: validate no abre el
+navegador y --help responde al instante.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import config
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {
+    'pipeline': 'bench_pipeline.py',
+    'excel': 'bench_excel.py',
+    'browser-modes': 'bench_browser_modes.py',
+}
+
+
+def parse_rows(texto):
+    """
+    Convierte una lista de filas del Excel ("5,7-9") en un conjunto.
+
+    Raises:
+        argparse.ArgumentTypeError: formato inválido
+    """
+    filas = set()
+    try:
+        for parte in texto.split(','):
+            parte = parte.strip()
+            if not parte:
+                continue
+            if '-' in parte:
+                desde, hasta = (int(x) for x in parte.split('-', 1))
+                if desde > hasta:
+                    raise ValueError(parte)
+                filas.update(range(desde, hasta + 1))
+            else:
+                filas.add(int(parte))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Filas inválidas: '{texto}' (usar p. ej. 5,7-9)")
+    if not filas:
+        raise argparse.ArgumentTypeError("No se indicó ninguna fila")
+    return frozenset(filas)
+
+
+def _pendientes(ledger):
+    """
+    Filas pendientes del Excel y las descartadas por InvoiceRequeue.
+
+    Returns:
+        tuple: (ExcelHandler, pendientes a emitir, descartadas)
+    """
+    from excel_handler import ExcelHandler
+    from invoice_requeue import InvoiceRequeue
+
+    excel_handler = ExcelHandler(ledger)
+    if not excel_handler.load_excel():
+        raise RuntimeError(f"No se pudo cargar el archivo Excel {ledger}")
+    requeue = InvoiceRequeue.for_ledger(ledger)
+    pendientes = excel_handler.get_facturas_pendientes()
+    descartadas = [f for f in pendientes if requeue.is_dead(f)]
+    return excel_handler, [f for f in pendientes if not requeue.is_dead(f)], descartadas
+
+
+def seleccionar_filas(ledger, rows=None, limit=None):
+    """
+    Resuelve --rows y --limit a las filas del Excel a emitir.
+
+    El límite se aplica de antemano sobre las filas pendientes, así varios
+    workers reparten exactamente esas filas entre sí.
+
+    Returns:
+        frozenset de números de fila, o None para emitir todas las pendientes
+    """
+    if rows is None and limit is None:
+        return None
+    _, pendientes, _ = _pendientes(ledger)
+    filas = [f.row_index for f in pendientes if rows is None or f.row_index in rows]
+    if rows is not None and len(filas) < len(rows):
+        logger.warning(f"Filas no pendientes (ya realizadas, descartadas o inexistentes): "
+                       f"{sorted(rows - set(filas))}")
+    if limit is not None:
+        filas = filas[:limit]
+    return frozenset(filas)
+
+
+def cmd_issue(args, configuracion, dry_run=False):
+    """Emite (o con dry_run, solo completa) las facturas pendientes de la empresa"""
+    if not configuracion.has_credentials:
+        raise SystemExit("Definir AFIP_CUIT y AFIP_PASSWORD (variables de entorno o archivo .env)")
+    from log_config import configure_logging
+    import metrics
+
+    configure_logging(log_file='facturacion_simulacro.log' if dry_run else 'facturacion.log')
+    if args.metrics_port is not None:
+        metrics.enable(args.metrics_port)
+
+    empresa = configuracion.empresa()
+    rows = seleccionar_filas(empresa.ledger, args.rows, args.limit)
+    if rows is not None and not rows:
+        logger.info("No hay filas pendientes para las opciones indicadas")
+        return 0
+
+    from orchestrator import Job, Orchestrator
+
+    job = Job(configuracion.cuit, configuracion.password, empresa, configuracion.login_url, rows)
+    headless = configuracion.headless if args.headless is None else args.headless
+    # El mismo trabajo una vez por worker: las reservas del Excel reparten las filas
+    resultados = Orchestrator([job] * args.workers, workers=args.workers, headless=headless,
+                              agrupar=args.agrupar, downloads_folder=configuracion.downloads,
+                              dry_run=dry_run, profile=dry_run).run()
+    return 1 if any(isinstance(r, Exception) for r in resultados.values()) else 0
+
+
+def cmd_dry_run(args, configuracion):
+    return cmd_issue(args, configuracion, dry_run=True)
+
+
+def cmd_validate(args, configuracion):
+    """Valida el Excel sin abrir el navegador"""
+    from invoice_journal import InvoiceJournal
+    import invoice_journal
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    ledger = args.ledger or configuracion.empresa().ledger
+    try:
+        excel_handler, pendientes, descartadas = _pendientes(ledger)
+    except RuntimeError as e:
+        logger.error(str(e))
+        return 2
+    # get_facturas_pendientes ya saltea las filas inválidas y las deja con su motivo
+    invalidas = excel_handler.rechazadas
+    if args.rows is not None:
+        pendientes = [f for f in pendientes if f.row_index in args.rows]
+        invalidas = [r for r in invalidas if r[0] in args.rows]
+
+    journal = InvoiceJournal.for_ledger(ledger)
+    a_medias = [f for f in pendientes if journal.state(f) != invoice_journal.PENDING]
+
+    print(f"{ledger}: {len(pendientes)} fila(s) pendiente(s) válida(s), {len(invalidas)} inválida(s), "
+          f"{len(descartadas)} descartada(s), {len(a_medias)} a medio emitir")
+    for fila, cliente, motivo in invalidas:
+        print(f"  fila {fila}: {cliente} no se puede emitir: {motivo}")
+    for factura in descartadas:
+        print(f"  fila {factura.row_index}: {factura.cliente} descartada tras fallar (ver .rechazadas.csv)")
+    if a_medias:
+        print("  Ejecutar 'resume' para recuperar las filas a medio emitir")
+    return 1 if invalidas else 0
+
+
+def cmd_resume(args, configuracion):
+    """Recupera desde el journal lo que quedó a medias, sin navegador"""
+    from invoice_recovery import reanudar_ledger
+    from log_config import configure_logging
+
+    configure_logging()
+    recuperadas, pendientes = reanudar_ledger(configuracion.empresa())
+    if pendientes:
+        logger.info(f"Quedan {pendientes} fila(s) para emitir con 'issue'")
+    return 0
+
+
+def cmd_bench(args, configuracion):
+    """Corre uno de los benchmarks de benchmarks/ con sus propias opciones"""
+    import runpy
+
+    script = Path(__file__).resolve().parent / "benchmarks" / BENCHMARKS[args.benchmark]
+    opciones = args.opciones[1:] if args.opciones[:1] == ['--'] else args.opciones
+    sys.argv = [str(script), *opciones]
+    runpy.run_path(str(script), run_name='__main__')
+    return 0
+
+
+def build_parser():
+    comun = argparse.ArgumentParser(add_help=False)
+    config.add_arguments(comun)
+
+    emision = argparse.ArgumentParser(add_help=False)
+    emision.add_argument('--workers', type=int, default=1, help="Navegadores en paralelo sobre el mismo Excel")
+    emision.add_argument('--limit', type=int, help="Emitir como máximo N filas pendientes")
+    emision.add_argument('--rows', type=parse_rows, help="Solo estas filas del Excel (p. ej. 5,7-9)")
+    emision.add_argument('--headless', action=argparse.BooleanOptionalAction, default=None,
+                         help="Chrome sin ventana (por defecto según la configuración)")
+    emision.add_argument('--agrupar', action='store_true',
+                         help="Un comprobante por cliente y periodo, una línea por rendición")
+    emision.add_argument('--metrics-port', type=int, help="Exponer métricas Prometheus en este puerto local")
+
+    parser = argparse.ArgumentParser(description="Facturación automática en Comprobantes en Línea")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    issue = subparsers.add_parser('issue', parents=[comun, emision], help="Emitir las facturas pendientes")
+    issue.set_defaults(func=cmd_issue)
+
+    dry_run = subparsers.add_parser('dry-run', parents=[comun, emision],
+                                    help="Completar los formularios sin confirmar (para medir tiempos)")
+    dry_run.set_defaults(func=cmd_dry_run)
+
+    validate = subparsers.add_parser('validate', parents=[comun], help="Validar el Excel sin abrir el navegador")
+    validate.add_argument('ledger', nargs='?', help="Excel a validar (por defecto el de la empresa)")
+    validate.add_argument('--rows', type=parse_rows, help="Solo estas filas del Excel (p. ej. 5,7-9)")
+    validate.set_defaults(func=cmd_validate)
+
+    resume = subparsers.add_parser('resume', parents=[comun],
+                                   help="Recuperar del journal las facturas que quedaron a medio emitir")
+    resume.set_defaults(func=cmd_resume)
+
+    bench = subparsers.add_parser('bench', help="Correr un benchmark contra el portal simulado")
+    bench.add_argument('benchmark', nargs='?', choices=sorted(BENCHMARKS), default='pipeline')
+    bench.add_argument('opciones', nargs=argparse.REMAINDER, help="Opciones del benchmark (después de --)")
+    bench.set_defaults(func=cmd_bench)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.comando == 'bench':
+        configuracion = None
+    else:
+        try:
+            configuracion = config.from_args(args)
+        except (OSError, ValueError, RuntimeError) as e:
+            parser.error(str(e))
+    if getattr(args, 'workers', 1) < 1:
+        parser.error("--workers debe ser al menos 1")
+    if getattr(args, 'limit', None) is not None and args.limit < 1:
+        parser.error("--limit debe ser al menos 1")
+    return args.func(args, configuracion)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Configuración de la facturación: credenciales, empresas representadas y carpetas.
+
+Se carga una vez al iniciar; cada fuente pisa a las anteriores:
+
+    1. valores por defecto de este módulo
+    2. archivo TOML (--config, AFIP_CONFIG o facturacion.toml si existe)
+    3. el perfil elegido dentro del archivo ([profiles.<nombre>], --profile o AFIP_PROFILE)
+    4. variables de entorno AFIP_* (también desde un .env si está instalado python-dotenv)
+    5. opciones de línea de comandos
+
+Ejemplo de facturacion.toml:
+
+    downloads = "~/Downloads"
+
+    [[empresas]]
+    nombre = "LAZZARINI&LAZZARINI S.R.L."
+    ledger = "facturador_test.xlsx"
+    destino = "~/Desktop/Facturas_NOV"
+
+    [[empresas]]
+    nombre = "OTRA EMPRESA S.A."
+    punto_venta = "2"
+    ledger = "otra_empresa.xlsx"
+    destino = "~/Desktop/Facturas_OTRA"
+
+    [profiles.simulado]
+    login_url = "http://127.0.0.1:8800/contribuyente_/login.xhtml"
+    headless = true
+
+La clave fiscal no se acepta en el archivo: solo en AFIP_PASSWORD.
+"""
+import logging
+import os
+from dataclasses import asdict, dataclass, field, fields, replace
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_DEFAULT = "facturacion.toml"
+LOGIN_URL_AFIP = "https://auth.afip.gob.ar/contribuyente_/login.xhtml"
+EMPRESA_DEFAULT = "LAZZARINI&LAZZARINI S.R.L."
+
+# Variable de entorno -> clave de Config
+_VARIABLES_ENTORNO = {
+    'AFIP_CUIT': 'cuit',
+    'AFIP_PASSWORD': 'password',
+    'AFIP_LOGIN_URL': 'login_url',
+    'AFIP_DOWNLOADS': 'downloads',
+    'AFIP_HEADLESS': 'headless',
+    'AFIP_EMPRESA': 'empresa_default',
+}
+
+# Claves que nunca se leen de un archivo
+_SOLO_ENTORNO = {'password'}
+
+
+@dataclass(frozen=True)
+class EmpresaConfig:
+    """Empresa representada: botón del selector de empresa y datos fijos de sus comprobantes"""
+    nombre: str
+    punto_venta: str = "4"
+    actividad: str = "682091"
+    unidad_medida: str = "98"  # otras unidades
+    alicuota_iva: str = "5"    # 21 %, solo se elige en factura B
+    ledger: str = "facturador_test.xlsx"
+    destino: str = str(Path.home() / "Desktop/Facturas_NOV")
+
+
+@dataclass(frozen=True)
+class Config:
+    """Configuración de una ejecución (un login y las empresas que representa)"""
+    cuit: str = None
+    password: str = field(default=None, repr=False)
+    login_url: str = LOGIN_URL_AFIP
+    downloads: str = str(Path.home() / "Downloads")
+    headless: bool = False
+    empresa_default: str = None
+    profile: str = None
+    empresas: tuple = (EmpresaConfig(EMPRESA_DEFAULT),)
+
+    def empresa(self, nombre=None):
+        """
+        Devuelve la configuración de una empresa.
+
+        Args:
+            nombre: nombre de la empresa (sin distinguir mayúsculas); por
+                    defecto empresa_default o la primera del archivo
+
+        Raises:
+            ValueError: si no hay una empresa con ese nombre
+        """
+        nombre = nombre or self.empresa_default
+        if nombre is None:
+            return self.empresas[0]
+        for empresa in self.empresas:
+            if empresa.nombre.strip().upper() == nombre.strip().upper():
+                return empresa
+        raise ValueError(f"No hay una empresa configurada con el nombre '{nombre}' "
+                         f"(configuradas: {', '.join(e.nombre for e in self.empresas)})")
+
+    @property
+    def has_credentials(self):
+        return bool(self.cuit and self.password)
+
+
+def _texto(valor):
+    # TOML y el Excel pueden traer códigos como números (punto_venta = 4)
+    return str(valor).strip()
+
+
+def _booleano(valor):
+    if isinstance(valor, bool):
+        return valor
+    texto = str(valor).strip().lower()
+    if texto in ('1', 'true', 'si', 'sí', 'yes', 'on'):
+        return True
+    if texto in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(f"Valor booleano inválido: '{valor}'")
+
+
+def _ruta(valor):
+    return str(Path(str(valor)).expanduser())
+
+
+_CONVERSIONES = {
+    'headless': _booleano,
+    'downloads': _ruta,
+    'ledger': _ruta,
+    'destino': _ruta,
+}
+
+
+def _build(cls, datos, origen):
+    """Crea la dataclass validando claves y convirtiendo los valores a su tipo"""
+    conocidas = {f.name for f in fields(cls)} - {'empresas'}
+    desconocidas = set(datos) - conocidas
+    if desconocidas:
+        raise ValueError(f"{origen}: claves desconocidas {sorted(desconocidas)} "
+                         f"(válidas: {sorted(conocidas)})")
+    valores = {}
+    for clave, valor in datos.items():
+        if valor is None:
+            continue
+        valores[clave] = _CONVERSIONES.get(clave, _texto)(valor)
+    return cls(**valores)
+
+
+def build_empresa(datos, base=None, origen='empresa'):
+    """
+    Crea una EmpresaConfig a partir de un dict (p. ej. una tabla TOML).
+
+    Args:
+        datos: valores de la empresa
+        base: EmpresaConfig de la que se toman los valores no indicados (opcional)
+        origen: descripción para los mensajes de error
+
+    Raises:
+        ValueError: claves desconocidas
+    """
+    if base is not None:
+        datos = {**asdict(base), **datos}
+    return _build(EmpresaConfig, datos, origen)
+
+
+def _read_file(path):
+    """Lee el archivo TOML de configuración"""
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        raise RuntimeError("Leer la configuración requiere Python 3.11 o superior (tomllib)")
+    with open(path, 'rb') as f:
+        datos = tomllib.load(f)
+    secretos = _SOLO_ENTORNO & set(datos)
+    if secretos:
+        raise ValueError(f"{path}: {sorted(secretos)} no se guarda en el archivo, usar AFIP_PASSWORD")
+    return datos
+
+
+def _load_dotenv():
+    """Carga un .env del directorio actual si python-dotenv está instalado"""
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+_current = None
+
+
+def load(path=None, profile=None, overrides=None, environ=None):
+    """
+    Carga la configuración y la deja como la actual (ver current).
+
+    Args:
+        path: archivo TOML (por defecto AFIP_CONFIG o facturacion.toml si existe)
+        profile: perfil del archivo a aplicar (por defecto AFIP_PROFILE)
+        overrides: valores de la línea de comandos (los None se ignoran)
+        environ: variables de entorno (por defecto os.environ)
+
+    Returns:
+        Config
+
+    Raises:
+        ValueError: claves desconocidas, perfil o empresa inexistentes
+    """
+    global _current
+    if environ is None:
+        _load_dotenv()
+        environ = os.environ
+
+    path = path or environ.get('AFIP_CONFIG') or (ARCHIVO_DEFAULT if Path(ARCHIVO_DEFAULT).exists() else None)
+    datos = _read_file(path) if path else {}
+    perfiles = datos.pop('profiles', {})
+    profile = profile or environ.get('AFIP_PROFILE')
+    if profile:
+        if profile not in perfiles:
+            raise ValueError(f"Perfil '{profile}' inexistente en {path} (perfiles: {sorted(perfiles)})")
+        datos.update(perfiles[profile])
+        datos['profile'] = profile
+
+    for variable, clave in _VARIABLES_ENTORNO.items():
+        if environ.get(variable):
+            datos[clave] = environ[variable]
+    datos.update({k: v for k, v in (overrides or {}).items() if v is not None})
+
+    empresas = datos.pop('empresas', None)
+    config = _build(Config, datos, path or 'configuración')
+    if empresas:
+        config = replace(config, empresas=tuple(
+            build_empresa(e, origen=f"{path}: empresa {e.get('nombre', i + 1)}") for i, e in enumerate(empresas)))
+    # Falla al cargar, no a mitad del lote, si la empresa elegida no existe
+    config.empresa()
+
+    logger.info(f"Configuración cargada ({path or 'valores por defecto'}"
+                f"{f', perfil {profile}' if profile else ''}): "
+                f"{len(config.empresas)} empresa(s), login {config.login_url}")
+    _current = config
+    return config
+
+
+def current():
+    """Configuración actual (se carga con los valores por defecto la primera vez)"""
+    if _current is None:
+        return load()
+    return _current
+
+
+def add_arguments(parser):
+    """Agrega a un ArgumentParser las opciones comunes de configuración"""
+    grupo = parser.add_argument_group('configuración')
+    grupo.add_argument('--config', help=f"Archivo TOML de configuración (por defecto {ARCHIVO_DEFAULT})")
+    grupo.add_argument('--profile', help="Perfil del archivo de configuración")
+    grupo.add_argument('--empresa', help="Empresa a facturar (nombre del botón del selector)")
+    grupo.add_argument('--cuit', help="CUIT de inicio de sesión (la clave va en AFIP_PASSWORD)")
+    grupo.add_argument('--login-url', help="URL de login (p. ej. la del portal simulado)")
+    grupo.add_argument('--downloads', help="Carpeta de descargas del navegador")
+    return grupo
+
+
+def from_args(args, **overrides):
+    """Carga la configuración a partir de las opciones de add_arguments"""
+    valores = {
+        'cuit': args.cuit,
+        'login_url': args.login_url,
+        'downloads': args.downloads,
+        'empresa_default': args.empresa,
+    }
+    valores.update(overrides)
+    return load(args.config, args.profile, valores)
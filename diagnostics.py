@@ -0,0 +1,165 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+from log_config import correlation_id_for
+
+logger = logging.getLogger(__name__)
+
+# Una sola llamada para todo lo que hace falta de la página
+_SNAPSHOT_SCRIPT = """
+    return {
+        url: location.href,
+        title: document.title,
+        html: document.documentElement ? document.documentElement.outerHTML : ''
+    };
+"""
+
+
+class Diagnostics:
+    """
+    Diagnóstico de fallas con costo cero mientras todo funciona.
+
+    Durante la ejecución solo se guarda metadata barata de los últimos pasos
+    (nombre, factura, hora) en un buffer circular, sin llamadas al navegador.
+    Cuando un paso falla se captura pantalla, DOM y consola del navegador y se
+    escriben en un hilo aparte. Cada contenido se guarda una sola vez por su
+    hash (dos fallas en la misma página comparten el mismo DOM en disco).
+    """
+
+    def __init__(self, driver, folder="diagnosticos", capacity=50, screenshots=None):
+        """
+        Args:
+            driver: WebDriver del que se capturan las fallas
+            folder: carpeta donde se guardan las capturas
+            capacity: cantidad de pasos recientes que se conservan
+            screenshots: ScreenshotStore donde guardar las imágenes (opcional;
+                         si no se indica se guardan junto al DOM)
+        """
+        self.driver = driver
+        self.folder = folder
+        self.screenshots = screenshots
+        self.recent = deque(maxlen=capacity)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='diagnostico')
+
+    @property
+    def enabled(self):
+        return True
+
+    def record_step(self, step, factura=None, ok=True):
+        """Agrega un paso al buffer circular (no toca el navegador)"""
+        self.recent.append({
+            'ts': time.time(),
+            'invoice': correlation_id_for(factura) if factura is not None else None,
+            'step': step,
+            'ok': ok
+        })
+
+    def capture_failure(self, step=None, factura=None, error=None):
+        """
+        Captura el estado del navegador tras una falla y lo escribe en segundo plano.
+
+        Args:
+            step: paso que falló (por defecto el último registrado)
+            factura: factura en curso (opcional)
+            error: excepción o mensaje de error (opcional)
+
+        Returns:
+            str: ruta del resumen de la captura, o None si no se pudo capturar
+        """
+        if step is None and self.recent:
+            step = self.recent[-1]['step']
+        self.record_step(step, factura, ok=False)
+
+        try:
+            pagina = self.driver.execute_script(_SNAPSHOT_SCRIPT) or {}
+        except Exception as e:
+            logger.warning(f"No se pudo leer el DOM para el diagnóstico: {str(e)}")
+            pagina = {}
+        try:
+            screenshot = self.driver.get_screenshot_as_base64()
+        except Exception as e:
+            logger.warning(f"No se pudo capturar la pantalla para el diagnóstico: {str(e)}")
+            screenshot = None
+        try:
+            consola = self.driver.get_log('browser')
+        except Exception:
+            # Solo disponible si el driver se creó con goog:loggingPrefs
+            consola = []
+
+        invoice = correlation_id_for(factura) if factura is not None else 'general'
+        nombre = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{invoice}_{step or 'desconocido'}"
+        path = os.path.join(self.folder, f"{nombre}.json")
+        resumen = {
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'invoice': invoice,
+            'step': step,
+            'error': str(error) if error is not None else None,
+            'url': pagina.get('url'),
+            'title': pagina.get('title'),
+            'recent_steps': list(self.recent)
+        }
+        if screenshot and self.screenshots is not None:
+            # El store comprime, deduplica y respeta su límite de disco
+            screenshot = self.screenshots.submit(screenshot, step, factura)
+        self._executor.submit(self._write, path, resumen, pagina.get('html'), screenshot, consola)
+        logger.info(f"Captura de diagnóstico del paso {step}: {path}")
+        return path
+
+    def _store_blob(self, data, extension):
+        """Guarda un contenido por su hash y devuelve la ruta relativa"""
+        digest = hashlib.sha256(data).hexdigest()
+        relativa = os.path.join('objetos', f"{digest}.{extension}")
+        destino = os.path.join(self.folder, relativa)
+        if not os.path.exists(destino):
+            tmp = f"{destino}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, destino)
+        return relativa
+
+    def _write(self, path, resumen, html, screenshot, consola):
+        """Escribe la captura (se ejecuta en el hilo de diagnóstico)"""
+        try:
+            os.makedirs(os.path.join(self.folder, 'objetos'), exist_ok=True)
+            if html:
+                resumen['dom'] = self._store_blob(html.encode('utf-8'), 'html')
+            if isinstance(screenshot, Future):
+                resumen['screenshot'] = screenshot.result()
+            elif screenshot:
+                resumen['screenshot'] = self._store_blob(base64.b64decode(screenshot), 'png')
+            if consola:
+                resumen['console'] = self._store_blob(
+                    json.dumps(consola, ensure_ascii=False, indent=2).encode('utf-8'), 'json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(resumen, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.error(f"Error escribiendo la captura de diagnóstico {path}: {str(e)}")
+
+    def close(self):
+        """Espera a que terminen de escribirse las capturas pendientes"""
+        self._executor.shutdown(wait=True)
+
+
+class NullDiagnostics:
+    """Diagnóstico deshabilitado: no guarda nada"""
+
+    enabled = False
+
+    def record_step(self, step, factura=None, ok=True):
+        pass
+
+    def capture_failure(self, step=None, factura=None, error=None):
+        return None
+
+    def close(self):
+        pass
+
+
+NULL_DIAGNOSTICS = NullDiagnostics()
@@ -2,40 +2,48 @@ from selenium.webdriver.support.ui import Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import ElementNotInteractableException, StaleElementReferenceException
+import functools
 import logging
 import time
-
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('element_handler.log'),
-        logging.StreamHandler()
-    ]
-)
+from step_profiler import NULL_PROFILER
+from retry_policy import DEFAULT_POLICY
 
 logger = logging.getLogger(__name__)
 
+def _profiled(method):
+    """Mide la llamada como un paso del profiler (nombre del método + descripción)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        description = kwargs.get('description', '')
+        with self.profiler.step(f"{method.__name__}[{description}]"):
+            result = method(self, *args, **kwargs)
+            if not result:
+                self.profiler.mark_failed()
+            return result
+    return wrapper
+
 class ElementHandler:
     """
     Clase para manejar interacciones seguras con elementos web en la aplicación AFIP.
     Proporciona métodos para clicks, selecciones y entradas de datos con fallbacks.
     """
     
-    def __init__(self, driver, wait):
+    def __init__(self, driver, wait, profiler=None, retry_policy=None):
         """
         Inicializa el manejador de elementos.
         
         Args:
             driver: WebDriver de Selenium
             wait: WebDriverWait configurado
+            profiler: StepProfiler para medir cada llamada safe_* (opcional)
+            retry_policy: RetryPolicy de los reintentos (por defecto DEFAULT_POLICY)
         """
         self.driver = driver
         self.wait = wait
-        self.retry_attempts = 3
-        self.retry_delay = 1
+        self.profiler = profiler or NULL_PROFILER
+        self.retry_policy = retry_policy or DEFAULT_POLICY
     
+    @_profiled
     def safe_click(self, locator, js_fallback=None, description=""):
         """
         Intenta hacer click en un elemento de forma segura.
@@ -50,29 +58,34 @@ class ElementHandler:
         """
         logger.info(f"Intentando click en elemento: {description}")
         
-        for attempt in range(self.retry_attempts):
+        def intento():
             try:
                 element = self.wait.until(EC.element_to_be_clickable(locator))
                 element.click()
                 logger.info(f"Click exitoso en {description}")
-                return True
             except Exception as e:
-                logger.warning(f"Intento {attempt + 1} fallido para click en {description}: {str(e)}")
-                if js_fallback:
-                    try:
-                        self.driver.execute_script(js_fallback)
-                        logger.info(f"Click exitoso usando JavaScript en {description}")
-                        return True
-                    except Exception as js_e:
-                        logger.error(f"Error en JavaScript fallback: {str(js_e)}")
-                
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(self.retry_delay)
-                    continue
-                
-                logger.error(f"Todos los intentos de click fallaron para {description}")
-                return False
+                logger.warning(f"Intento fallido para click en {description}: {str(e)}")
+                if not js_fallback:
+                    raise
+                try:
+                    self.driver.execute_script(js_fallback)
+                except Exception as js_e:
+                    logger.error(f"Error en JavaScript fallback: {str(js_e)}")
+                    raise e
+                self.profiler.note_fallback()
+                logger.info(f"Click exitoso usando JavaScript en {description}")
+
+        # Los reintentos y su espera dependen de la clase de error; una sesión
+        # expirada o un error de validación no se reintentan
+        try:
+            self.retry_policy.call(intento, description=f"click en {description}", driver=self.driver,
+                                   on_retry=lambda clase, e: self.profiler.note_retry())
+            return True
+        except Exception:
+            logger.error(f"Todos los intentos de click fallaron para {description}")
+            return False
     
+    @_profiled
     def safe_select(self, element_id, value, description="", scroll_into_view=True):
         """
         Realiza una selección segura en un elemento select.
@@ -110,12 +123,14 @@ class ElementHandler:
                     select.dispatchEvent(event);
                 """
                 self.driver.execute_script(js_script)
+                self.profiler.note_fallback()
                 logger.info(f"Selección exitosa usando JavaScript en {description}")
                 return True
             except Exception as js_e:
                 logger.error(f"Error en selección por JavaScript: {str(js_e)}")
                 return False
     
+    @_profiled
     def safe_input(self, element_id, value, description=""):
         """
         Ingresa texto de forma segura en un campo de entrada.
@@ -199,6 +214,7 @@ class ElementHandler:
         except:
             return False
     
+    @_profiled
     def safe_clear_and_send_keys(self, element_id, value, description=""):
         """
         Limpia y envía texto a un elemento de forma segura.
@@ -221,6 +237,7 @@ class ElementHandler:
                 element.clear()
             except:
                 self.driver.execute_script(f"document.getElementById('{element_id}').value = '';")
+                self.profiler.note_fallback()
             
             # Intentar enviar las teclas
             element.send_keys(str(value).strip())
@@ -3,7 +3,13 @@ from dataclasses import dataclass
 from typing import Optional
 from datetime import datetime
 from openpyxl import load_workbook
+import logging
 import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class FacturaData:
@@ -20,13 +26,25 @@ class FacturaData:
     row_index: int
 
 class ExcelHandler:
-    def __init__(self, excel_path: str):
+    def __init__(self, excel_path: str, leases=None):
+        """
+        Args:
+            excel_path: ruta del Excel de facturas
+            leases: LedgerLeases compartido con otros procesos (opcional). Si se
+                    indica, cada marca relee el Excel bajo bloqueo antes de
+                    guardar para no pisar las marcas de otros procesos.
+        """
         self.excel_path = excel_path
+        self.leases = leases
         self.df = None
         self.workbook = None
         self.sheet = None
+        self._unsaved = False
+        self._pending_marks = set()
+        self.rechazadas = []
 
     def load_excel(self) -> bool:
+        inicio = time.perf_counter()
         try:
             # Especificar dtype para la columna CUIT
             dtype_dict = {'CUIT': str}
@@ -65,10 +83,11 @@ class ExcelHandler:
             self.sheet = self.workbook.active
             
             self._validate_required_columns()
+            metrics.current().ledger_load.observe(time.perf_counter() - inicio)
             return True
             
         except Exception as e:
-            print(f"Error al cargar el archivo Excel: {str(e)}")
+            logger.error(f"Error al cargar el archivo Excel: {str(e)}")
             return False
 
     def _validate_required_columns(self):
@@ -79,7 +98,7 @@ class ExcelHandler:
         ]
         
         # Mostrar columnas disponibles para diagnóstico
-        print("Columnas encontradas:", list(self.df.columns))
+        logger.info(f"Columnas encontradas: {list(self.df.columns)}")
         
         missing_columns = [col for col in required_columns if col not in self.df.columns]
         if missing_columns:
@@ -104,12 +123,18 @@ class ExcelHandler:
             return cuit_limpio
             
         except Exception as e:
-            print(f"Error limpiando CUIT {cuit_raw}: {str(e)}")
+            logger.error(f"Error limpiando CUIT {cuit_raw}: {str(e)}")
             return ''
 
     def get_facturas_pendientes(self) -> list[FacturaData]:
-        """Obtiene solo las facturas no realizadas"""
+        """
+        Obtiene solo las facturas no realizadas.
+
+        Las filas pendientes con datos inválidos se saltean y quedan en
+        self.rechazadas como (fila, cliente, motivo), para informarlas.
+        """
         facturas = []
+        self.rechazadas = []
         
         for index, row in self.df.iterrows():
             # Verificar si el cliente está vacío
@@ -124,7 +149,7 @@ class ExcelHandler:
                     # Usar el CUIT ya limpio del DataFrame
                     cuit = self.limpiar_cuit(row['CUIT'])
                     if not cuit:
-                        print(f"CUIT vacío para cliente {row['Cliente']}, saltando...")
+                        self._rechazar(index, row['Cliente'], "CUIT vacío")
                         continue
                     
                     # Convertir valores numéricos
@@ -132,13 +157,14 @@ class ExcelHandler:
                         importe = float(str(row['Importe']).replace(',', '.'))
                         iva = float(str(row['IVA']).replace(',', '.'))
                     except ValueError:
-                        print(f"Error en valores numéricos para cliente {row['Cliente']}, saltando...")
+                        self._rechazar(index, row['Cliente'],
+                                       f"valores numéricos inválidos (Importe='{row['Importe']}', IVA='{row['IVA']}')")
                         continue
 
                     # Verificar fecha
                     fecha = pd.to_datetime(row['Fecha'])
                     if pd.isna(fecha):
-                        print(f"Fecha inválida para cliente {row['Cliente']}, saltando...")
+                        self._rechazar(index, row['Cliente'], "fecha vacía o inválida")
                         continue
 
                     factura = FacturaData(
@@ -155,31 +181,40 @@ class ExcelHandler:
                     )
                     
                     # Solo agregar si todos los datos son válidos
-                    if self.validate_factura_data(factura):
+                    motivo = self.motivo_rechazo(factura)
+                    if motivo is None:
                         facturas.append(factura)
-                        print(f"Factura agregada para {factura.cliente}: CUIT={cuit}, Importe={importe}")
+                        logger.info(f"Factura agregada para {factura.cliente}: CUIT={cuit}, Importe={importe}")
                     else:
-                        print(f"Factura no válida para {row['Cliente']}, saltando...")
+                        self._rechazar(index, row['Cliente'], motivo)
                         
                 except Exception as e:
-                    print(f"Error procesando fila {index + 2}: {str(e)}")
+                    self._rechazar(index, row['Cliente'], f"error procesando la fila: {str(e)}")
                     continue
         
         return facturas
 
-    def validate_factura_data(self, factura: FacturaData) -> bool:
-        """Realiza validaciones adicionales sobre los datos de la factura"""
+    def _rechazar(self, index, cliente, motivo):
+        """Registra una fila pendiente que no se puede emitir"""
+        logger.warning(f"Fila {index + 2} ({cliente}) no válida: {motivo}, saltando...")
+        self.rechazadas.append((index + 2, str(cliente).strip(), motivo))
+
+    def motivo_rechazo(self, factura: FacturaData):
+        """
+        Valida los datos de la factura.
+
+        Returns:
+            str: motivo por el que la factura no es válida, o None si lo es
+        """
         try:
             # Validar que el cliente no esté vacío
             if not factura.cliente or factura.cliente.strip() == '':
-                print("Error: Cliente vacío")
-                return False
+                return "cliente vacío"
 
             # Validación del CUIT
             cuit_limpio = self.limpiar_cuit(factura.cuit)
             if len(cuit_limpio) != 11:
-                print(f"CUIT inválido para {factura.cliente}: '{factura.cuit}' (limpio: '{cuit_limpio}')")
-                return False
+                return f"CUIT inválido '{factura.cuit}' (limpio: '{cuit_limpio}')"
             
             # Asignar el CUIT limpio
             factura.cuit = cuit_limpio
@@ -187,73 +222,121 @@ class ExcelHandler:
             # Validación de condición de IVA
             condiciones_validas = ['RI', 'CF', 'M', 'E']
             if factura.cond_iva not in condiciones_validas:
-                print(f"Condición de IVA inválida para {factura.cliente}: '{factura.cond_iva}' - debe ser una de {condiciones_validas}")
-                return False
+                return f"condición de IVA inválida '{factura.cond_iva}' - debe ser una de {condiciones_validas}"
             
             # Validación de importes
             try:
                 importe = float(str(factura.importe).replace(',', '.'))
-                assert importe > 0, f"Importe debe ser mayor a 0 para {factura.cliente}"
-            except (ValueError, AssertionError) as e:
-                print(f"Error en importe para {factura.cliente}: {str(e)}")
-                return False
+            except ValueError:
+                return f"importe inválido '{factura.importe}'"
+            if importe <= 0:
+                return f"el importe debe ser mayor a 0 ({factura.importe})"
             
             # Validación de rendición
             if not factura.rendicion or str(factura.rendicion).strip() == '':
-                print(f"Error: Número de rendición vacío para {factura.cliente}")
-                return False
+                return "número de rendición vacío"
 
             # Validación de fecha
             if factura.fecha is None:
-                print(f"Error: Fecha inválida para {factura.cliente}")
-                return False
+                return "fecha inválida"
 
             # Validación de periodo
             if not factura.periodo or str(factura.periodo).strip() == '':
-                print(f"Error: Periodo vacío para {factura.cliente}")
-                return False
+                return "periodo vacío"
             
-            print(f"Validación exitosa para {factura.cliente} - CUIT: {factura.cuit}")
-            return True
+            return None
                 
         except Exception as e:
-            print(f"Error inesperado validando factura para {factura.cliente}: {str(e)}")
+            return f"error inesperado validando: {str(e)}"
+
+    def validate_factura_data(self, factura: FacturaData) -> bool:
+        """Realiza validaciones adicionales sobre los datos de la factura"""
+        motivo = self.motivo_rechazo(factura)
+        if motivo is not None:
+            logger.warning(f"Factura no válida para {factura.cliente}: {motivo}")
             return False
+        logger.info(f"Validación exitosa para {factura.cliente} - CUIT: {factura.cuit}")
+        return True
+
+    def _realizado_col(self):
+        """Índice (1-based) de la columna 'Realizado' en la hoja"""
+        for idx, cell in enumerate(self.sheet[1], 1):
+            if cell.value == 'Realizado':
+                return idx
+        raise ValueError("No se encontró la columna 'Realizado'")
+
+    def _save_marks(self):
+        """
+        Escribe las marcas pendientes y guarda el Excel.
+
+        Con reservas compartidas se relee el archivo bajo bloqueo exclusivo, así
+        se conservan las marcas que otro proceso haya guardado desde la carga.
+        """
+        if self.leases is None:
+            self.workbook.save(self.excel_path)
+            return
+        with self.leases.exclusive():
+            self.workbook = load_workbook(self.excel_path)
+            self.sheet = self.workbook.active
+            realizado_col = self._realizado_col()
+            for row_index in self._pending_marks:
+                self.sheet.cell(row=row_index, column=realizado_col, value='✓')
+            self.workbook.save(self.excel_path)
 
     def marcar_como_realizada(self, factura: FacturaData) -> bool:
         """Marca una factura como realizada en el Excel"""
+        return self.marcar_como_realizadas([factura])
+
+    def marcar_como_realizadas(self, facturas: list[FacturaData]) -> bool:
+        """Marca varias facturas (p. ej. las de un comprobante agrupado) guardando el Excel una sola vez"""
         try:
-            # Encontrar la columna 'Realizado'
-            realizado_col = None
-            for idx, cell in enumerate(self.sheet[1], 1):
-                if cell.value == 'Realizado':
-                    realizado_col = idx
-                    break
-            
-            if realizado_col is None:
-                raise ValueError("No se encontró la columna 'Realizado'")
-            
-            # Marcar como realizada
-            self.sheet.cell(row=factura.row_index, column=realizado_col, value='✓')
+            # Marcar como realizadas
+            realizado_col = self._realizado_col()
+            for factura in facturas:
+                self.sheet.cell(row=factura.row_index, column=realizado_col, value='✓')
+                self._pending_marks.add(factura.row_index)
+            self._unsaved = True
             
             # Guardar el archivo
-            self.workbook.save(self.excel_path)
-            print(f"Factura de {factura.cliente} marcada como realizada")
+            self._save_marks()
+            self._unsaved = False
+            self._pending_marks.clear()
+            for factura in facturas:
+                if self.leases is not None:
+                    self.leases.complete(factura)
+                logger.info(f"Factura de {factura.cliente} (rendición {factura.rendicion}) marcada como realizada")
             return True
             
         except Exception as e:
-            print(f"Error al marcar factura como realizada: {str(e)}")
+            logger.error(f"Error al marcar factura como realizada: {str(e)}")
+            return False
+
+    def flush(self) -> bool:
+        """Guarda las marcas que no se pudieron guardar (p. ej. Excel abierto en otro programa)"""
+        if not self._unsaved:
+            return True
+        try:
+            self._save_marks()
+            self._unsaved = False
+            self._pending_marks.clear()
+            logger.info("Marcas pendientes guardadas en el Excel")
+            return True
+        except Exception as e:
+            logger.error(f"Error guardando marcas pendientes: {str(e)}")
             return False
 
 def main():
     """Función principal para pruebas"""
+    from log_config import configure_logging
+
+    configure_logging(log_file=None)
     excel_handler = ExcelHandler("facturador_test.xlsx")
     if excel_handler.load_excel():
         facturas = excel_handler.get_facturas_pendientes()
-        print(f"\nSe encontraron {len(facturas)} facturas pendientes")
+        logger.info(f"Se encontraron {len(facturas)} facturas pendientes")
         
         for factura in facturas:
-            print(f"\nProcesando factura para {factura.cliente}...")
+            logger.info(f"Procesando factura para {factura.cliente}...")
             excel_handler.marcar_como_realizada(factura)
 
 if __name__ == "__main__":
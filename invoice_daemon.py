@@ -0,0 +1,381 @@
+import argparse
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from archive_handler import ComprobanteArchive
+from browser_manager import BrowserManager
+from invoice_journal import InvoiceJournal
+from invoice_recovery import archivar_descargas_pendientes
+from log_config import configure_logging
+from retry_policy import Backoff, classify
+from run_lifecycle import RunLifecycle, BATCH
+from step_profiler import StepProfiler
+import config
+import metrics
+import main as flujo
+
+logger = logging.getLogger(__name__)
+
+# Constantes de inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Espera tras una vuelta fallida del servicio, creciente con las fallas seguidas
+ESPERA_FALLAS = Backoff(attempts=1, delay=5, max_delay=300)
+# Inicios de sesión fallidos seguidos tras los que se detiene el servicio
+# (clave vencida o cuenta bloqueada: reintentar solo empeora el bloqueo)
+MAX_LOGINS_FALLIDOS = 3
+
+
+class LedgerWatcher:
+    """
+    Espera cambios en los Excel de facturas o en una carpeta de entrada.
+
+    En Linux usa inotify sobre los directorios observados (Excel guarda
+    escribiendo un temporal y renombrándolo, por eso se observa el directorio y
+    no el archivo). En otros sistemas, o si inotify no está disponible, compara
+    la fecha de modificación cada poll_interval segundos.
+
+    En ambos casos un Excel solo cuenta como cambiado si su fecha de
+    modificación difiere de la última vista; acknowledge() da por vistas las
+    escrituras del propio servicio (las marcas de 'Realizado').
+    """
+
+    def __init__(self, ledgers, drop_dir=None, poll_interval=2.0):
+        """
+        Args:
+            ledgers: rutas de los Excel a observar
+            drop_dir: carpeta donde se dejan nuevos Excel para procesar (opcional)
+            poll_interval: intervalo de sondeo cuando no hay inotify
+        """
+        self.ledgers = [Path(p).resolve() for p in ledgers]
+        self.drop_dir = Path(drop_dir).resolve() if drop_dir else None
+        self.poll_interval = poll_interval
+        self._fd = None
+        self._watches = {}
+        self._mtimes = self._snapshot()
+        self._init_inotify()
+
+    def _init_inotify(self):
+        """Inicializa inotify si el sistema lo soporta"""
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            directorios = {p.parent for p in self.ledgers}
+            if self.drop_dir:
+                directorios.add(self.drop_dir)
+            for directorio in directorios:
+                wd = libc.inotify_add_watch(fd, str(directorio).encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch {directorio}")
+                self._watches[wd] = directorio
+            self._fd = fd
+            logger.info(f"Observando {len(directorios)} carpetas con inotify")
+        except Exception as e:
+            logger.warning(f"inotify no disponible ({str(e)}), se usa sondeo cada {self.poll_interval}s")
+            self._fd = None
+
+    def _snapshot(self):
+        """Fechas de modificación de los Excel observados"""
+        mtimes = {}
+        for path in self.ledger_paths():
+            try:
+                mtimes[path] = path.stat().st_mtime
+            except OSError:
+                continue
+        return mtimes
+
+    def ledger_paths(self):
+        """Excel a procesar: los configurados más los que haya en la carpeta de entrada"""
+        paths = list(self.ledgers)
+        if self.drop_dir and self.drop_dir.is_dir():
+            paths.extend(sorted(p.resolve() for p in self.drop_dir.glob('*.xlsx')
+                                if not p.name.startswith('~$')))
+        return paths
+
+    def acknowledge(self):
+        """
+        Da por vistos los cambios hechos hasta ahora.
+
+        Se llama después de procesar los Excel: las marcas que guardó el
+        servicio generan eventos que no deben disparar otra pasada.
+        """
+        self._mtimes = self._snapshot()
+        if self._fd is None:
+            return
+        # Descartar los eventos ya encolados; los de otros cambios se
+        # detectan igual por la fecha de modificación
+        while select.select([self._fd], [], [], 0)[0]:
+            try:
+                os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+    def _changed(self, path):
+        """Indica si la fecha de modificación del Excel difiere de la última vista"""
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return False
+        if self._mtimes.get(path) == mtime:
+            return False
+        self._mtimes[path] = mtime
+        return True
+
+    def _relevant(self, directorio, nombre):
+        """Indica si un evento de inotify corresponde a un Excel observado"""
+        path = (directorio / nombre).resolve()
+        if path in self.ledgers:
+            return True
+        return (self.drop_dir is not None and directorio == self.drop_dir
+                and nombre.endswith('.xlsx') and not nombre.startswith('~$'))
+
+    def wait(self, timeout):
+        """
+        Bloquea hasta que cambie algún Excel observado o venza el timeout.
+
+        Returns:
+            bool: True si hubo cambios
+        """
+        if self._fd is None:
+            return self._wait_polling(timeout)
+
+        fin = time.monotonic() + timeout
+        while True:
+            restante = fin - time.monotonic()
+            if restante <= 0:
+                return False
+            listos, _, _ = select.select([self._fd], [], [], restante)
+            if not listos:
+                return False
+            cambios = False
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                nombre = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                directorio = self._watches.get(wd)
+                if (directorio is not None and nombre and self._relevant(directorio, nombre)
+                        and self._changed((directorio / nombre).resolve())):
+                    cambios = True
+            if cambios:
+                return True
+
+    def _wait_polling(self, timeout):
+        """Alternativa sin inotify: compara fechas de modificación"""
+        fin = time.monotonic() + timeout
+        while time.monotonic() < fin:
+            time.sleep(min(self.poll_interval, max(0, fin - time.monotonic())))
+            actual = self._snapshot()
+            if actual != self._mtimes:
+                self._mtimes = actual
+                return True
+        return False
+
+    def close(self):
+        """Libera el descriptor de inotify"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class InvoiceDaemon:
+    """
+    Modo servicio: mantiene una sesión autenticada y emite las facturas a
+    medida que aparecen filas pendientes en los Excel observados.
+
+    La sesión se mantiene viva volviendo al menú principal cada
+    keepalive_interval segundos; si el portal la expiró se vuelve a iniciar.
+    Una vuelta fallida no detiene el servicio: se espera (ESPERA_FALLAS) y se
+    reintenta, salvo tras MAX_LOGINS_FALLIDOS inicios de sesión fallidos seguidos.
+    """
+
+    def __init__(self, cuit, password, ledgers, drop_dir=None, headless=True,
+                 keepalive_interval=300, settle_time=1.5, lifecycle=None, login_url=None, standby=False,
+                 agrupar=False, empresa=None, downloads_folder=None):
+        """
+        Args:
+            cuit: CUIT de inicio de sesión
+            password: clave fiscal
+            ledgers: rutas de los Excel a observar
+            drop_dir: carpeta de entrada de nuevos Excel (opcional)
+            headless: ejecutar Chrome sin ventana
+            keepalive_interval: segundos entre verificaciones de sesión sin actividad
+            settle_time: espera tras un cambio para que termine de escribirse el archivo
+            lifecycle: RunLifecycle a usar (por defecto uno en modo lote)
+            login_url: URL de login (por defecto la de la configuración)
+            standby: mantener una segunda sesión lista para reemplazar a la actual
+            agrupar: emitir un solo comprobante por cliente y periodo (varias líneas de detalle)
+            empresa: EmpresaConfig a facturar (por defecto la predeterminada de la configuración)
+            downloads_folder: carpeta de descargas del navegador (por defecto la de la configuración)
+        """
+        self.cuit = cuit
+        self.password = password
+        self.watcher = LedgerWatcher(ledgers, drop_dir)
+        self.headless = headless
+        self.keepalive_interval = keepalive_interval
+        self.settle_time = settle_time
+        self.lifecycle = lifecycle or RunLifecycle(BATCH)
+        self.login_url = login_url or config.current().login_url
+        self.empresa = empresa or config.current().empresa()
+        self.downloads_folder = downloads_folder or config.current().downloads
+        self.standby = standby
+        self.agrupar = agrupar
+        self.browser = None
+        self.driver = None
+        self.logins_fallidos = 0
+        # Con métricas activas se miden los pasos para el histograma de latencias
+        self.profiler = StepProfiler() if metrics.current().registry.enabled else None
+        metrics.current().session_age.set_function(
+            lambda: self.browser.session_age() if self.browser else None)
+
+    def _start_session(self):
+        """Abre un navegador nuevo e inicia sesión"""
+        if self.browser:
+            self.browser.close_browser()
+        self.browser = BrowserManager(headless=self.headless, download_dir=self.downloads_folder)
+        self.driver, _ = self.browser.setup_driver()
+        self._login(self.driver)
+        logger.info("Sesión iniciada")
+        if self.standby:
+            self.browser.start_standby(self._login, check=flujo.sesion_activa)
+
+    def _login(self, driver):
+        """Inicia sesión en un navegador recién abierto (también al reciclarlo)"""
+        if self.profiler:
+            self.profiler.instrument_driver(driver)
+        try:
+            flujo.iniciar_sesion(driver, self.cuit, self.password, self.login_url, self.empresa, self.browser)
+        except Exception:
+            self.logins_fallidos += 1
+            raise
+        self.logins_fallidos = 0
+
+    def _ensure_session(self):
+        """Verifica la sesión y la vuelve a iniciar si expiró"""
+        if self.driver is not None and flujo.sesion_activa(self.driver):
+            return
+        logger.warning("Sesión expirada o navegador caído, iniciando sesión nuevamente...")
+        if self.browser is None:
+            self._start_session()
+        else:
+            # Usa la sesión de reserva si está lista
+            self.driver = self.browser.recycle(login=self._login)
+
+    def _drain(self):
+        """Procesa las filas pendientes de todos los Excel observados"""
+        for ledger in self.watcher.ledger_paths():
+            if self.lifecycle.stopping:
+                return
+            logger.info(f"Procesando pendientes de {ledger}")
+            self.lifecycle.on_shutdown(f"descargas pendientes {ledger}", lambda l=ledger: archivar_descargas_pendientes(
+                InvoiceJournal.for_ledger(l), ComprobanteArchive(), self.empresa.destino))
+            flujo.facturar(self.driver, self.lifecycle, excel_path=str(ledger), profiler=self.profiler,
+                           browser=self.browser, relogin=self._login, agrupar=self.agrupar,
+                           empresa=self.empresa, downloads_folder=self.downloads_folder)
+            # facturar puede haber reciclado el navegador
+            self.driver = self.browser.driver
+
+    def run(self):
+        """Bucle principal del servicio hasta recibir SIGINT/SIGTERM"""
+        self.lifecycle.install_signal_handlers()
+        try:
+            drenar = True  # al iniciar se procesa lo que ya está pendiente
+            fallas = 0
+            ultimo_keepalive = time.monotonic()
+
+            while not self.lifecycle.stopping:
+                try:
+                    if drenar:
+                        self._ensure_session()
+                        self._drain()
+                        # Las marcas guardadas por _drain no son cambios nuevos
+                        self.watcher.acknowledge()
+                        drenar = False
+                        ultimo_keepalive = time.monotonic()
+                    elif time.monotonic() - ultimo_keepalive >= self.keepalive_interval:
+                        self._ensure_session()
+                        ultimo_keepalive = time.monotonic()
+                    fallas = 0
+                except Exception as e:
+                    if self.browser is not None:
+                        # facturar o recycle pueden haber cambiado el navegador antes de fallar
+                        self.driver = self.browser.driver
+                    if self.logins_fallidos >= MAX_LOGINS_FALLIDOS:
+                        logger.critical(f"{self.logins_fallidos} inicios de sesión fallidos seguidos "
+                                        f"({str(e)}), se detiene el servicio")
+                        break
+                    fallas += 1
+                    espera = ESPERA_FALLAS.wait(fallas)
+                    logger.exception(f"Falla en el servicio ({classify(e, self.driver)}), "
+                                     f"reintento {fallas} en {espera:.0f}s")
+                    # Lo pendiente (drenar o keepalive) se reintenta en la próxima vuelta
+                    self.lifecycle.sleep(espera)
+                    continue
+
+                restante = self.keepalive_interval - (time.monotonic() - ultimo_keepalive)
+                # Despertar al menos cada segundo para atender la señal de detención
+                cambios = self.watcher.wait(timeout=max(0.0, min(1.0, restante)))
+                if self.lifecycle.stopping:
+                    break
+
+                if cambios:
+                    time.sleep(self.settle_time)
+                    drenar = True
+        finally:
+            self.lifecycle.shutdown()
+            self.watcher.close()
+            if self.browser:
+                self.browser.close_standby()
+                self.browser.close_browser()
+            logger.info("Servicio detenido")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emite facturas continuamente a medida que se agregan filas pendientes")
+    parser.add_argument('ledgers', nargs='*', help="Excel a observar (por defecto el de la empresa)")
+    parser.add_argument('--drop-dir', help="Carpeta de entrada donde se dejan nuevos Excel")
+    parser.add_argument('--headed', action=argparse.BooleanOptionalAction, default=None,
+                        help="Mostrar la ventana del navegador (por defecto según la configuración)")
+    parser.add_argument('--keepalive', type=int, default=300, help="Segundos entre verificaciones de sesión")
+    parser.add_argument('--standby', action='store_true', help="Mantener una sesión de reserva para recuperarse al instante")
+    parser.add_argument('--agrupar', action='store_true',
+                        help="Un comprobante por cliente y periodo, una línea por rendición")
+    parser.add_argument('--metrics-port', type=int, help="Exponer métricas Prometheus en este puerto local")
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    configuracion = config.from_args(args)
+    if not configuracion.has_credentials:
+        parser.error("Definir AFIP_CUIT y AFIP_PASSWORD (variables de entorno o archivo .env)")
+    empresa = configuracion.empresa()
+    headless = configuracion.headless if args.headed is None else not args.headed
+
+    configure_logging(log_file='facturacion_servicio.log')
+    if args.metrics_port is not None:
+        metrics.enable(args.metrics_port)
+    InvoiceDaemon(configuracion.cuit, configuracion.password, args.ledgers or [empresa.ledger],
+                  drop_dir=args.drop_dir, headless=headless, keepalive_interval=args.keepalive,
+                  login_url=configuracion.login_url, standby=args.standby, agrupar=args.agrupar,
+                  empresa=empresa, downloads_folder=configuracion.downloads).run()
+
+
+if __name__ == "__main__":
+    main()
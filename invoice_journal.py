@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from archive_handler import clave_factura
+
+logger = logging.getLogger(__name__)
+
+# Estados por los que pasa cada factura, en orden
+PENDING = 'pending'
+FORM_FILLED = 'form_filled'
+CONFIRMED = 'confirmed'
+PDF_DOWNLOADED = 'pdf_downloaded'
+FILED = 'filed'
+MARKED = 'marked'
+
+ESTADOS = [PENDING, FORM_FILLED, CONFIRMED, PDF_DOWNLOADED, FILED, MARKED]
+
+
+class InvoiceJournal:
+    """
+    Journal local con el estado de cada factura para poder retomar tras una caída.
+
+    Cada transición se agrega como una línea JSON y se sincroniza a disco antes
+    de continuar, de modo que al reiniciar se conoce el último estado durable de
+    cada factura. Las transiciones solo avanzan: una factura confirmada nunca
+    vuelve a un estado anterior a 'confirmed'.
+    """
+
+    def __init__(self, path):
+        """
+        Inicializa el journal y reproduce las transiciones ya registradas.
+
+        Args:
+            path: ruta del archivo de journal (JSON lines)
+        """
+        self.path = Path(path)
+        self._entries = {}
+        self._offset = 0
+        self._replay()
+
+    @classmethod
+    def for_ledger(cls, excel_path):
+        """Crea el journal asociado a un archivo Excel (mismo nombre, .journal.jsonl)"""
+        return cls(Path(excel_path).with_suffix('.journal.jsonl'))
+
+    def _replay(self):
+        """Reconstruye el estado en memoria leyendo el journal de disco"""
+        self.refresh()
+        logger.info(f"Journal cargado: {len(self._entries)} facturas con estado registrado")
+
+    def refresh(self):
+        """
+        Incorpora las transiciones agregadas al archivo desde la última lectura.
+
+        Permite ver lo que registró otro proceso que comparte el mismo journal.
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as f:
+            f.seek(self._offset)
+            while True:
+                linea = f.readline()
+                if not linea.endswith('\n'):
+                    # Fin de archivo, o una línea que otro proceso todavía está escribiendo
+                    break
+                self._offset = f.tell()
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    registro = json.loads(linea)
+                except json.JSONDecodeError:
+                    # Una línea truncada solo puede venir de una caída durante la escritura
+                    logger.warning(f"Línea ilegible en el journal, se ignora: {linea[:80]}")
+                    continue
+                entrada = self._entries.setdefault(registro['clave'], {'estado': PENDING, 'datos': {}})
+                if ESTADOS.index(registro['estado']) >= ESTADOS.index(entrada['estado']):
+                    entrada['estado'] = registro['estado']
+                entrada['factura'] = registro.get('factura') or entrada.get('factura')
+                entrada['datos'].update(registro.get('datos', {}))
+
+    def state(self, factura):
+        """Devuelve el último estado durable de la factura ('pending' si no hay registro)"""
+        entrada = self._entries.get(clave_factura(factura))
+        return entrada['estado'] if entrada else PENDING
+
+    def reached(self, factura, estado):
+        """Indica si la factura ya alcanzó (o superó) el estado indicado"""
+        return ESTADOS.index(self.state(factura)) >= ESTADOS.index(estado)
+
+    def data(self, factura):
+        """Devuelve los datos acumulados de la factura (p. ej. la ruta del PDF descargado)"""
+        entrada = self._entries.get(clave_factura(factura))
+        return dict(entrada['datos']) if entrada else {}
+
+    def advance(self, factura, estado, **datos):
+        """
+        Registra que la factura alcanzó un nuevo estado.
+
+        Args:
+            factura: Objeto FacturaData
+            estado: uno de ESTADOS
+            **datos: información adicional a conservar (ruta del PDF, etc.)
+
+        Returns:
+            bool: True si se registró la transición, False si era un retroceso
+        """
+        if estado not in ESTADOS:
+            raise ValueError(f"Estado desconocido: {estado}")
+
+        actual = self.state(factura)
+        if ESTADOS.index(estado) < ESTADOS.index(actual):
+            logger.warning(f"Transición ignorada para {factura.cliente}: {actual} -> {estado}")
+            return False
+
+        clave = clave_factura(factura)
+        registro = {
+            'clave': clave,
+            'estado': estado,
+            'fila': factura.row_index,
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'factura': {
+                'cliente': factura.cliente,
+                'cuit': factura.cuit,
+                'rendicion': str(factura.rendicion),
+                'periodo': factura.periodo,
+                'row_index': factura.row_index
+            },
+            'datos': datos
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        entrada = self._entries.setdefault(clave, {'estado': PENDING, 'datos': {}})
+        entrada['estado'] = estado
+        entrada['factura'] = registro['factura']
+        entrada['datos'].update(datos)
+        logger.info(f"Factura de {factura.cliente} -> {estado}")
+        return True
+
+    def pending_downloads(self):
+        """
+        Devuelve los PDF descargados que todavía no se archivaron.
+
+        Returns:
+            list: tuplas (factura, ruta_pdf); factura es un objeto con los
+                  atributos cliente, cuit, rendicion, periodo y row_index
+        """
+        pendientes = []
+        for entrada in self._entries.values():
+            if entrada['estado'] == PDF_DOWNLOADED and entrada.get('factura') and entrada['datos'].get('pdf'):
+                pendientes.append((SimpleNamespace(**entrada['factura']), entrada['datos']['pdf']))
+        return pendientes
@@ -0,0 +1,236 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from archive_handler import ARCHIVO_DEFAULT, nombre_archivo_factura, normalizar_rendicion
+from json_state import file_lock, read_json, write_json
+from log_config import correlation
+
+logger = logging.getLogger(__name__)
+
+# Líneas de detalle por comprobante al agrupar rendiciones
+MAX_LINEAS_DETALLE = 20
+
+
+def descripcion_factura(factura):
+    """Texto de la línea de detalle del comprobante"""
+    return f"Comisiones por cobranzas Mes de {factura.periodo} - Rendición N° {str(factura.rendicion).strip()}"
+
+
+def nombre_archivo_grupo(facturas):
+    """Nombre legible del PDF de un comprobante que agrupa varias rendiciones"""
+    if len(facturas) == 1:
+        return nombre_archivo_factura(facturas[0])
+    primera = facturas[0]
+    rendiciones = ", ".join(normalizar_rendicion(f.rendicion) for f in facturas)
+    nombre = f"{primera.cliente} x Honorarios {primera.periodo} - Rendiciones N° {rendiciones}.pdf"
+    return nombre.replace('/', '-').replace('\\', '-')
+
+
+def clave_grupo(factura):
+    """
+    Facturas con la misma clave pueden ir en un mismo comprobante.
+
+    Incluye la fecha: el comprobante toma la fecha (y el periodo facturado
+    desde/hasta y el vencimiento) de su primera fila, así que filas con otra
+    fecha van en otro comprobante.
+    """
+    fecha = factura.fecha.date() if hasattr(factura.fecha, 'date') else factura.fecha
+    return (str(factura.cliente).strip().upper(), factura.cuit,
+            str(factura.periodo).strip().upper(), str(factura.cond_iva).strip().upper(), fecha)
+
+
+def agrupar_facturas(facturas, max_items=MAX_LINEAS_DETALLE):
+    """
+    Agrupa las facturas pendientes por cliente, CUIT, periodo, condición de IVA y fecha.
+
+    Se respeta el orden del Excel: cada grupo aparece donde estaba su primera
+    fila. Los grupos de más de max_items filas se parten en varios.
+
+    Returns:
+        list: listas de FacturaData, una por comprobante a emitir
+    """
+    grupos = []
+    abiertos = {}
+    for factura in facturas:
+        clave = clave_grupo(factura)
+        grupo = abiertos.get(clave)
+        if grupo is None or len(grupo) >= max_items:
+            # Se agrega en el lugar de su primera fila
+            grupo = abiertos[clave] = []
+            grupos.append(grupo)
+        grupo.append(factura)
+    return grupos
+
+
+class ReceptorCache:
+    """
+    Datos conocidos de cada receptor (CUIT), guardados entre ejecuciones.
+
+    Sirve para detectar antes de emitir una fila que no coincide con lo que se
+    facturó antes al mismo CUIT (otro nombre u otra condición de IVA, que
+    cambiaría el tipo de comprobante).
+    """
+
+    def __init__(self, path=ARCHIVO_DEFAULT / "receptores.json"):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._modificados = set()
+        self._data = read_json(self.path, "la caché de receptores")
+
+    def check(self, factura):
+        """
+        Compara la factura con los datos conocidos de su CUIT.
+
+        Returns:
+            list: avisos (vacía si no hay diferencias o el CUIT es nuevo)
+        """
+        with self._lock:
+            conocido = self._data.get(factura.cuit)
+        if not conocido:
+            return []
+        avisos = []
+        if conocido['cond_iva'] != factura.cond_iva:
+            avisos.append(f"CUIT {factura.cuit}: condición de IVA {factura.cond_iva}, "
+                          f"antes se facturó como {conocido['cond_iva']}")
+        if conocido['cliente'].strip().upper() != factura.cliente.strip().upper():
+            avisos.append(f"CUIT {factura.cuit}: cliente '{factura.cliente}', "
+                          f"antes se facturó a '{conocido['cliente']}'")
+        return avisos
+
+    def record(self, factura):
+        """Registra los datos con los que se emitió una factura"""
+        with self._lock:
+            self._data[factura.cuit] = {
+                'cliente': factura.cliente,
+                'cond_iva': factura.cond_iva,
+                'ultima': datetime.now().isoformat(timespec='seconds')
+            }
+            self._modificados.add(factura.cuit)
+
+    def save(self):
+        """
+        Guarda la caché si hubo cambios (escritura atómica).
+
+        Bajo bloqueo se relee el archivo y solo se reemplazan los CUIT que
+        registró este proceso, para no perder los de otro que facture a la vez.
+        """
+        with self._lock:
+            if not self._modificados:
+                return
+            with file_lock(self.path):
+                en_disco = read_json(self.path, "la caché de receptores")
+                for cuit in self._modificados:
+                    en_disco[cuit] = self._data[cuit]
+                write_json(self.path, en_disco)
+            self._data = en_disco
+            self._modificados.clear()
+
+
+@dataclass
+class PreparedInvoice:
+    """
+    Datos de un comprobante calculados antes de que el navegador llegue a él.
+
+    factura es la fila que define el encabezado (fecha, receptor); lineas
+    tiene una tupla (factura, descripción) por línea de detalle, que es una
+    sola salvo al agrupar rendiciones.
+    """
+    factura: object
+    valida: bool
+    lineas: list = field(default_factory=list)
+    nombre_archivo: str = None
+    ya_facturadas: list = field(default_factory=list)
+    rechazadas: list = field(default_factory=list)
+    avisos: list = field(default_factory=list)
+
+    @property
+    def descripcion(self):
+        return self.lineas[0][1] if self.lineas else None
+
+
+class InvoicePipeline:
+    """
+    Recorre las facturas preparando la siguiente mientras se emite la actual.
+
+    Con agrupar=True cada elemento es un comprobante con una línea de detalle
+    por rendición del mismo cliente, CUIT, periodo y fecha (ver agrupar_facturas).
+
+    El trabajo que no usa el navegador (validación, caché de receptores,
+    descripción, nombre del PDF y control de duplicados) de la factura N+1
+    se hace en un hilo aparte durante las esperas del asistente de la
+    factura N, así cada factura solo espera a la página.
+
+    El control de duplicados adelantado solo sirve para saltear antes: si dio
+    negativo hay que repetirlo (es una consulta en memoria) al momento de
+    emitir, porque la factura N puede archivar la misma rendición.
+    """
+
+    def __init__(self, facturas, excel_handler, archive, receptores=None, agrupar=False,
+                 max_items=MAX_LINEAS_DETALLE):
+        """
+        Args:
+            facturas: lista de FacturaData pendientes
+            excel_handler: ExcelHandler que valida las facturas
+            archive: ComprobanteArchive para el control de duplicados
+            receptores: ReceptorCache (opcional)
+            agrupar: emitir un comprobante por grupo de rendiciones
+            max_items: líneas de detalle por comprobante al agrupar
+        """
+        facturas = list(facturas)
+        self.grupos = agrupar_facturas(facturas, max_items) if agrupar else [[f] for f in facturas]
+        self.excel_handler = excel_handler
+        self.archive = archive
+        self.receptores = receptores
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+
+    def prepare(self, grupo):
+        """Calcula los datos del comprobante que no dependen del navegador"""
+        with correlation(grupo[0]):
+            validas = []
+            rechazadas = []
+            for factura in grupo:
+                (validas if self.excel_handler.validate_factura_data(factura) else rechazadas).append(factura)
+            if not validas:
+                return PreparedInvoice(grupo[0], valida=False, rechazadas=rechazadas)
+            avisos = self.receptores.check(validas[0]) if self.receptores else []
+            for aviso in avisos:
+                logger.warning(aviso)
+            return PreparedInvoice(
+                validas[0],
+                valida=True,
+                lineas=[(f, descripcion_factura(f)) for f in validas],
+                nombre_archivo=nombre_archivo_grupo(validas),
+                ya_facturadas=[f for f in validas if self.archive.is_invoiced(f)],
+                rechazadas=rechazadas,
+                avisos=avisos
+            )
+
+    def requeue(self, facturas):
+        """Vuelve a encolar un comprobante que falló para reintentarlo al final del lote"""
+        self.grupos.append(list(facturas))
+
+    def __iter__(self):
+        # Se recorre por índice: requeue puede agregar grupos mientras tanto
+        indice = 0
+        siguiente = self._executor.submit(self.prepare, self.grupos[0]) if self.grupos else None
+        while siguiente is not None:
+            actual = siguiente
+            indice += 1
+            siguiente = self._executor.submit(self.prepare, self.grupos[indice]) if indice < len(self.grupos) else None
+            yield actual.result()
+            if siguiente is None and indice < len(self.grupos):
+                siguiente = self._executor.submit(self.prepare, self.grupos[indice])
+
+    def close(self):
+        """Cancela la preparación pendiente (p. ej. si se detuvo el lote)"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -6,18 +6,15 @@ import logging
 import time
 import os
 import time
-import shutil
-from pathlib import Path
-
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('invoice_processor.log'),
-        logging.StreamHandler()
-    ]
-)
+from archive_handler import ComprobanteArchive
+import invoice_journal
+import config
+import metrics
+from log_config import correlation
+from diagnostics import NULL_DIAGNOSTICS
+from invoice_pipeline import descripcion_factura
+from retry_policy import POLITICA_DESCARGA, PortalValidationError
+from alert_handler import IMPRIMIR_XPATH
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +24,8 @@ class InvoiceProcessor:
     Maneja todo el flujo de creación de facturas desde el inicio hasta el fin.
     """
     
-    def __init__(self, driver, element_handler, alert_handler):
+    def __init__(self, driver, element_handler, alert_handler, archive=None, journal=None, profiler=None,
+                 diagnostics=None, empresa=None, downloads_folder=None):
         """
         Inicializa el procesador de facturas.
         
@@ -35,10 +33,26 @@ class InvoiceProcessor:
             driver: WebDriver de Selenium
             element_handler: Instancia de ElementHandler
             alert_handler: Instancia de AlertHandler
+            archive: Instancia de ComprobanteArchive (opcional, se usa la carpeta por defecto)
+            journal: Instancia de InvoiceJournal para registrar el estado de cada factura (opcional)
+            profiler: StepProfiler (opcional, por defecto el del element_handler)
+            diagnostics: Diagnostics para capturar el estado del navegador ante fallas (opcional)
+            empresa: EmpresaConfig con punto de venta, actividad y carpeta destino
+                     (opcional, por defecto la empresa predeterminada de la configuración)
+            downloads_folder: carpeta de descargas del navegador (opcional, por defecto la de la configuración)
+
+        Los reintentos usan la RetryPolicy del element_handler.
         """
         self.driver = driver
         self.handler = element_handler
         self.alert_handler = alert_handler
+        self.archive = archive if archive is not None else ComprobanteArchive()
+        self.journal = journal
+        self.profiler = profiler or element_handler.profiler
+        self.diagnostics = diagnostics or NULL_DIAGNOSTICS
+        self.retry_policy = element_handler.retry_policy
+        self.empresa = empresa or config.current().empresa()
+        self.downloads_folder = downloads_folder or config.current().downloads
         self.wait = WebDriverWait(driver, 10)
 
     def process_invoice(self, factura):
@@ -51,8 +65,20 @@ class InvoiceProcessor:
         Returns:
             bool: True si el proceso fue exitoso, False si falló
         """
+        with correlation(factura):
+            return self._process_invoice(factura)
+
+    def _process_invoice(self, factura):
+        """Pasos de process_invoice, dentro del contexto de correlación de la factura"""
         logger.info(f"Iniciando procesamiento de factura para {factura.cliente}")
         
+        # Nunca volver a confirmar una factura que el journal registra como confirmada
+        if self.journal and self.journal.reached(factura, invoice_journal.CONFIRMED):
+            logger.warning(f"La factura de {factura.cliente} ya está en estado "
+                           f"'{self.journal.state(factura)}', no se vuelve a emitir")
+            return self.journal.reached(factura, invoice_journal.FILED)
+
+        self.profiler.begin_invoice(factura)
         try:
             # Secuencia de pasos para procesar la factura
             steps = [
@@ -66,19 +92,34 @@ class InvoiceProcessor:
             
             # Ejecutar cada paso
             for step in steps:
-                if not step(factura):
+                self.diagnostics.record_step(step.__name__, factura)
+                with self.profiler.step(step.__name__):
+                    ok = step(factura)
+                    if not ok:
+                        self.profiler.mark_failed()
+                if not ok:
                     logger.error(f"Falló el paso {step.__name__} para {factura.cliente}")
-                    self.driver.save_screenshot(f"error_{step.__name__}_{factura.cliente}.png")
+                    self.diagnostics.capture_failure(step.__name__, factura)
+                    self.profiler.end_invoice(ok=False)
                     return False
+                if step == self._fill_invoice_details:
+                    self._journal(factura, invoice_journal.FORM_FILLED)
                     
             logger.info(f"Factura procesada exitosamente para {factura.cliente}")
+            self.profiler.end_invoice(ok=True)
             return True
             
         except Exception as e:
             logger.error(f"Error procesando factura para {factura.cliente}: {str(e)}")
-            self.driver.save_screenshot(f"error_factura_{factura.cliente}.png")
+            self.diagnostics.capture_failure(factura=factura, error=e)
+            self.profiler.end_invoice(ok=False)
             return False
 
+    def _journal(self, factura, estado, **datos):
+        """Registra una transición de estado si hay journal configurado"""
+        if self.journal:
+            self.journal.advance(factura, estado, **datos)
+
     def _init_invoice(self, factura):
         """Inicia el proceso de facturación"""
         try:
@@ -92,7 +133,7 @@ class InvoiceProcessor:
             # Seleccionar Punto de Venta
             if not self.handler.safe_select(
                 "puntodeventa",
-                "4",
+                self.empresa.punto_venta,
                 description="Punto de Venta"
             ):
                 return False
@@ -107,12 +148,17 @@ class InvoiceProcessor:
                 return False
 
             # Click en Continuar
-            return self.handler.safe_click(
+            if not self.handler.safe_click(
                 (By.XPATH, "//input[@type='button' and @value='Continuar >' and @onclick='validarCampos();']"),
                 js_fallback="validarCampos();",
                 description="Botón Continuar"
-            )
+            ):
+                return False
+            self.alert_handler.check_validation_error(self.driver, factura, "tipo_comprobante")
+            return True
 
+        except PortalValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error en inicialización de factura: {str(e)}")
             return False
@@ -131,7 +177,7 @@ class InvoiceProcessor:
             # Seleccionar Actividad
             if not self.handler.safe_select(
                 "actiAsociadaId",
-                "682091",
+                self.empresa.actividad,
                 description="Actividad"
             ):
                 return False
@@ -184,6 +230,7 @@ class InvoiceProcessor:
 
             # Agregar una pausa para asegurar que la página se cargue
             time.sleep(2)
+            self.alert_handler.check_validation_error(self.driver, factura, "fechas")
                 
             # Seleccionar condición IVA
             condicion_iva_map = {
@@ -226,9 +273,12 @@ class InvoiceProcessor:
 
             # Agregar pausa para asegurar que la página se cargue
             time.sleep(2)
+            self.alert_handler.check_validation_error(self.driver, factura, "receptor")
 
             return True
 
+        except PortalValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error en información del cliente: {str(e)}")
 
@@ -236,7 +286,7 @@ class InvoiceProcessor:
         """Completa los detalles de la factura"""
         try:
             # Descripción
-            descripcion = f"Comisiones por cobranzas Mes de {factura.periodo} - Rendición N° {str(factura.rendicion).strip()}"
+            descripcion = descripcion_factura(factura)
             if not self.handler.safe_input(
                 "detalle_descripcion1",
                 descripcion,
@@ -247,7 +297,7 @@ class InvoiceProcessor:
             # Unidad de medida
             if not self.handler.safe_select(
                 "detalle_medida1",
-                "98",
+                self.empresa.unidad_medida,
                 description="Unidad de Medida"
             ):
                 return False
@@ -264,7 +314,7 @@ class InvoiceProcessor:
             if factura.cond_iva.upper() not in ['RI', 'M']:
                 if not self.handler.safe_select(
                     "detalle_tipo_iva1",
-                    "5",  # 21%
+                    self.empresa.alicuota_iva,  # 21%
                     description="Tipo de IVA"
                 ):
                     return False
@@ -279,9 +329,12 @@ class InvoiceProcessor:
 
             # Pequeña pausa para asegurar que la página se actualice
             time.sleep(2)
+            self.alert_handler.check_validation_error(self.driver, factura, "detalle")
 
             return True
 
+        except PortalValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error en detalles de factura: {str(e)}")
             return False
@@ -290,8 +343,8 @@ class InvoiceProcessor:
         """Confirma y finaliza la factura, maneja el PDF descargado"""
         try:
             # Definir rutas al inicio
-            downloads_folder = str(Path.home() / "Downloads")
-            destino_folder = str(Path.home() / "Desktop")  # Usar Path para mayor compatibilidad
+            downloads_folder = self.downloads_folder
+            destino_folder = self.empresa.destino
 
             # Click en Confirmar Datos
             if not self.handler.safe_click(
@@ -305,7 +358,9 @@ class InvoiceProcessor:
             if not self.alert_handler.handle_confirmation(self.driver):
                 logger.error("Error manejando ventana de confirmación")
                 return False
-                
+            # AFIP ya emitió el comprobante: registrarlo antes de cualquier espera
+            # para que una caída nunca lleve a confirmarlo de nuevo
+            self._journal(factura, invoice_journal.CONFIRMED)
             logger.info("Esperando a que la página se actualice después de la confirmación...")
                 
             # Espera más larga y explícita para la actualización de la página
@@ -315,136 +370,95 @@ class InvoiceProcessor:
             except:
                 logger.warning("No se pudo verificar el estado de carga de la página")
 
-            # Espera base más larga
-            time.sleep(5)
-
-            # Verificar el HTML actual
-            page_source = self.driver.page_source
-            logger.info("Estructura actual de la página:")
-            logger.info(page_source)
+            # Un rechazo del portal se informa, pero el Imprimir visible indica éxito
+            self.alert_handler.check_validation_error(self.driver, factura, "confirmacion",
+                                                      success_xpath=IMPRIMIR_XPATH)
 
-            # Lista reducida de localizadores más específicos
+            # Localizadores del botón Imprimir, del más específico al más general
             locators = [
                 (By.XPATH, "//input[@type='button' and @value='Imprimir...']"),  # Más específico
                 (By.XPATH, "//*[@id='botones_comprobante']/input[@type='button']"),  # Por ID y tipo
                 (By.XPATH, "//input[contains(@onclick, 'imprimirComprobante.do')]")  # Por onclick
             ]
 
-            # Buscar todos los botones en la página
-            all_buttons = self.driver.find_elements(By.TAG_NAME, "input")
-            logger.info("Botones encontrados en la página:")
-            for btn in all_buttons:
-                try:
-                    btn_info = {
-                        'type': btn.get_attribute('type'),
-                        'value': btn.get_attribute('value'),
-                        'onclick': btn.get_attribute('onclick'),
-                        'id': btn.get_attribute('id'),
-                        'class': btn.get_attribute('class'),
-                        'is_displayed': btn.is_displayed(),
-                        'is_enabled': btn.is_enabled()
-                    }
-                    logger.info(f"Botón encontrado: {btn_info}")
-                except:
-                    continue
-
-            # Intentar la búsqueda del botón
-            max_intentos = 5
-            for intento in range(max_intentos):
+            def click_imprimir():
+                # Una sola espera para todos los localizadores
+                imprimir_btn = WebDriverWait(self.driver, 10).until(
+                    EC.any_of(*(EC.visibility_of_element_located(locator) for locator in locators))
+                )
+                logger.info("Botón Imprimir encontrado")
+
+                # Scroll con más margen
+                self.driver.execute_script("""
+                    arguments[0].scrollIntoView(true);
+                    window.scrollBy(0, -100);
+                """, imprimir_btn)
+
                 try:
-                    logger.info(f"\nIntento {intento + 1} de encontrar el botón Imprimir")
-                    
-                    for locator in locators:
-                        try:
-                            logger.info(f"Probando localizador: {locator}")
-                            
-                            # Espera explícita más larga
-                            wait = WebDriverWait(self.driver, 10)
-                            imprimir_btn = wait.until(
-                                EC.presence_of_element_located(locator)
-                            )
-                            
-                            logger.info(f"Botón encontrado con localizador {locator}")
-                            logger.info(f"Atributos del botón:")
-                            logger.info(f"- Visible: {imprimir_btn.is_displayed()}")
-                            logger.info(f"- Habilitado: {imprimir_btn.is_enabled()}")
-                            logger.info(f"- HTML: {imprimir_btn.get_attribute('outerHTML')}")
-                            
-                            if not imprimir_btn.is_displayed():
-                                logger.info("Botón no visible, intentando siguiente localizador")
-                                continue
-                            
-                            # Scroll con más margen
-                            self.driver.execute_script("""
-                                arguments[0].scrollIntoView(true);
-                                window.scrollBy(0, -100);
-                            """, imprimir_btn)
-                            time.sleep(2)
-                            
-                            # Intentar click directo con espera explícita
-                            wait.until(EC.element_to_be_clickable(locator))
-                            
-                            try:
-                                logger.info("Intentando click directo...")
-                                imprimir_btn.click()
-                            except Exception as click_e:
-                                logger.warning(f"Click directo falló: {click_e}")
-                                
-                                try:
-                                    logger.info("Intentando click con JavaScript...")
-                                    onclick = imprimir_btn.get_attribute('onclick')
-                                    if onclick:
-                                        logger.info(f"Ejecutando onclick: {onclick}")
-                                        self.driver.execute_script(onclick)
-                                    else:
-                                        self.driver.execute_script("arguments[0].click();", imprimir_btn)
-                                except Exception as js_e:
-                                    logger.warning(f"Click JavaScript falló: {js_e}")
-                                    
-                                    try:
-                                        logger.info("Intentando click con Actions...")
-                                        ActionChains(self.driver).move_to_element(imprimir_btn).pause(1).click().perform()
-                                    except Exception as action_e:
-                                        logger.warning(f"Click Actions falló: {action_e}")
-                                        continue
-                            
-                            # Verificar si el click fue exitoso
-                            logger.info("Verificando si se inició la descarga...")
-                            if self._verify_download_started(downloads_folder):
-                                logger.info("¡Descarga iniciada correctamente!")
-                                time.sleep(5)
-                                
-                                # Procesar el archivo descargado
-                                if self._process_downloaded_file(downloads_folder, destino_folder, factura):
-                                    # Solo si todo el proceso fue exitoso, hacer click en Menú Principal
-                                    return self.handler.safe_click(
-                                        (By.XPATH, "//input[@value='Menú Principal']"),
-                                        js_fallback="parent.location.href='menu_ppal.jsp'",
-                                        description="Botón Menú Principal"
-                                    )
-                            else:
-                                logger.warning("No se detectó inicio de descarga")
-                                
-                        except Exception as e:
-                            logger.warning(f"Error con localizador {locator}: {str(e)}")
-                            continue
-                    
-                    time.sleep(2)
-                    
-                except Exception as e:
-                    logger.warning(f"Error en intento {intento + 1}: {str(e)}")
-                    if intento == max_intentos - 1:
-                        logger.error("No se pudo hacer click en Imprimir")
-                        self.driver.save_screenshot("error_imprimir.png")
-                        return False
+                    logger.info("Intentando click directo...")
+                    imprimir_btn.click()
+                except Exception as click_e:
+                    logger.warning(f"Click directo falló: {click_e}")
+                    try:
+                        logger.info("Intentando click con JavaScript...")
+                        onclick = imprimir_btn.get_attribute('onclick')
+                        if onclick:
+                            logger.info(f"Ejecutando onclick: {onclick}")
+                            self.driver.execute_script(onclick)
+                        else:
+                            self.driver.execute_script("arguments[0].click();", imprimir_btn)
+                    except Exception as js_e:
+                        logger.warning(f"Click JavaScript falló: {js_e}")
+                        logger.info("Intentando click con Actions...")
+                        ActionChains(self.driver).move_to_element(imprimir_btn).pause(1).click().perform()
 
-            return False
+            try:
+                self.retry_policy.call(click_imprimir, description="click en Imprimir", driver=self.driver,
+                                       on_retry=lambda clase, e: self.profiler.note_retry())
+                inicio_descarga = time.monotonic()
+                pdf_path = self.wait_for_download(downloads_folder)
+            except Exception as e:
+                logger.error(f"No se pudo hacer click en Imprimir u obtener el PDF: {str(e)}")
+                return False
+
+            logger.info("¡Descarga iniciada correctamente!")
+            metrics.current().download_wait.observe(time.monotonic() - inicio_descarga)
+            self._journal(factura, invoice_journal.PDF_DOWNLOADED, pdf=pdf_path)
 
+            # Procesar el archivo descargado
+            if not self._process_downloaded_file(downloads_folder, destino_folder, factura, pdf_path):
+                return False
+            self._journal(factura, invoice_journal.FILED)
+            # Solo si todo el proceso fue exitoso, hacer click en Menú Principal
+            return self.handler.safe_click(
+                (By.XPATH, "//input[@value='Menú Principal']"),
+                js_fallback="parent.location.href='menu_ppal.jsp'",
+                description="Botón Menú Principal"
+            )
+
+        except PortalValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error en confirmación de factura: {str(e)}")
-            self.driver.save_screenshot("error_confirmacion.png")
             return False
 
+    def wait_for_download(self, downloads_folder, policy=POLITICA_DESCARGA):
+        """
+        Espera a que aparezca el PDF recién descargado, sondeando con espera creciente.
+
+        Returns:
+            str: ruta del PDF
+
+        Raises:
+            TimeoutError: si no apareció dentro del presupuesto de la política
+        """
+        def descargado():
+            if not self._verify_download_started(downloads_folder):
+                raise TimeoutError("No se encontró un PDF reciente en la carpeta de descargas")
+            return self._latest_pdf(downloads_folder)
+
+        return policy.call(descargado, description="descarga del PDF")
+
     def _verify_download_started(self, downloads_folder):
         """
         Verifica si existe un nuevo archivo PDF en la carpeta de descargas.
@@ -452,18 +466,10 @@ class InvoiceProcessor:
         logger.info("Buscando archivo PDF más reciente...")
         
         try:
-            # Obtener todos los archivos PDF en la carpeta
-            pdf_files = [f for f in os.listdir(downloads_folder) if f.endswith('.pdf')]
-            
-            if not pdf_files:
+            most_recent_file = self._latest_pdf(downloads_folder)
+            if not most_recent_file:
                 logger.warning("No se encontraron archivos PDF en la carpeta de descargas")
                 return False
-                
-            # Obtener el archivo más reciente
-            most_recent_file = max(
-                [os.path.join(downloads_folder, f) for f in pdf_files],
-                key=os.path.getmtime
-            )
             
             # Verificar si el archivo fue creado en los últimos 30 segundos
             file_creation_time = os.path.getctime(most_recent_file)
@@ -480,25 +486,31 @@ class InvoiceProcessor:
             logger.error(f"Error verificando archivo PDF: {str(e)}")
             return False
 
-    def _process_downloaded_file(self, downloads_folder, destino_folder, factura):
+    def _latest_pdf(self, downloads_folder):
+        """
+        Devuelve la ruta del PDF más reciente de la carpeta de descargas, o None.
+        """
+        pdf_files = [f for f in os.listdir(downloads_folder) if f.endswith('.pdf')]
+        if not pdf_files:
+            return None
+        return max(
+            [os.path.join(downloads_folder, f) for f in pdf_files],
+            key=os.path.getmtime
+        )
+
+    def _process_downloaded_file(self, downloads_folder, destino_folder, factura, pdf_path=None, nombre=None):
         """
-        Procesa el archivo PDF más reciente de la carpeta de descargas.
+        Procesa el archivo PDF descargado (por defecto el más reciente de la carpeta de descargas).
+
+        nombre es el nombre con que se publica en destino (por defecto el de nombre_archivo_factura).
         """
         logger.info(f"Procesando archivo para {factura.cliente}")
         
         try:
-            # Obtener el archivo PDF más reciente
-            pdf_files = [f for f in os.listdir(downloads_folder) if f.endswith('.pdf')]
-            
-            if not pdf_files:
+            most_recent_file = pdf_path or self._latest_pdf(downloads_folder)
+            if not most_recent_file:
                 logger.error("No se encontraron archivos PDF")
                 return False
-                
-            # Obtener el archivo más reciente
-            most_recent_file = max(
-                [os.path.join(downloads_folder, f) for f in pdf_files],
-                key=os.path.getmtime
-            )
             
             # Verificar que el archivo existe y tiene tamaño
             if not os.path.exists(most_recent_file):
@@ -509,24 +521,10 @@ class InvoiceProcessor:
                 logger.error(f"Archivo vacío: {most_recent_file}")
                 return False
 
-            # Crear nuevo nombre de archivo
-            nuevo_nombre = (f"{factura.cliente} x Honorarios {factura.periodo} - "
-                        f"Rendición N° {str(factura.rendicion).rstrip('.0')}.pdf")
-            nuevo_nombre = nuevo_nombre.replace('/', '-').replace('\\', '-')
-            
-            # Asegurar que existe la carpeta destino
-            os.makedirs(destino_folder, exist_ok=True)
-            
-            # Ruta completa del archivo destino
-            archivo_destino = os.path.join(destino_folder, nuevo_nombre)
-
-            # Si existe un archivo con el mismo nombre en destino, eliminarlo
-            if os.path.exists(archivo_destino):
-                os.remove(archivo_destino)
-
-            # Mover el archivo
-            shutil.move(most_recent_file, archivo_destino)
-            logger.info(f"Archivo movido exitosamente a: {archivo_destino}")
+            # Archivar por contenido y publicar con nombre legible en destino
+            # (nunca se elimina un comprobante previo con el mismo nombre)
+            entrada = self.archive.store(most_recent_file, factura, destino_folder, nombre=nombre)
+            logger.info(f"Archivo movido exitosamente a: {entrada['publicado']}")
             return True
 
         except Exception as e:
@@ -0,0 +1,122 @@
+import logging
+from pathlib import Path
+
+from archive_handler import ComprobanteArchive, clave_factura
+from invoice_journal import InvoiceJournal
+from ledger_lease import LedgerLeases
+import config
+import invoice_journal
+
+logger = logging.getLogger(__name__)
+
+
+def reanudar_factura(factura, journal, archive, excel_handler, invoice_processor, destino_folder=None):
+    """
+    Retoma una factura desde su último estado durable en el journal.
+
+    destino_folder es la carpeta donde publicar el PDF (por defecto la de la
+    empresa predeterminada).
+
+    Returns:
+        bool: True si la factura ya no debe pasar por el asistente de emisión
+    """
+    estado = journal.state(factura)
+    destino_folder = destino_folder or config.current().empresa().destino
+
+    if estado == invoice_journal.PDF_DOWNLOADED:
+        pdf_path = journal.data(factura).get('pdf')
+        if pdf_path and Path(pdf_path).exists():
+            logger.info(f"Retomando {factura.cliente}: archivando PDF ya descargado {pdf_path}")
+            archive.store(pdf_path, factura, destino_folder)
+            journal.advance(factura, invoice_journal.FILED)
+            estado = invoice_journal.FILED
+        elif vincular_a_grupo(factura, journal, archive):
+            estado = invoice_journal.FILED
+        else:
+            logger.warning(f"Retomando {factura.cliente}: el PDF descargado ya no está en {pdf_path}")
+            estado = invoice_journal.CONFIRMED
+
+    if estado == invoice_journal.CONFIRMED:
+        # El comprobante ya fue emitido: nunca volver a confirmar
+        logger.warning(f"La factura de {factura.cliente} fue confirmada pero no se obtuvo el PDF. "
+              f"Descargarlo manualmente desde 'Consultas' en Comprobantes en Línea.")
+        if excel_handler.marcar_como_realizada(factura):
+            journal.advance(factura, invoice_journal.MARKED, pdf_faltante=True)
+        return True
+
+    if estado in (invoice_journal.FILED, invoice_journal.MARKED):
+        logger.info(f"Retomando {factura.cliente}: comprobante ya archivado, se marca como realizada")
+        if excel_handler.marcar_como_realizada(factura):
+            journal.advance(factura, invoice_journal.MARKED)
+        return True
+
+    # pending / form_filled: el formulario vivía en el navegador, se reinicia el asistente
+    return False
+
+
+def vincular_a_grupo(factura, journal, archive):
+    """
+    Vincula una rendición de un comprobante agrupado al PDF ya archivado por otra.
+
+    Todas las filas de un comprobante agrupado comparten el mismo PDF
+    descargado; la primera que se archiva lo mueve, así que las demás se
+    resuelven por el índice del archivo.
+
+    Returns:
+        bool: True si se encontró el comprobante archivado y quedó vinculada
+    """
+    for clave in journal.data(factura).get('grupo') or []:
+        entrada = archive.lookup(clave)
+        if entrada is not None and clave != clave_factura(factura):
+            archive.link(factura, entrada)
+            journal.advance(factura, invoice_journal.FILED)
+            return True
+    return False
+
+
+def archivar_descargas_pendientes(journal, archive, destino_folder=None):
+    """Archiva los PDF que quedaron descargados pero sin archivar (cola de descargas)"""
+    destino_folder = destino_folder or config.current().empresa().destino
+    for factura, pdf_path in journal.pending_downloads():
+        if not Path(pdf_path).exists():
+            vincular_a_grupo(factura, journal, archive)
+            continue
+        logger.info(f"Archivando PDF pendiente de {factura.cliente}: {pdf_path}")
+        archive.store(pdf_path, factura, destino_folder)
+        journal.advance(factura, invoice_journal.FILED)
+
+
+def reanudar_ledger(empresa=None, excel_path=None, archive=None):
+    """
+    Recupera sin navegador lo que quedó a medias en el journal de un Excel.
+
+    Archiva los PDF descargados y marca como realizadas las filas cuyo
+    comprobante ya fue confirmado; las que no llegaron a confirmarse quedan
+    pendientes para la próxima emisión.
+
+    Returns:
+        tuple: (filas recuperadas, filas que siguen pendientes)
+    """
+    empresa = empresa or config.current().empresa()
+    excel_path = excel_path or empresa.ledger
+    archive = archive if archive is not None else ComprobanteArchive()
+    journal = InvoiceJournal.for_ledger(excel_path)
+    archivar_descargas_pendientes(journal, archive, empresa.destino)
+
+    # pandas solo se carga al leer el Excel (archivar descargas no lo necesita)
+    from excel_handler import ExcelHandler
+
+    excel_handler = ExcelHandler(excel_path, leases=LedgerLeases.for_ledger(excel_path))
+    if not excel_handler.load_excel():
+        raise Exception("No se pudo cargar el archivo Excel")
+    recuperadas = 0
+    pendientes = 0
+    for factura in excel_handler.get_facturas_pendientes():
+        if journal.state(factura) != invoice_journal.PENDING and reanudar_factura(
+                factura, journal, archive, excel_handler, None, empresa.destino):
+            recuperadas += 1
+        else:
+            pendientes += 1
+    excel_handler.flush()
+    logger.info(f"{excel_path}: {recuperadas} fila(s) recuperadas del journal, {pendientes} pendiente(s)")
+    return recuperadas, pendientes
@@ -0,0 +1,153 @@
+import csv
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from archive_handler import clave_factura, normalizar_rendicion
+from json_state import file_lock, read_json, write_json
+import retry_policy
+
+logger = logging.getLogger(__name__)
+
+# Intentos fallidos de una fila antes de descartarla
+MAX_INTENTOS = 3
+
+# Clases de error que no se reintentan: la fila se descarta al primer intento
+CLASES_PERMANENTES = (retry_policy.VALIDATION,)
+
+COLUMNAS_RECHAZADAS = ['fecha', 'fila', 'cliente', 'cuit', 'rendicion', 'periodo',
+                       'intentos', 'clase', 'error', 'diagnostico']
+
+
+class InvoiceRequeue:
+    """
+    Intentos fallidos por fila del Excel y reporte de filas descartadas.
+
+    Los intentos se guardan junto al Excel (.intentos.json) y sobreviven entre
+    ejecuciones. Una fila que falla se reintenta al final del lote mientras no
+    supere max_attempts; después, o ante un error permanente (datos rechazados
+    por el portal), se agrega al reporte de rechazadas (.rechazadas.csv) con la
+    clase de error y la captura de diagnóstico, y deja de ocupar el navegador.
+    Para volver a intentarla basta con corregir la fila y borrar su entrada
+    del archivo de intentos (o el archivo completo).
+    """
+
+    def __init__(self, path, dead_letter_path, max_attempts=MAX_INTENTOS):
+        """
+        Args:
+            path: archivo JSON con los intentos por fila
+            dead_letter_path: CSV de filas descartadas
+            max_attempts: intentos fallidos antes de descartar una fila
+        """
+        self.path = Path(path)
+        self.dead_letter_path = Path(dead_letter_path)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._modificadas = set()
+        self._data = self._load()
+
+    @classmethod
+    def for_ledger(cls, excel_path, **kwargs):
+        """Intentos y rechazadas asociados a un Excel (.intentos.json / .rechazadas.csv)"""
+        excel_path = Path(excel_path)
+        return cls(excel_path.with_suffix('.intentos.json'), excel_path.with_suffix('.rechazadas.csv'), **kwargs)
+
+    def _load(self):
+        return read_json(self.path, "el archivo de intentos")
+
+    def attempts(self, factura):
+        """Intentos fallidos registrados para la fila"""
+        with self._lock:
+            return self._data.get(clave_factura(factura), {}).get('intentos', 0)
+
+    def is_dead(self, factura):
+        """Indica si la fila fue descartada"""
+        with self._lock:
+            return self._data.get(clave_factura(factura), {}).get('descartada', False)
+
+    def record_failure(self, factura, error_class, error, diagnostico=None):
+        """
+        Registra un intento fallido.
+
+        Args:
+            factura: FacturaData que falló
+            error_class: clase de error de retry_policy.classify
+            error: excepción o mensaje
+            diagnostico: ruta de la captura de Diagnostics (opcional)
+
+        Returns:
+            bool: True si la fila debe reintentarse, False si quedó descartada
+        """
+        clave = clave_factura(factura)
+        with self._lock:
+            entrada = self._data.setdefault(clave, {'intentos': 0})
+            entrada['intentos'] += 1
+            entrada['clase'] = error_class
+            entrada['error'] = str(error)
+            entrada['diagnostico'] = diagnostico
+            entrada['ultimo'] = datetime.now().isoformat(timespec='seconds')
+            descartar = entrada['intentos'] >= self.max_attempts or error_class in CLASES_PERMANENTES
+            entrada['descartada'] = descartar
+            self._modificadas.add(clave)
+            intentos = entrada['intentos']
+        if descartar:
+            logger.error(f"Factura de {factura.cliente} (rendición {factura.rendicion}) descartada tras "
+                         f"{intentos} intento(s) ({error_class}); ver {self.dead_letter_path}")
+            self._dead_letter(factura, intentos, error_class, error, diagnostico)
+        else:
+            logger.info(f"Factura de {factura.cliente} (rendición {factura.rendicion}) se reintenta al final "
+                        f"del lote (intento {intentos} de {self.max_attempts})")
+        self.save()
+        return not descartar
+
+    def record_success(self, factura):
+        """Olvida los intentos fallidos de una fila emitida"""
+        clave = clave_factura(factura)
+        with self._lock:
+            if self._data.pop(clave, None) is None:
+                return
+            self._modificadas.add(clave)
+        self.save()
+
+    def _dead_letter(self, factura, intentos, error_class, error, diagnostico):
+        """Agrega la fila al CSV de rechazadas"""
+        nuevo = not self.dead_letter_path.exists()
+        with open(self.dead_letter_path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNAS_RECHAZADAS)
+            if nuevo:
+                writer.writeheader()
+            writer.writerow({
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'fila': factura.row_index,
+                'cliente': factura.cliente,
+                'cuit': factura.cuit,
+                'rendicion': normalizar_rendicion(factura.rendicion),
+                'periodo': factura.periodo,
+                'intentos': intentos,
+                'clase': error_class,
+                'error': str(error),
+                'diagnostico': diagnostico or ''
+            })
+
+    def save(self):
+        """
+        Guarda los intentos (escritura atómica).
+
+        Bajo bloqueo entre procesos se relee el archivo y solo se reemplazan
+        las filas que cambió este proceso, para no pisar los intentos de otro
+        proceso que facture el mismo Excel.
+        """
+        with self._lock:
+            if not self._modificadas:
+                return
+            with file_lock(self.path):
+                en_disco = self._load()
+                for clave in self._modificadas:
+                    if clave in self._data:
+                        en_disco[clave] = self._data[clave]
+                    else:
+                        en_disco.pop(clave, None)
+                write_json(self.path, en_disco)
+            self._data = en_disco
+            self._modificadas.clear()
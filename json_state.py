@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def lock_path(path):
+    """Archivo de bloqueo asociado a un archivo de estado (mismo nombre + .lock)"""
+    path = Path(path)
+    return path.with_name(path.name + '.lock')
+
+
+@contextmanager
+def file_lock(path, timeout=30):
+    """
+    Bloqueo exclusivo entre procesos (y entre hilos) sobre un archivo de estado.
+
+    Igual que LedgerLeases.exclusive(), el bloqueo es una transacción
+    EXCLUSIVE de SQLite sobre un archivo .lock junto al archivo protegido, así
+    funciona igual en Linux y en Windows y se libera solo si el proceso muere.
+
+    Args:
+        path: archivo a proteger
+        timeout: segundos máximos de espera del bloqueo
+    """
+    lock = lock_path(path)
+    lock.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(lock, timeout=timeout, isolation_level=None)) as conn:
+        conn.execute("BEGIN EXCLUSIVE")
+        try:
+            yield
+        finally:
+            conn.execute("ROLLBACK")
+
+
+def read_json(path, descripcion="archivo"):
+    """
+    Lee un archivo JSON de estado.
+
+    Returns:
+        dict: el contenido, o vacío si no existe o no se puede leer
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"No se pudo leer {descripcion} ({str(e)}), se empieza vacío")
+        return {}
+
+
+def write_json(path, data):
+    """
+    Escribe un archivo JSON de forma atómica.
+
+    El temporal tiene nombre único en la misma carpeta, así dos escritores no
+    comparten el temporal y el reemplazo nunca deja un archivo a medias.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
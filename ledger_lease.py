@@ -0,0 +1,148 @@
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+from archive_handler import clave_factura
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    clave TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    fila INTEGER,
+    expires REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class LedgerLeases:
+    """
+    Reservas de filas del Excel para que varios procesos facturen en paralelo.
+
+    Cada proceso reserva una fila antes de emitirla (claim). La reserva vence
+    a los ttl segundos si no se renueva, de modo que las filas de un proceso
+    caído vuelven a quedar disponibles. Una fila marcada como realizada queda
+    cerrada y ya no se puede reservar.
+
+    Las reservas viven en una base SQLite junto al Excel; SQLite se encarga del
+    bloqueo entre procesos, tanto para las reservas como para exclusive(), que
+    serializa las escrituras del Excel.
+    """
+
+    def __init__(self, path, owner=None, ttl=600):
+        """
+        Args:
+            path: ruta de la base de reservas
+            owner: identificador de este proceso (por defecto host:pid:aleatorio)
+            ttl: segundos de validez de una reserva sin renovar
+        """
+        self.path = Path(path)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(_SCHEMA)
+
+    @classmethod
+    def for_ledger(cls, excel_path, **kwargs):
+        """Reservas asociadas a un archivo Excel (mismo nombre, .leases.sqlite)"""
+        return cls(Path(excel_path).with_suffix('.leases.sqlite'), **kwargs)
+
+    def _connect(self):
+        # isolation_level=None: las transacciones se abren explícitamente con BEGIN
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self, mode='IMMEDIATE'):
+        conn = self._connect()
+        try:
+            conn.execute(f"BEGIN {mode}")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def claim(self, factura):
+        """
+        Reserva la fila para este proceso.
+
+        Returns:
+            bool: True si quedó reservada (o ya lo estaba por este proceso)
+        """
+        clave = clave_factura(factura)
+        ahora = time.time()
+        with self._transaction() as conn:
+            fila = conn.execute("SELECT owner, expires, done FROM leases WHERE clave = ?", (clave,)).fetchone()
+            if fila is not None:
+                owner, expires, done = fila
+                if done:
+                    return False
+                if owner != self.owner and expires > ahora:
+                    return False
+                if owner != self.owner:
+                    logger.warning(f"Reserva vencida de {owner} sobre {factura.cliente}, se toma")
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (clave, owner, fila, expires, done) VALUES (?, ?, ?, ?, 0)",
+                (clave, self.owner, factura.row_index, ahora + self.ttl))
+        return True
+
+    def renew(self, factura):
+        """
+        Extiende la reserva de la fila.
+
+        Returns:
+            bool: False si la reserva ya no pertenece a este proceso
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE leases SET expires = ? WHERE clave = ? AND owner = ? AND done = 0",
+                (time.time() + self.ttl, clave_factura(factura), self.owner))
+            return cursor.rowcount == 1
+
+    def release(self, factura):
+        """Libera la reserva para que otro proceso pueda reintentar la fila"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE clave = ? AND owner = ? AND done = 0",
+                         (clave_factura(factura), self.owner))
+
+    def complete(self, factura):
+        """Cierra la fila: ya está realizada y ningún proceso debe volver a reservarla"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (clave, owner, fila, expires, done) VALUES (?, ?, ?, ?, 1)",
+                (clave_factura(factura), self.owner, factura.row_index, time.time()))
+
+    def is_done(self, factura):
+        """Indica si algún proceso ya cerró la fila"""
+        with closing(self._connect()) as conn:
+            fila = conn.execute("SELECT done FROM leases WHERE clave = ?", (clave_factura(factura),)).fetchone()
+        return bool(fila and fila[0])
+
+    def release_all(self):
+        """Libera todas las reservas abiertas de este proceso"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM leases WHERE owner = ? AND done = 0", (self.owner,))
+        if cursor.rowcount:
+            logger.info(f"Se liberaron {cursor.rowcount} reservas")
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Bloqueo exclusivo entre procesos mientras dura el bloque.
+
+        Se usa para releer, modificar y guardar el Excel sin pisar las marcas
+        que otro proceso haya guardado mientras tanto.
+        """
+        with self._transaction('EXCLUSIVE'):
+            yield
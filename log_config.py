@@ -0,0 +1,127 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+from contextlib import contextmanager
+from datetime import datetime
+
+from archive_handler import normalizar_rendicion
+
+# Id de correlación de la factura en curso (se propaga a todos los registros)
+_correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+# Atributos estándar de LogRecord que no se repiten como campos extra
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'correlation_id'}
+
+_listener = None
+
+
+def correlation_id_for(factura):
+    """Id de correlación estable para una factura: fila y rendición"""
+    return f"r{factura.row_index}-{normalizar_rendicion(factura.rendicion)}"
+
+
+def set_correlation_id(value):
+    """Fija el id de correlación del contexto actual (None para limpiarlo)"""
+    _correlation_id.set(value)
+
+
+@contextmanager
+def correlation(factura):
+    """Asocia todos los registros del bloque a la factura"""
+    token = _correlation_id.set(correlation_id_for(factura))
+    try:
+        yield
+    finally:
+        _correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """Agrega correlation_id al registro en el hilo que lo emite"""
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON"""
+
+    def format(self, record):
+        evento = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'correlation_id', None):
+            evento['correlation_id'] = record.correlation_id
+        for clave, valor in vars(record).items():
+            if clave not in _RESERVED and not clave.startswith('_'):
+                evento[clave] = valor
+        if record.exc_info:
+            evento['exc'] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Formato legible para consola, con el id de correlación si existe"""
+
+    def format(self, record):
+        base = super().format(record)
+        cid = getattr(record, 'correlation_id', None)
+        return f"[{cid}] {base}" if cid else base
+
+
+def configure_logging(log_file='facturacion.log', level=logging.INFO, console=True,
+                      max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    Configura un único pipeline de logging asíncrono para todo el proceso.
+
+    Los registros se encolan (QueueHandler) y un hilo (QueueListener) los
+    escribe en JSON a un archivo con rotación por tamaño y, opcionalmente, en
+    formato legible a consola. Llamadas repetidas no hacen nada.
+
+    Args:
+        log_file: archivo JSON lines (None para no escribir a disco)
+        level: nivel mínimo
+        console: mostrar también por consola
+        max_bytes: tamaño máximo antes de rotar
+        backup_count: cantidad de archivos rotados a conservar
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    destinos = []
+    if log_file:
+        archivo = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        archivo.setFormatter(JsonFormatter())
+        destinos.append(archivo)
+    if console:
+        consola = logging.StreamHandler()
+        consola.setFormatter(ConsoleFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        destinos.append(consola)
+
+    cola = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(cola)
+    handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(cola, *destinos, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Vacía la cola y detiene el hilo de escritura"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,29 +1,37 @@
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select
 from selenium.common.exceptions import TimeoutException, NoAlertPresentException
-from pathlib import Path
+import argparse
+import logging
 import time
 import random
-import keyboard  # Para detectar la tecla Esc
 from excel_handler import ExcelHandler, FacturaData 
 from invoice_processor import InvoiceProcessor
 from element_handler import ElementHandler  # Si no lo tienes ya importado
-from alert_handler import AlertHandler 
-
-def get_random_user_agent():
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15'
-    ]
-    return random.choice(user_agents)
+from alert_handler import AlertHandler, IMPRIMIR_XPATH
+from browser_manager import BrowserManager
+from archive_handler import ComprobanteArchive, clave_factura
+from invoice_journal import InvoiceJournal
+from ledger_lease import LedgerLeases
+from invoice_requeue import InvoiceRequeue
+from invoice_recovery import archivar_descargas_pendientes, reanudar_factura
+from invoice_pipeline import InvoicePipeline, ReceptorCache, nombre_archivo_grupo
+import invoice_journal
+import retry_policy
+from run_lifecycle import RunLifecycle, BATCH, INTERACTIVE
+from step_profiler import StepProfiler, NULL_PROFILER
+from diagnostics import Diagnostics, NULL_DIAGNOSTICS
+from screenshot_store import ScreenshotStore
+import metrics
+import config
+from log_config import configure_logging, correlation_id_for, set_correlation_id
+
+logger = logging.getLogger(__name__)
+
+# Fallas seguidas del loop principal antes de abandonar la ejecución
+MAX_FALLAS_SEGUIDAS = 3
 
 def manejar_ventana_confirmacion(driver):
     try:
@@ -34,19 +42,19 @@ def manejar_ventana_confirmacion(driver):
         try:
             alert = driver.switch_to.alert
             alert.accept()
-            print("Alerta aceptada correctamente")
+            logger.info("Alerta aceptada correctamente")
             return True
         except NoAlertPresentException:
-            print("No se encontró alerta simple, probando otros métodos...")
+            logger.warning("No se encontró alerta simple, probando otros métodos...")
 
         # Método 2: Usando wait explícito para alert
         try:
             alert = WebDriverWait(driver, 10).until(EC.alert_is_present())
             alert.accept()
-            print("Alerta aceptada con espera explícita")
+            logger.info("Alerta aceptada con espera explícita")
             return True
         except TimeoutException:
-            print("No se encontró alerta con espera explícita, probando otros métodos...")
+            logger.warning("No se encontró alerta con espera explícita, probando otros métodos...")
 
         # Método 3: Cambiar a ventana emergente
         try:
@@ -69,189 +77,506 @@ def manejar_ventana_confirmacion(driver):
                     
                     # Volver a la ventana principal
                     driver.switch_to.window(main_window)
-                    print("Ventana emergente manejada correctamente")
+                    logger.info("Ventana emergente manejada correctamente")
                     return True
         except Exception as e:
-            print(f"Error al manejar ventana emergente: {str(e)}")
+            logger.error(f"Error al manejar ventana emergente: {str(e)}")
 
         # Método 4: Intento con JavaScript
         try:
             driver.execute_script("document.querySelector('button.aceptar').click();")
-            print("Ventana manejada con JavaScript")
+            logger.info("Ventana manejada con JavaScript")
             return True
         except Exception as e:
-            print(f"Error al intentar con JavaScript: {str(e)}")
+            logger.error(f"Error al intentar con JavaScript: {str(e)}")
 
         return False
 
     except Exception as e:
-        print(f"Error general en manejo de ventana: {str(e)}")
+        logger.error(f"Error general en manejo de ventana: {str(e)}")
         return False
 
-def login_afip(cuit, password):
-    options = webdriver.ChromeOptions()
-    user_agent = get_random_user_agent()
-    options.add_argument(f'user-agent={user_agent}')
-    options.add_argument('--disable-blink-features=AutomationControlled')
-    options.add_experimental_option('excludeSwitches', ['enable-automation'])
-    options.add_experimental_option('useAutomationExtension', False)
-    
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
-    
-    driver.execute_cdp_cmd('Network.setUserAgentOverride', {"userAgent": user_agent})
-    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-    
-    time.sleep(random.uniform(1, 3))
-    
+def iniciar_sesion(driver, cuit, password, login_url=None, empresa=None, browser=None):
+    """
+    Inicia sesión en AFIP, abre Comprobantes en Línea y selecciona la empresa.
+    Al terminar el driver queda en el menú principal (menu_ppal.jsp).
+
+    login_url permite apuntar al portal simulado (portal_simulado.py); login_url
+    y empresa (EmpresaConfig) salen por defecto de la configuración actual.
+    Con browser (BrowserManager) se aplica su configuración CDP a la pestaña
+    de Comprobantes en Línea, donde transcurre todo el asistente.
+    """
+    login_url = login_url or config.current().login_url
+    empresa = empresa or config.current().empresa()
+    driver.get(login_url)
+    wait = WebDriverWait(driver, 10)
+
+    # Ingresa el CUIT
+    text_box = wait.until(EC.presence_of_element_located((By.ID, "F1:username")))
+    text_box.clear()
+    text_box.send_keys(cuit)
+    logger.info(f"CUIT ingresado: {cuit}")
+
+    # Hace clic en el botón "Siguiente"
+    siguiente_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnSiguiente")))
+    siguiente_button.click()
+    logger.info("Se hizo clic en el botón Siguiente")
+
+    # Ingresa la contraseña
+    password_field = wait.until(EC.presence_of_element_located((By.ID, "F1:password")))
+    password_field.send_keys(password)
+    logger.info("Contraseña ingresada")
+
+    # Hace clic en el botón "Ingresar"
+    ingresar_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnIngresar")))
+    ingresar_button.click()
+    logger.info("Se hizo clic en el botón Ingresar")
+
+    time.sleep(5)
+
+    # Hace clic en "Ver Todos" en la página principal
+    mis_comprobantes = wait.until(EC.element_to_be_clickable((By.LINK_TEXT, "Ver todos")))
+    mis_comprobantes.click()
+    logger.info("Se encontró y abrió 'Ver todos'")
+
+    # Hacer clic en "Comprobantes en Línea"
+    comprobantes_link = wait.until(EC.presence_of_element_located((By.XPATH, "//h3[contains(text(),'COMPROBANTES EN LÍNEA')]")))
+
+    # Scroll hasta el elemento
+    driver.execute_script("arguments[0].scrollIntoView(true);", comprobantes_link)
+    time.sleep(1)
+
+    # Click en Comprobantes en Línea
     try:
-        driver.get("https://auth.afip.gob.ar/contribuyente_/login.xhtml")
-        wait = WebDriverWait(driver, 10)
-
-        # Ingresa el CUIT
-        text_box = wait.until(EC.presence_of_element_located((By.ID, "F1:username")))
-        text_box.clear()
-        text_box.send_keys(cuit)
-        print(f"CUIT ingresado: {cuit}")
+        comprobantes_link.click()
+        logger.info("Se hizo clic en Comprobantes en Línea")
+    except Exception as e:
+        driver.execute_script("arguments[0].click();", comprobantes_link)
+        logger.info("Se hizo clic en Comprobantes en Línea usando JavaScript")
 
-        # Hace clic en el botón "Siguiente"
-        siguiente_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnSiguiente")))
-        siguiente_button.click()
-        print("Se hizo clic en el botón Siguiente")
+    time.sleep(5)
 
-        # Ingresa la contraseña
-        password_field = wait.until(EC.presence_of_element_located((By.ID, "F1:password")))
-        password_field.send_keys(password)
-        print("Contraseña ingresada")
+    # Obtener todas las pestañas abiertas
+    handles = driver.window_handles
 
-        # Hace clic en el botón "Ingresar"
-        ingresar_button = wait.until(EC.element_to_be_clickable((By.ID, "F1:btnIngresar")))
-        ingresar_button.click()
-        print("Se hizo clic en el botón Ingresar")
+    # Cambiar a la última pestaña abierta
+    driver.switch_to.window(handles[-1])
+    logger.info("Cambiado a la nueva pestaña")
+    if browser is not None:
+        browser.apply_to_current_tab(driver)
 
-        time.sleep(5)
+    seleccionar_empresa(driver, empresa)
 
-        # Hace clic en "Ver Todos" en la página principal
-        mis_comprobantes = wait.until(EC.element_to_be_clickable((By.LINK_TEXT, "Ver todos")))
-        mis_comprobantes.click()
-        print("Se encontró y abrió 'Ver todos'")
+def seleccionar_empresa(driver, empresa):
+    """Hace clic en el botón de la empresa en el selector de Comprobantes en Línea"""
+    nombre_empresa = empresa.nombre.replace('"', '\\"')
+    selector_empresa = f'input.btn_empresa[value="{nombre_empresa}"]'
+    try:
+        # Esperar y hacer clic en el botón de la empresa
+        wait = WebDriverWait(driver, 10)
+        empresa_button = wait.until(EC.element_to_be_clickable((
+            By.CSS_SELECTOR, selector_empresa
+        )))
 
-        # Hacer clic en "Comprobantes en Línea"
-        comprobantes_link = wait.until(EC.presence_of_element_located((By.XPATH, "//h3[contains(text(),'COMPROBANTES EN LÍNEA')]")))
-        
-        # Scroll hasta el elemento
-        driver.execute_script("arguments[0].scrollIntoView(true);", comprobantes_link)
+        driver.execute_script("arguments[0].scrollIntoView(true);", empresa_button)
         time.sleep(1)
-      
-        # Click en Comprobantes en Línea
-        try:
-            comprobantes_link.click()
-            print("Se hizo clic en Comprobantes en Línea")
-        except Exception as e:
-            driver.execute_script("arguments[0].click();", comprobantes_link)
-            print("Se hizo clic en Comprobantes en Línea usando JavaScript")
 
-        time.sleep(5)
+        empresa_button.click()
+        logger.info(f"Se hizo clic en el botón de la empresa {empresa.nombre}")
 
-        # Obtener todas las pestañas abiertas
-        handles = driver.window_handles
-        
-        # Cambiar a la última pestaña abierta
-        driver.switch_to.window(handles[-1])
-        print("Cambiado a la nueva pestaña")
-        
+    except Exception as e:
+        logger.error(f"Error al hacer clic en el botón de la empresa: {str(e)}")
         try:
-            # Esperar y hacer clic en el botón de la empresa
-            wait = WebDriverWait(driver, 10)
-            empresa_button = wait.until(EC.element_to_be_clickable((
-                By.CSS_SELECTOR, "input.btn_empresa[value='LAZZARINI&LAZZARINI S.R.L.']"
-            )))
-            
-            driver.execute_script("arguments[0].scrollIntoView(true);", empresa_button)
-            time.sleep(1)
-            
-            empresa_button.click()
-            print("Se hizo clic en el botón de la empresa")
-            
-        except Exception as e:
-            print(f"Error al hacer clic en el botón de la empresa: {str(e)}")
-            try:
-                button = driver.find_element(By.CSS_SELECTOR, "input.btn_empresa[value='LAZZARINI&LAZZARINI S.R.L.']")
-                driver.execute_script("arguments[0].click();", button)
-                print("Se hizo clic usando JavaScript en el botón de la empresa")
-            except Exception as js_e:
-                print(f"Error en el clic por JavaScript: {str(js_e)}")
-
-        # Loop principal para procesar facturas
-        while True:
-            try:
-                # Procesar lote de facturas
-                facturar(driver)
-                
-                # Verificar si quedan más facturas
-                excel_handler = ExcelHandler("facturador_test.xlsx")
-                if excel_handler.load_excel():
-                    facturas_pendientes = excel_handler.get_facturas_pendientes()
-                    if not facturas_pendientes:
-                        print("\nNo quedan facturas pendientes. Proceso completado.")
-                        break
-                    else:
-                        print(f"\nQuedan {len(facturas_pendientes)} facturas pendientes. Continuando...")
-                        continue
+            button = driver.find_element(By.CSS_SELECTOR, selector_empresa)
+            driver.execute_script("arguments[0].click();", button)
+            logger.info("Se hizo clic usando JavaScript en el botón de la empresa")
+        except Exception as js_e:
+            logger.error(f"Error en el clic por JavaScript: {str(js_e)}")
+
+def cambiar_empresa(driver, empresa, timeout=10):
+    """
+    Cambia la empresa representada sin volver a iniciar sesión.
+
+    Vuelve al selector de empresas (index_bis.jsp) y elige la indicada; cuando
+    un mismo CUIT representa a varias empresas es mucho más barato que un
+    login completo.
+
+    Returns:
+        bool: True si quedó en el menú principal de la nueva empresa
+    """
+    try:
+        driver.execute_script("parent.location.href='index_bis.jsp'")
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "input.btn_empresa"))
+        )
+        seleccionar_empresa(driver, empresa)
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.LINK_TEXT, "Generar Comprobantes"))
+        )
+        logger.info(f"Se cambió a la empresa {empresa.nombre} sin volver a iniciar sesión")
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo cambiar a la empresa {empresa.nombre}: {str(e)}")
+        return False
 
-            except KeyboardInterrupt:
-                print("\nProceso interrumpido por el usuario.")
-                break
-            except Exception as e:
-                print(f"\nError en el loop principal: {str(e)}")
-                driver.save_screenshot("error_loop_principal.png")
-                break
+def sesion_activa(driver, timeout=10):
+    """
+    Vuelve al menú principal y verifica que la sesión siga autenticada.
 
-        # Esperar la tecla Esc para cerrar
-        print("\nProceso completado. Mantén la sesión abierta, presiona 'Esc' para cerrar.")
-        while True:
-            if keyboard.is_pressed('esc'):
-                print("Tecla 'Esc' presionada. Cerrando sesión.")
-                break
+    Returns:
+        bool: True si el menú muestra 'Generar Comprobantes'
+    """
+    try:
+        driver.execute_script("parent.location.href='menu_ppal.jsp'")
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.LINK_TEXT, "Generar Comprobantes"))
+        )
+        return True
+    except Exception as e:
+        logger.info(f"La sesión no está activa: {str(e)}")
+        return False
+
+def agregar_linea_detalle(driver, wait, numero):
+    """
+    Agrega una línea de detalle al comprobante y espera a que aparezca.
+
+    Args:
+        numero: número de la línea que se agrega (2 en adelante)
+    """
+    boton = wait.until(EC.element_to_be_clickable((
+        By.XPATH, "//input[@type='button' and contains(@value, 'Agregar línea')]"
+    )))
+    try:
+        boton.click()
+    except:
+        driver.execute_script("arguments[0].click();", boton)
+    wait.until(EC.presence_of_element_located((By.ID, f"detalle_descripcion{numero}")))
+    logger.info(f"Se agregó la línea de detalle {numero}")
+
+def login_afip(cuit=None, password=None, headless=None, interactive=None, login_url=None, metrics_port=None,
+               standby=False, agrupar=False, configuracion=None, empresa=None):
+    """
+    Inicia sesión y emite las facturas pendientes de una empresa.
+
+    Los argumentos no indicados salen de la configuración (config.current()
+    o la que se pase en configuracion); empresa es el nombre de una de las
+    empresas configuradas (por defecto la predeterminada).
+    """
+    configure_logging()
+    if metrics_port is not None:
+        metrics.enable(metrics_port)
+
+    configuracion = configuracion or config.current()
+    cuit = cuit or configuracion.cuit
+    password = password or configuracion.password
+    headless = configuracion.headless if headless is None else headless
+    login_url = login_url or configuracion.login_url
+    empresa = configuracion.empresa(empresa)
+
+    # Sin ventana no hay nadie mirando: por defecto el modo headless es de lote
+    if interactive is None:
+        interactive = not headless
+    lifecycle = RunLifecycle(INTERACTIVE if interactive else BATCH)
+    lifecycle.install_signal_handlers()
+
+    # En modo headless también se bloquean imágenes, fuentes y analítica
+    browser = BrowserManager(headless=headless, download_dir=configuracion.downloads)
+    driver, _ = browser.setup_driver()
+    metrics.current().session_age.set_function(browser.session_age)
+    profiler = StepProfiler()
+    profiler.instrument_driver(driver)
+    screenshots = ScreenshotStore()
+    diagnostics = Diagnostics(driver, screenshots=screenshots)
+    lifecycle.on_shutdown("diagnósticos", diagnostics.close)
+    lifecycle.on_shutdown("capturas", screenshots.close)
+    lifecycle.on_shutdown("reporte de tiempos", profiler.write_report)
+    lifecycle.on_shutdown("descargas pendientes", lambda: archivar_descargas_pendientes(
+        InvoiceJournal.for_ledger(empresa.ledger), ComprobanteArchive(), empresa.destino))
+    
+    time.sleep(random.uniform(1, 3))
+    
+    def relogin(d):
+        iniciar_sesion(d, cuit, password, login_url, empresa, browser)
+
+    try:
+        iniciar_sesion(driver, cuit, password, login_url, empresa, browser)
+        if standby:
+            # Segunda sesión lista en el menú para reemplazar a la actual ante fallas
+            browser.start_standby(relogin, check=sesion_activa)
+
+        emitir_pendientes(browser, lifecycle, empresa, relogin, downloads_folder=configuracion.downloads,
+                          profiler=profiler, diagnostics=diagnostics, screenshots=screenshots, agrupar=agrupar)
+
+        # En modo interactivo mantener la sesión abierta hasta Ctrl+C / SIGTERM
+        if not lifecycle.stopping:
+            logger.info("Proceso completado.")
+            lifecycle.wait()
 
     except Exception as e:
-        driver.save_screenshot(f"afip_login_error_{cuit}.png")
-        print(f"Error durante el login: {str(e)}. Se guardó una captura de pantalla.")
+        screenshots.capture(browser.driver, "login")
+        logger.error(f"Error durante el login: {str(e)}. Se guardó una captura de pantalla.")
         return None
 
     finally:
-        driver.quit()
-        print("Sesión cerrada.")
+        lifecycle.shutdown()
+        browser.close_standby()
+        browser.close_browser()
+        logger.info("Sesión cerrada.")
+
+def emitir_pendientes(browser, lifecycle, empresa, relogin, downloads_folder=None, profiler=None,
+                      diagnostics=None, screenshots=None, agrupar=False, rows=None, dry_run=False):
+    """
+    Loop principal: emite las facturas pendientes del Excel de una empresa
+    hasta vaciarlo, dejar de avanzar o acumular demasiadas fallas seguidas.
+
+    El driver debe estar en el menú principal de la empresa. Ante una falla
+    fuera de facturar se recicla el navegador con relogin.
+
+    Args:
+        browser: BrowserManager con la sesión abierta
+        lifecycle: RunLifecycle de la ejecución
+        empresa: EmpresaConfig a facturar
+        relogin: función que recibe un driver nuevo y lo deja en el menú de la empresa
+        rows: filas del Excel a las que se limita el lote (opcional)
+        dry_run: completar los formularios sin confirmar (una sola pasada, ver facturar)
+
+    Returns:
+        int: filas emitidas en total
+    """
+    profiler = profiler or NULL_PROFILER
+    screenshots = screenshots or ScreenshotStore()
+    total = 0
+    fallas_seguidas = 0
+    while not lifecycle.stopping:
+        try:
+            # Procesar lote de facturas (el navegador puede reciclarse dentro de facturar)
+            emitidas = facturar(browser.driver, lifecycle, profiler=profiler, diagnostics=diagnostics,
+                                screenshots=screenshots, browser=browser, relogin=relogin, agrupar=agrupar,
+                                empresa=empresa, downloads_folder=downloads_folder, rows=rows, dry_run=dry_run)
+            total += emitidas
+            fallas_seguidas = 0
+            if dry_run:
+                # Nada quedó marcado: otra pasada repetiría los mismos formularios
+                break
 
-def facturar(driver):
-    try:
-        # Primero definir wait
-        wait = WebDriverWait(driver, 10)
+            # Verificar si quedan más facturas (sin contar las descartadas)
+            requeue = InvoiceRequeue.for_ledger(empresa.ledger)
+            excel_handler = ExcelHandler(empresa.ledger)
+            if not excel_handler.load_excel():
+                logger.error("No se pudo releer el Excel para verificar pendientes")
+                break
+            facturas_pendientes = [f for f in excel_handler.get_facturas_pendientes()
+                                   if not requeue.is_dead(f) and (rows is None or f.row_index in rows)]
+            if not facturas_pendientes:
+                logger.info("No quedan facturas pendientes. Proceso completado.")
+                break
+            if not emitidas:
+                # facturar ya reintentó cada fila; otra pasada sin progreso solo gira en vacío
+                logger.warning(f"Quedan {len(facturas_pendientes)} facturas pendientes pero no se emitió ninguna "
+                               f"en esta pasada (reservadas por otro proceso o con error); se detiene")
+                break
+            logger.info(f"Quedan {len(facturas_pendientes)} facturas pendientes. Continuando...")
 
-        # Luego inicializar handlers con wait ya definido
-        element_handler = ElementHandler(driver, wait)
+        except KeyboardInterrupt:
+            logger.warning("Proceso interrumpido por el usuario.")
+            break
+        except Exception as e:
+            logger.error(f"Error en el loop principal: {str(e)}")
+            screenshots.capture(browser.driver, "loop_principal")
+            fallas_seguidas += 1
+            if fallas_seguidas >= MAX_FALLAS_SEGUIDAS:
+                logger.error(f"{fallas_seguidas} fallas seguidas, se abandona la ejecución")
+                break
+            # Empezar de nuevo con un navegador limpio y sesión nueva
+            try:
+                driver = browser.recycle(login=relogin)
+                profiler.instrument_driver(driver)
+                if diagnostics is not None:
+                    diagnostics.driver = driver
+            except Exception as recycle_e:
+                logger.error(f"No se pudo reciclar el navegador: {str(recycle_e)}")
+                break
+    return total
+
+def facturar(driver, lifecycle=None, excel_path=None, profiler=None,
+             downloads_folder=None, destino_folder=None, archive=None,
+             diagnostics=None, screenshots=None, leases=None, browser=None, relogin=None, agrupar=False,
+             requeue=None, empresa=None, rows=None, dry_run=False):
+    """
+    Emite las facturas pendientes del Excel.
+
+    Con agrupar=True las rendiciones pendientes del mismo cliente, CUIT y
+    periodo se emiten en un solo comprobante, una línea de detalle por
+    rendición; cada fila se sigue marcando, reservando y registrando en el
+    journal por separado.
+
+    Una factura que falla se reintenta al final del lote hasta agotar sus
+    intentos (InvoiceRequeue); después queda en el reporte de rechazadas y
+    no se vuelve a intentar.
+
+    empresa (EmpresaConfig) define punto de venta, actividad, unidad, IVA,
+    Excel y carpeta destino; por defecto la empresa predeterminada de la
+    configuración. excel_path y las carpetas pisan los de la empresa.
+
+    rows limita el lote a esas filas del Excel (números de fila de la hoja).
+    Con dry_run=True se completa y valida cada formulario pero nunca se
+    confirma: no se emite nada ni se modifican el Excel ni el journal (sirve
+    para medir tiempos contra el portal).
+
+    Returns:
+        int: cantidad de filas emitidas y marcadas como realizadas (en
+             dry_run, las que llegaron al formulario completo)
+    """
+    empresa = empresa or config.current().empresa()
+    excel_path = excel_path or empresa.ledger
+    downloads_folder = downloads_folder or config.current().downloads
+    destino_folder = destino_folder or empresa.destino
+    profiler = profiler or NULL_PROFILER
+    diagnostics = diagnostics or NULL_DIAGNOSTICS
+    screenshots = screenshots or ScreenshotStore()
+    metricas = metrics.current()
+
+    def paso(nombre):
+        # Abre un tramo medido, lo deja en el historial de diagnóstico y renueva las reservas
+        profiler.checkpoint(nombre)
+        diagnostics.record_step(nombre, factura)
+        for item in items:
+            leases.renew(item)
+
+    def avanzar(estado, **datos):
+        # Todas las filas del comprobante pasan juntas por el journal
+        if len(items) > 1:
+            datos['grupo'] = [clave_factura(item) for item in items]
+        for item in items:
+            journal.advance(item, estado, **datos)
+
+    pipeline = None
+    receptores = ReceptorCache()
+    emitidas = 0
+    try:
         alert_handler = AlertHandler()
-        invoice_processor = InvoiceProcessor(driver, element_handler, alert_handler)
+        archive = archive if archive is not None else ComprobanteArchive()
+        journal = InvoiceJournal.for_ledger(excel_path)
+        # Reservas compartidas con otros procesos que facturan el mismo Excel
+        leases = leases if leases is not None else LedgerLeases.for_ledger(excel_path)
+        # Intentos por fila y reporte de filas descartadas
+        requeue = requeue if requeue is not None else InvoiceRequeue.for_ledger(excel_path)
+
+        def preparar(d):
+            # Handlers atados al driver (se vuelven a crear si se recicla el navegador)
+            w = WebDriverWait(d, 10)
+            handler = ElementHandler(d, w, profiler=profiler)
+            processor = InvoiceProcessor(d, handler, alert_handler, archive=archive, journal=journal,
+                                         diagnostics=diagnostics, empresa=empresa,
+                                         downloads_folder=downloads_folder)
+            return w, handler, processor
+
+        wait, element_handler, invoice_processor = preparar(driver)
 
         # Instanciar el ExcelHandler
-        excel_handler = ExcelHandler("facturador_test.xlsx")
+        excel_handler = ExcelHandler(excel_path, leases=leases)
         if not excel_handler.load_excel():
             raise Exception("No se pudo cargar el archivo Excel")
+        if lifecycle:
+            lifecycle.on_shutdown(f"ledger {excel_path}", excel_handler.flush)
 
         # Obtener facturas pendientes
         facturas_pendientes = excel_handler.get_facturas_pendientes()
+        descartadas = [f for f in facturas_pendientes if requeue.is_dead(f)]
+        if descartadas:
+            logger.warning(f"Se omiten {len(descartadas)} facturas descartadas en ejecuciones anteriores "
+                           f"(ver {requeue.dead_letter_path})")
+            metricas.skipped.inc(len(descartadas), reason='descartada')
+            facturas_pendientes = [f for f in facturas_pendientes if not requeue.is_dead(f)]
+        if rows is not None:
+            facturas_pendientes = [f for f in facturas_pendientes if f.row_index in rows]
         if not facturas_pendientes:
-            print("No hay facturas pendientes para procesar")
-            return
+            logger.info("No hay facturas pendientes para procesar")
+            return emitidas
+
+        # Por cada factura pendiente; la siguiente se prepara mientras se emite la actual
+        pipeline = InvoicePipeline(facturas_pendientes, excel_handler, archive, receptores, agrupar=agrupar)
+        for preparada in pipeline:
+            factura = preparada.factura
+            lineas = list(preparada.lineas)
+            items = [item for item, _ in lineas]
+            if lifecycle and lifecycle.stopping:
+                logger.warning("Detención solicitada, no se inician más facturas")
+                break
 
-        # Por cada factura pendiente
-        for factura in facturas_pendientes:
+            # Reciclar el navegador entre facturas antes de que se degrade
+            if browser is not None:
+                motivo = browser.needs_recycle()
+                if motivo:
+                    logger.info(f"Reciclando el navegador: {motivo}")
+                    driver = browser.recycle(login=relogin)
+                    profiler.instrument_driver(driver)
+                    if diagnostics.enabled:
+                        diagnostics.driver = driver
+                    wait, element_handler, invoice_processor = preparar(driver)
+
+            factura_ok = False
+            reservadas = []
+            intentada = False
+            set_correlation_id(correlation_id_for(factura))
             try:
-                # Validar datos de la factura
-                if not excel_handler.validate_factura_data(factura):
-                    print(f"Factura para {factura.cliente} no pasó la validación, continuando con la siguiente...")
+                # Validación hecha de antemano por el pipeline
+                for rechazada in preparada.rechazadas:
+                    logger.warning(f"Factura para {rechazada.cliente} (rendición {rechazada.rendicion}) "
+                                   f"no pasó la validación, continuando con la siguiente...")
+                    metricas.skipped.inc(reason='validacion')
+                if not preparada.valida:
                     continue
 
+                # Reservar las filas para que ningún otro proceso las emita a la vez
+                for item in list(lineas):
+                    if leases.claim(item[0]):
+                        reservadas.append(item[0])
+                    else:
+                        logger.info(f"La factura de {item[0].cliente} (rendición {item[0].rendicion}) está reservada "
+                                    f"por otro proceso o ya fue realizada, se omite")
+                        metricas.skipped.inc(reason='reservada')
+                        lineas.remove(item)
+                # Incorporar lo que otro proceso haya registrado para estas filas
+                journal.refresh()
+
+                for item in list(lineas):
+                    if dry_run:
+                        # El simulacro no toca el Excel: solo se omiten las filas con historia
+                        if journal.state(item[0]) != invoice_journal.PENDING or archive.is_invoiced(item[0]):
+                            logger.info(f"Simulacro: se omite {item[0].cliente} (rendición {item[0].rendicion}), "
+                                        f"ya tiene registro en el journal o el archivo")
+                            lineas.remove(item)
+                        continue
+
+                    # Retomar desde el último estado durable si hubo una caída
+                    if reanudar_factura(item[0], journal, archive, excel_handler, invoice_processor, destino_folder):
+                        metricas.skipped.inc(reason='reanudada')
+                        lineas.remove(item)
+
+                    # Evitar emitir de nuevo una rendición que ya tiene comprobante archivado
+                    elif item[0] in preparada.ya_facturadas or archive.is_invoiced(item[0]):
+                        entrada = archive.get(item[0])
+                        logger.info(f"La rendición {item[0].rendicion} de {item[0].cliente} ya fue facturada "
+                              f"({entrada['publicado'] or entrada['objeto']}), se marca como realizada")
+                        excel_handler.marcar_como_realizada(item[0])
+                        metricas.skipped.inc(reason='ya_facturada')
+                        lineas.remove(item)
+
+                if not lineas:
+                    continue
+                items = [item for item, _ in lineas]
+                factura = items[0]
+                nombre_archivo = (preparada.nombre_archivo if len(lineas) == len(preparada.lineas)
+                                  else nombre_archivo_grupo(items))
+                if len(items) > 1:
+                    logger.info(f"Comprobante agrupado para {factura.cliente}: rendiciones "
+                                f"{', '.join(str(item.rendicion) for item in items)}")
+
+                profiler.begin_invoice(factura)
+                intentada = True
+                paso("generar_comprobantes")
+
                 # Hace clic en "Generar Comprobantes"
                 generar_comprobantes = wait.until(EC.element_to_be_clickable((By.LINK_TEXT, "Generar Comprobantes")))
                 time.sleep(1)
@@ -260,21 +585,23 @@ def facturar(driver):
                     generar_comprobantes.click()
                 except:
                     driver.execute_script("arguments[0].click();", generar_comprobantes)
-                print("Se encontró y abrió 'Generar Comprobantes'")
+                logger.info("Se encontró y abrió 'Generar Comprobantes'")
                 
+                paso("punto_de_venta")
                 # Seleccionar Punto de Venta
                 select_element = wait.until(EC.presence_of_element_located((By.ID, "puntodeventa")))
                 select = Select(select_element)
                 time.sleep(2)
                 
                 try:
-                    select.select_by_value("4")
-                    print("Se seleccionó el Punto de Venta 4")
+                    select.select_by_value(empresa.punto_venta)
+                    logger.info(f"Se seleccionó el Punto de Venta {empresa.punto_venta}")
                 except Exception as e:
-                    print(f"Error al seleccionar Punto de Venta: {str(e)}")
-                    driver.execute_script("document.getElementById('puntodeventa').value='4';")
+                    logger.error(f"Error al seleccionar Punto de Venta: {str(e)}")
+                    driver.execute_script(f"document.getElementById('puntodeventa').value='{empresa.punto_venta}';")
                     driver.execute_script("obtenerDenominacion(formulario,'puntodeventa');")
 
+                paso("tipo_comprobante")
                 # Seleccionar tipo de comprobante según condición IVA
                 wait.until(EC.visibility_of_element_located((By.ID, "universocomprobante")))
                 time.sleep(2)
@@ -283,10 +610,10 @@ def facturar(driver):
                     # Determinar el valor según la condición IVA
                     if factura.cond_iva.upper() in ['RI', 'M']:
                         valor_comprobante = "10"  # Factura A
-                        print(f"Cliente {factura.cliente} es {factura.cond_iva} - Seleccionando Factura A")
+                        logger.info(f"Cliente {factura.cliente} es {factura.cond_iva} - Seleccionando Factura A")
                     else:
                         valor_comprobante = "19"  # Factura B 
-                        print(f"Cliente {factura.cliente} es {factura.cond_iva} - Seleccionando Factura B")
+                        logger.info(f"Cliente {factura.cliente} es {factura.cond_iva} - Seleccionando Factura B")
 
                     # Intentar selección directa
                     select_comprobante = Select(driver.find_element(By.ID, "universocomprobante"))
@@ -294,7 +621,7 @@ def facturar(driver):
                     time.sleep(1)
                 
                 except Exception as e:
-                    print(f"Error al seleccionar tipo de comprobante: {str(e)}")
+                    logger.error(f"Error al seleccionar tipo de comprobante: {str(e)}")
                     # Plan B: JavaScript
                     script = f"""
                         var select = document.getElementById("universocomprobante");
@@ -321,21 +648,24 @@ def facturar(driver):
                         # Si falla, intentar con JavaScript
                         driver.execute_script("validarCampos();")
                     
-                    print("Se hizo clic en Continuar")
+                    logger.info("Se hizo clic en Continuar")
                     time.sleep(2)  # Esperar a que cargue la siguiente página
                     
                 except Exception as e:
-                    print(f"Error al hacer clic en Continuar: {str(e)}")
-                    # Capturar screenshot si hay error
-                    driver.save_screenshot(f"error_continuar_{factura.cliente}.png")
+                    logger.error(f"Error al hacer clic en Continuar: {str(e)}")
+                    screenshots.capture(driver, "tipo_comprobante_continuar", factura)
                     raise  # Re-lanzar el error para que se maneje en el bloque try/except superior
 
+                # Un dato rechazado por el portal corta la factura sin esperar timeouts
+                alert_handler.check_validation_error(driver, factura, "tipo_comprobante")
+
+                paso("fechas_y_concepto")
                 # Ingresa Fecha
                 text_box = wait.until(EC.presence_of_element_located((By.ID, "fc")))
                 text_box.clear()
                 fecha_formateada = factura.fecha.strftime("%d/%m/%Y")  # Convertir a formato dd/mm/yyyy
                 text_box.send_keys(fecha_formateada)
-                print(f"Fecha ingresada: {fecha_formateada}")
+                logger.info(f"Fecha ingresada: {fecha_formateada}")
 
                 # Seleccionar concepto Servicio
                 wait.until(EC.visibility_of_element_located((By.ID, "idconcepto")))
@@ -346,10 +676,10 @@ def facturar(driver):
                     select_concepto = Select(driver.find_element(By.ID, "idconcepto"))
                     select_concepto.select_by_value("2")
                     time.sleep(1)
-                    print("Se seleccionó el Concepto Servicio")
+                    logger.info("Se seleccionó el Concepto Servicio")
                 
                 except Exception as e:
-                    print(f"Error al seleccionar Concepto: {str(e)}")
+                    logger.error(f"Error al seleccionar Concepto: {str(e)}")
                     # Plan B: JavaScript
                     script = """
                         var select = document.getElementById("idconcepto");
@@ -366,7 +696,7 @@ def facturar(driver):
                 text_box.clear()
                 fecha_formateada = factura.fecha.strftime("%d/%m/%Y")  # Convertir a formato dd/mm/yyyy
                 text_box.send_keys(fecha_formateada)
-                print(f"Fecha Desde ingresada: {fecha_formateada}")
+                logger.info(f"Fecha Desde ingresada: {fecha_formateada}")
 
 
                 # Ingresa Fecha Hasta
@@ -374,7 +704,7 @@ def facturar(driver):
                 text_box.clear()
                 fecha_formateada = factura.fecha.strftime("%d/%m/%Y")  # Convertir a formato dd/mm/yyyy
                 text_box.send_keys(fecha_formateada)
-                print(f"Fecha Hasta ingresada: {fecha_formateada}")
+                logger.info(f"Fecha Hasta ingresada: {fecha_formateada}")
 
 
                 # Ingresa Fecha Vto. Pago
@@ -382,19 +712,20 @@ def facturar(driver):
                 text_box.clear()
                 fecha_formateada = factura.fecha.strftime("%d/%m/%Y")  # Convertir a formato dd/mm/yyyy
                 text_box.send_keys(fecha_formateada)
-                print(f"Fecha Vto. Pago ingresada: {fecha_formateada}")
+                logger.info(f"Fecha Vto. Pago ingresada: {fecha_formateada}")
 
+                paso("actividad")
                 # Seleccionar Actividad
                 select_element = wait.until(EC.presence_of_element_located((By.ID, "actiAsociadaId")))
                 select_concepto = Select(select_element)
                 time.sleep(2)
                 
                 try:
-                    select_concepto.select_by_value("682091")
-                    print("Se seleccionó la Actividad")
+                    select_concepto.select_by_value(empresa.actividad)
+                    logger.info("Se seleccionó la Actividad")
                 except Exception as e:
-                    print(f"Error al seleccionar Concepto: {str(e)}")
-                    driver.execute_script("document.getElementById('actiAsociadaId').value='682091';")
+                    logger.error(f"Error al seleccionar Concepto: {str(e)}")
+                    driver.execute_script(f"document.getElementById('actiAsociadaId').value='{empresa.actividad}';")
                     driver.execute_script("obtenerDenominacion(formulario,'actiAsociadaId');")
 
                 # Hacer clic en el botón Continuar
@@ -412,15 +743,18 @@ def facturar(driver):
                         # Si falla, intentar con JavaScript
                         driver.execute_script("validarCampos();")
                     
-                    print("Se hizo clic en Continuar")
+                    logger.info("Se hizo clic en Continuar")
                     time.sleep(2)  # Esperar a que cargue la siguiente página
                    
                 except Exception as e:
-                    print(f"Error al hacer clic en Continuar: {str(e)}")
-                    # Capturar screenshot si hay error
-                    driver.save_screenshot(f"error_continuar_{factura.cliente}.png")
+                    logger.error(f"Error al hacer clic en Continuar: {str(e)}")
+                    screenshots.capture(driver, "actividad_continuar", factura)
                     raise  # Re-lanzar el error para que se maneje en el bloque try/except superior
 
+                # Un dato rechazado por el portal corta la factura sin esperar timeouts
+                alert_handler.check_validation_error(driver, factura, "actividad")
+
+                paso("receptor")
                 # Seleccionar condición IVA                 
                 wait.until(EC.visibility_of_element_located((By.ID, "idivareceptor")))                 
                 time.sleep(2)                  
@@ -429,16 +763,16 @@ def facturar(driver):
                     # Determinar el valor según la condición IVA
                     if factura.cond_iva.upper() == 'RI':
                         condicion_iva = "1"  # IVA Responsable Inscripto
-                        print(f"Cliente {factura.cliente} es Responsable Inscripto")
+                        logger.info(f"Cliente {factura.cliente} es Responsable Inscripto")
                     elif factura.cond_iva.upper() == 'M':
                         condicion_iva = "6"  # Responsable Monotributo 
-                        print(f"Cliente {factura.cliente} es Monotributista")
+                        logger.info(f"Cliente {factura.cliente} es Monotributista")
                     elif factura.cond_iva.upper() == 'CF':
                         condicion_iva = "5"  # Consumidor Final
-                        print(f"Cliente {factura.cliente} es Consumidor Final")
+                        logger.info(f"Cliente {factura.cliente} es Consumidor Final")
                     elif factura.cond_iva.upper() == 'E':
                         condicion_iva = "4"  # IVA Sujeto Exento
-                        print(f"Cliente {factura.cliente} es IVA Exento")
+                        logger.info(f"Cliente {factura.cliente} es IVA Exento")
 
                     # Intentar selección directa
                     select_comprobante = Select(driver.find_element(By.ID, "idivareceptor"))
@@ -446,7 +780,7 @@ def facturar(driver):
                     time.sleep(1)
                             
                 except Exception as e:
-                    print(f"Error al seleccionar condición IVA: {str(e)}")
+                    logger.error(f"Error al seleccionar condición IVA: {str(e)}")
                     # Plan B: JavaScript
                     script = f"""
                         var select = document.getElementById("idivareceptor");
@@ -461,14 +795,14 @@ def facturar(driver):
                 text_box = wait.until(EC.presence_of_element_located((By.ID, "nrodocreceptor")))
                 text_box.clear()
                 text_box.send_keys(factura.cuit)
-                print(f"CUIT ingresado: {factura.cuit}")
+                logger.info(f"CUIT ingresado: {factura.cuit}")
                 time.sleep(8)
 
                 # Hacer click en checkbox Contado
                 checkbox = wait.until(EC.element_to_be_clickable((By.ID, "formadepago1")))
                 time.sleep(1)
                 checkbox.click()
-                print("Se hizo clic en Contado como Condición de Venta")
+                logger.info("Se hizo clic en Contado como Condición de Venta")
 
                 # Hacer clic en el botón Continuar
                 try:
@@ -485,71 +819,79 @@ def facturar(driver):
                         # Si falla, intentar con JavaScript
                         driver.execute_script("validarCampos();")
                     
-                    print("Se hizo clic en Continuar")
+                    logger.info("Se hizo clic en Continuar")
                     time.sleep(2)  # Esperar a que cargue la siguiente página
                    
                 except Exception as e:
-                    print(f"Error al hacer clic en Continuar: {str(e)}")
-                    # Capturar screenshot si hay error
-                    driver.save_screenshot(f"error_continuar_{factura.cliente}.png")
+                    logger.error(f"Error al hacer clic en Continuar: {str(e)}")
+                    screenshots.capture(driver, "receptor_continuar", factura)
                     raise  # Re-lanzar el error para que se maneje en el bloque try/except superior
 
-                # Escribir concepto
-                text_box = wait.until(EC.presence_of_element_located((By.ID, "detalle_descripcion1")))
-                text_box.clear()
-                text_box.send_keys(f"Comisiones por cobranzas Mes de {factura.periodo} - Rendición N° {str(factura.rendicion).strip()}")
-                print(f"Concepto ingresado correctamente")
-
-                # Seleccionar Unidad de Medida
-                select_element = wait.until(EC.presence_of_element_located((By.ID, "detalle_medida1")))
-                select_um = Select(select_element)
-                time.sleep(2)
-                
-                try:
-                    select_um.select_by_value("98")
-                    print("Se seleccionó la Unidad de Medida")
-                except Exception as e:
-                    print(f"Error al seleccionar Unidad de Medida: {str(e)}")
-                    driver.execute_script("document.getElementById('detalle_medida1').value='98';")
-                    driver.execute_script("obtenerDenominacion(formulario,'detalle_medida1');")
-
-                # Escribir importe
-                text_box = wait.until(EC.presence_of_element_located((By.ID, "detalle_precio1")))
-                text_box.clear()
-                text_box.send_keys(factura.importe)
-                print(f"Importe ingresado correctamente")
-                time.sleep(2)
-
-                # NUEVO CÓDIGO: Seleccionar IVA 21% solo si es factura B
-                if factura.cond_iva.upper() not in ['RI', 'M']:  # Si no es RI ni M, es factura B
+                # Un dato rechazado por el portal corta la factura sin esperar timeouts
+                alert_handler.check_validation_error(driver, factura, "receptor")
+
+                paso("detalle")
+                # Una línea de detalle por rendición del comprobante
+                for numero, (item, descripcion) in enumerate(lineas, 1):
+                    if numero > 1:
+                        agregar_linea_detalle(driver, wait, numero)
+
+                    # Escribir concepto
+                    text_box = wait.until(EC.presence_of_element_located((By.ID, f"detalle_descripcion{numero}")))
+                    text_box.clear()
+                    text_box.send_keys(descripcion)
+                    logger.info(f"Concepto ingresado correctamente")
+
+                    # Seleccionar Unidad de Medida
+                    select_element = wait.until(EC.presence_of_element_located((By.ID, f"detalle_medida{numero}")))
+                    select_um = Select(select_element)
+                    time.sleep(2)
+                    
                     try:
-                        # Esperar a que el elemento esté presente
-                        select_iva = wait.until(EC.presence_of_element_located((By.ID, "detalle_tipo_iva1")))
-                        select_iva_dropdown = Select(select_iva)
-                        time.sleep(1)
-                        
-                        # Intentar selección directa del 21%
+                        select_um.select_by_value(empresa.unidad_medida)
+                        logger.info("Se seleccionó la Unidad de Medida")
+                    except Exception as e:
+                        logger.error(f"Error al seleccionar Unidad de Medida: {str(e)}")
+                        driver.execute_script(f"document.getElementById('detalle_medida{numero}').value='{empresa.unidad_medida}';")
+                        driver.execute_script(f"obtenerDenominacion(formulario,'detalle_medida{numero}');")
+
+                    # Escribir importe
+                    text_box = wait.until(EC.presence_of_element_located((By.ID, f"detalle_precio{numero}")))
+                    text_box.clear()
+                    text_box.send_keys(item.importe)
+                    logger.info(f"Importe ingresado correctamente")
+                    time.sleep(2)
+
+                    # NUEVO CÓDIGO: Seleccionar IVA 21% solo si es factura B
+                    if factura.cond_iva.upper() not in ['RI', 'M']:  # Si no es RI ni M, es factura B
                         try:
-                            select_iva_dropdown.select_by_value("5")  # 5 corresponde al 21%
-                            print("Se seleccionó IVA 21%")
+                            # Esperar a que el elemento esté presente
+                            select_iva = wait.until(EC.presence_of_element_located((By.ID, f"detalle_tipo_iva{numero}")))
+                            select_iva_dropdown = Select(select_iva)
+                            time.sleep(1)
+                            
+                            # Intentar selección directa del 21%
+                            try:
+                                select_iva_dropdown.select_by_value(empresa.alicuota_iva)  # 5 corresponde al 21%
+                                logger.info("Se seleccionó IVA 21%")
+                            except Exception as e:
+                                logger.error(f"Error al seleccionar IVA por método directo: {str(e)}")
+                                # Plan B: JavaScript
+                                script = f"""
+                                    var select = document.getElementById("detalle_tipo_iva{numero}");
+                                    select.value = "{empresa.alicuota_iva}";
+                                    var event = new Event('change');
+                                    select.dispatchEvent(event);
+                                    calcularSubtotalDetalle({numero});
+                                """
+                                driver.execute_script(script)
+                                logger.info("Se seleccionó IVA 21% usando JavaScript")
+                            
+                            time.sleep(2)  # Esperar a que se actualicen los cálculos
+                            
                         except Exception as e:
-                            print(f"Error al seleccionar IVA por método directo: {str(e)}")
-                            # Plan B: JavaScript
-                            script = """
-                                var select = document.getElementById("detalle_tipo_iva1");
-                                select.value = "5";
-                                var event = new Event('change');
-                                select.dispatchEvent(event);
-                                calcularSubtotalDetalle(1);
-                            """
-                            driver.execute_script(script)
-                            print("Se seleccionó IVA 21% usando JavaScript")
-                        
-                        time.sleep(2)  # Esperar a que se actualicen los cálculos
-                        
-                    except Exception as e:
-                        print(f"Error al seleccionar porcentaje de IVA: {str(e)}")
-                        driver.save_screenshot(f"error_seleccion_iva_{factura.cliente}.png")
+                            logger.error(f"Error al seleccionar porcentaje de IVA: {str(e)}")
+                            screenshots.capture(driver, "detalle_iva", factura)
 
                 # Hacer clic en el botón Continuar
                 try:
@@ -566,15 +908,31 @@ def facturar(driver):
                         # Si falla, intentar con JavaScript
                         driver.execute_script("validarCampos();")
                     
-                    print("Se hizo clic en Continuar")
+                    logger.info("Se hizo clic en Continuar")
                     time.sleep(2)  # Esperar a que cargue la siguiente página
                    
                 except Exception as e:
-                    print(f"Error al hacer clic en Continuar: {str(e)}")
-                    # Capturar screenshot si hay error
-                    driver.save_screenshot(f"error_continuar_{factura.cliente}.png")
+                    logger.error(f"Error al hacer clic en Continuar: {str(e)}")
+                    screenshots.capture(driver, "detalle_continuar", factura)
                     raise  # Re-lanzar el error para que se maneje en el bloque try/except superior
 
+                # Un dato rechazado por el portal corta la factura sin esperar timeouts
+                alert_handler.check_validation_error(driver, factura, "detalle")
+
+                if dry_run:
+                    # Simulacro: el formulario quedó completo y aceptado, se descarta sin confirmar
+                    paso("menu_principal")
+                    driver.execute_script("parent.location.href='menu_ppal.jsp'")
+                    wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Generar Comprobantes")))
+                    logger.info(f"Simulacro: formulario de {factura.cliente} completo, no se confirma")
+                    factura_ok = True
+                    emitidas += len(items)
+                    profiler.checkpoint(None)
+                    continue
+
+                avanzar(invoice_journal.FORM_FILLED)
+
+                paso("confirmacion")
                 # Hacer clic en el botón Confirmar Datos
                 try:
                     # Esperar a que el botón esté presente y sea clickeable
@@ -590,27 +948,32 @@ def facturar(driver):
                         # Si falla, intentar con JavaScript
                         driver.execute_script("confirmar();")
                     
-                    print("Se hizo clic en Confirmar Datos")
+                    logger.info("Se hizo clic en Confirmar Datos")
                     time.sleep(2)  # Esperar a que aparezca la ventana de confirmación
                    
                 except Exception as e:
-                    print(f"Error al hacer clic en Confirmar Datos: {str(e)}")
-                    # Capturar screenshot si hay error
-                    driver.save_screenshot(f"error_confirmar_{factura.cliente}.png")
+                    logger.error(f"Error al hacer clic en Confirmar Datos: {str(e)}")
+                    screenshots.capture(driver, "confirmar", factura)
                     raise  # Re-lanzar el error para que se maneje en el bloque try/except superior  
 
                 # Manejar la ventana de confirmación
                 if manejar_ventana_confirmacion(driver):
-                    print("Ventana de confirmación manejada exitosamente")
+                    logger.info("Ventana de confirmación manejada exitosamente")
+                    # AFIP ya emitió el comprobante: registrarlo antes de cualquier espera
+                    # para que una caída nunca lleve a confirmarlo de nuevo
+                    avanzar(invoice_journal.CONFIRMED)
                     time.sleep(5)  # Esperar a que se procese la confirmación
+                    alert_handler.check_validation_error(driver, factura, "confirmacion",
+                                                         success_xpath=IMPRIMIR_XPATH)
                 else:
-                    print("No se pudo manejar la ventana de confirmación")
-                    driver.save_screenshot(f"error_ventana_confirmacion_{factura.cliente}.png")
+                    logger.error("No se pudo manejar la ventana de confirmación")
+                    screenshots.capture(driver, "ventana_confirmacion", factura)
                     raise Exception("Error al manejar la ventana de confirmación")
                 
+                paso("imprimir_pdf")
                 # Intentar hacer click en el botón Imprimir
                 try:
-                    print("Buscando botón Imprimir...")
+                    logger.info("Buscando botón Imprimir...")
                     # Esperar a que la página se actualice
                     wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
                     
@@ -629,7 +992,7 @@ def facturar(driver):
                                 EC.presence_of_element_located((By.XPATH, xpath))
                             )
                             if imprimir_btn.is_displayed():
-                                print(f"Botón Imprimir encontrado con localizador: {xpath}")
+                                logger.info(f"Botón Imprimir encontrado con localizador: {xpath}")
                                 break
                         except:
                             continue
@@ -640,60 +1003,48 @@ def facturar(driver):
                         time.sleep(1)
 
                         try:
-                            print("Intentando click en botón Imprimir...")
+                            logger.info("Intentando click en botón Imprimir...")
                             imprimir_btn.click()
                         except:
-                            print("Click directo falló, intentando con JavaScript...")
+                            logger.warning("Click directo falló, intentando con JavaScript...")
                             onclick = imprimir_btn.get_attribute('onclick')
                             if onclick:
                                 driver.execute_script(onclick)
                             else:
                                 driver.execute_script("arguments[0].click();", imprimir_btn)
 
-                        print("Click en Imprimir realizado")
-                        time.sleep(5)  # Esperar a que se genere el PDF
-                              
-                        # Usar los métodos del InvoiceProcessor para manejar el PDF
-                        downloads_folder = str(Path.home() / "Downloads")
-                        destino_folder = str(Path.home() / "Desktop/Facturas_NOV")
-
-                        print("Buscando archivo PDF...")
-                        max_intentos = 3
-                        for intento in range(max_intentos):
-                            try:
-                                if invoice_processor._verify_download_started(downloads_folder):
-                                    print("Archivo PDF encontrado, procesando...")
-                                    
-                                    if invoice_processor._process_downloaded_file(downloads_folder, destino_folder, factura):
-                                        print("Archivo PDF procesado exitosamente")
-                                        break
-                                    else:
-                                        print("Error procesando el archivo PDF")
-                                        if intento == max_intentos - 1:
-                                            raise Exception("No se pudo procesar el PDF")
-                                else:
-                                    print(f"Intento {intento + 1}: No se encontró archivo PDF reciente")
-                                    if intento == max_intentos - 1:
-                                        raise Exception("No se encontró el archivo PDF después de varios intentos")
-                                
-                                time.sleep(2)  # Breve pausa entre intentos
-                                
-                            except Exception as e:
-                                print(f"Error en intento {intento + 1}: {str(e)}")
-                                if intento == max_intentos - 1:
-                                    raise
+                        logger.info("Click en Imprimir realizado")
+                        inicio_descarga = time.monotonic()
+
+                        # Sondear la carpeta de descargas con espera creciente (POLITICA_DESCARGA)
+                        logger.info("Buscando archivo PDF...")
+                        pdf_path = invoice_processor.wait_for_download(downloads_folder)
+                        logger.info("Archivo PDF encontrado, procesando...")
+                        metricas.download_wait.observe(time.monotonic() - inicio_descarga)
+                        avanzar(invoice_journal.PDF_DOWNLOADED, pdf=pdf_path)
+
+                        # Un PDF que no se puede archivar no mejora reintentando
+                        if not invoice_processor._process_downloaded_file(downloads_folder, destino_folder, factura, pdf_path,
+                                                                          nombre=nombre_archivo):
+                            raise Exception("No se pudo procesar el PDF")
+                        logger.info("Archivo PDF procesado exitosamente")
+                        # Las demás rendiciones del comprobante apuntan al mismo PDF
+                        for item in items[1:]:
+                            archive.link(item, archive.get(factura))
+                        avanzar(invoice_journal.FILED)
 
                         # Solo si todo el proceso fue exitoso, hacer click en Menú Principal
-                        print("Procediendo a Menú Principal...")
+                        logger.info("Procediendo a Menú Principal...")
 
                     else:
-                        print("No se pudo encontrar el botón Imprimir")
-                        driver.save_screenshot("error_no_boton_imprimir.png")
+                        logger.error("No se pudo encontrar el botón Imprimir")
+                        screenshots.capture(driver, "buscar_imprimir", factura)
 
                 except Exception as e:
-                    print(f"Error al intentar imprimir: {str(e)}")
-                    driver.save_screenshot("error_imprimir.png")
+                    logger.error(f"Error al intentar imprimir: {str(e)}")
+                    screenshots.capture(driver, "imprimir", factura)
                 
+                paso("menu_principal")
                 # Hacer clic en el botón Menú Principal
                 try:
                     # Esperar a que el botón esté presente y sea clickeable
@@ -714,31 +1065,74 @@ def facturar(driver):
                         # Si falla, intentar con JavaScript
                         driver.execute_script("parent.location.href='menu_ppal.jsp'")
                     
-                    print("Se hizo clic en Menú Principal")
+                    logger.info("Se hizo clic en Menú Principal")
                     time.sleep(4)  # Esperar a que cargue la siguiente página         
                 
                 except Exception as e:
-                    print(f"Error al hacer clic en Menú Principal: {str(e)}")
-                    # Capturar screenshot si hay error
-                    driver.save_screenshot(f"error_menu_principal_{factura.cliente}.png")
+                    logger.error(f"Error al hacer clic en Menú Principal: {str(e)}")
+                    screenshots.capture(driver, "menu_principal", factura)
                     raise  # Re-lanzar el error para que se maneje en el bloque try/except superior  
 
-                # Si todo sale bien, marcar como realizada
-                if excel_handler.marcar_como_realizada(factura):
-                    print(f"Factura para {factura.cliente} procesada exitosamente")
+                paso("marcar_realizada")
+                # Si todo sale bien, marcar como realizadas todas las filas del comprobante
+                if excel_handler.marcar_como_realizadas(items):
+                    avanzar(invoice_journal.MARKED)
+                    factura_ok = True
+                    emitidas += len(items)
+                    for item in items:
+                        requeue.record_success(item)
+                    metricas.issued.inc(len(items))
+                    receptores.record(factura)
+                    logger.info(f"Factura para {factura.cliente} procesada exitosamente")
+                    profiler.checkpoint(None)
                     time.sleep(2)  # Esperar antes de la siguiente factura
+                else:
+                    metricas.failed.inc(reason='marcar_realizada')
               
             except Exception as e:
-                print(f"Error procesando factura para {factura.cliente}: {str(e)}")
-                driver.save_screenshot(f"error_factura_{factura.cliente}.png")
+                clase = retry_policy.classify(e, driver)
+                logger.error(f"Error procesando factura para {factura.cliente} ({clase}): {str(e)}")
+                metricas.failed.inc(reason=type(e).__name__)
+                diagnostico = diagnostics.capture_failure(factura=factura, error=e)
+                # Reintentar al final del lote las filas que no agotaron sus intentos
+                # (un simulacro no consume intentos ni descarta filas)
+                reintentar = [] if dry_run else [item for item in items
+                                                 if requeue.record_failure(item, clase, e, diagnostico)]
+                if reintentar and not (lifecycle and lifecycle.stopping):
+                    pipeline.requeue(reintentar)
+                # Con una sesión de reserva lista se cambia a ella sin diagnosticar;
+                # si no, volver al menú y reciclar solo si la sesión expiró
+                if browser is not None:
+                    if clase == retry_policy.SESSION_EXPIRED:
+                        browser.request_recycle("sesión expirada o navegador caído")
+                    elif browser.has_standby():
+                        browser.request_recycle("falla en la factura, se usa la sesión de reserva")
+                    elif not sesion_activa(driver):
+                        browser.request_recycle("sesión expirada o navegador caído")
                 continue
+            finally:
+                profiler.end_invoice(factura_ok)
+                if not factura_ok or dry_run:
+                    for item in reservadas:
+                        leases.release(item)
+                if browser is not None and intentada:
+                    browser.record_result(factura_ok)
+                set_correlation_id(None)
         
     except Exception as e:
-        print(f"Error en la función facturar: {str(e)}")
-        driver.save_screenshot("error_facturar.png")
+        logger.error(f"Error en la función facturar: {str(e)}")
+        screenshots.capture(driver, "facturar")
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        receptores.save()
+    return emitidas
 
-# Ejemplo de uso
 if __name__ == "__main__":
-    cuit = "20146327401"
-    password = "Ramolaz2024"
-    login_afip(cuit, password)
+    parser = argparse.ArgumentParser(description="Emite las facturas pendientes del Excel en Comprobantes en Línea")
+    config.add_arguments(parser)
+    args = parser.parse_args()
+    configuracion = config.from_args(args)
+    if not configuracion.has_credentials:
+        parser.error("Definir AFIP_CUIT y AFIP_PASSWORD (variables de entorno o archivo .env)")
+    login_afip(configuracion=configuracion)
@@ -0,0 +1,297 @@
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Límites de los histogramas de tiempos (segundos)
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base de las métricas: valores por combinación de etiquetas"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}, se recibió {tuple(labels)}")
+        return tuple(labels[n] for n in self.labelnames)
+
+    def render(self):
+        lineas = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lineas.append(f"{self.name}{_labels_text(self.labelnames, key)} {_number(value)}")
+        return lineas
+
+
+class Counter(_Metric):
+    """Contador que solo aumenta"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valor instantáneo; puede calcularse al momento de leerlo con set_function"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Calcula el valor (sin etiquetas) al exponer las métricas; None no se publica"""
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = None
+            with self._lock:
+                if value is None:
+                    self._values.pop((), None)
+                else:
+                    self._values[()] = value
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Distribución de valores en buckets acumulativos, con suma y cantidad"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            serie = self._values.get(key)
+            if serie is None:
+                serie = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, limite in enumerate(self.buckets):
+                if value <= limite:
+                    serie['counts'][i] += 1
+                    break
+            serie['sum'] += value
+            serie['count'] += 1
+
+    def render(self):
+        lineas = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((k, dict(v, counts=list(v['counts']))) for k, v in self._values.items())
+        for key, serie in items:
+            acumulado = 0
+            for limite, cantidad in zip(self.buckets, serie['counts']):
+                acumulado += cantidad
+                etiquetas = _labels_text(self.labelnames + ('le',), key + (_number(limite),))
+                lineas.append(f"{self.name}_bucket{etiquetas} {acumulado}")
+            etiquetas = _labels_text(self.labelnames, key)
+            lineas.append(f"{self.name}_sum{etiquetas} {_number(serie['sum'])}")
+            lineas.append(f"{self.name}_count{etiquetas} {serie['count']}")
+        return lineas
+
+
+class MetricsRegistry:
+    """Conjunto de métricas expuestas en formato de texto de Prometheus"""
+
+    enabled = True
+
+    def __init__(self):
+        self._metrics = {}
+        self._server = None
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Texto de exposición con todas las métricas"""
+        lineas = []
+        for metric in self._metrics.values():
+            lineas.extend(metric.render())
+        return '\n'.join(lineas) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Expone las métricas en http://host:port/metrics desde un hilo aparte.
+
+        Returns:
+            int: puerto en el que quedó escuchando (útil con port=0)
+        """
+        # Solo hace falta al exponer las métricas: no se paga al importar el módulo
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metricas', daemon=True).start()
+        puerto = self._server.server_address[1]
+        logger.info(f"Métricas disponibles en http://{host}:{puerto}/metrics")
+        return puerto
+
+    def stop(self):
+        """Detiene el servidor de métricas"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _NullMetric:
+    """Métrica deshabilitada: todas las operaciones son no-op"""
+
+    def inc(self, amount=1, **labels):
+        pass
+
+    def set(self, value, **labels):
+        pass
+
+    def set_function(self, function):
+        pass
+
+    def observe(self, value, **labels):
+        pass
+
+
+class NullRegistry:
+    """Registro deshabilitado: devuelve métricas que no hacen nada"""
+
+    enabled = False
+    _metric = _NullMetric()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._metric
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._metric
+
+    def render(self):
+        return ''
+
+    def serve(self, port, host='127.0.0.1'):
+        return None
+
+    def stop(self):
+        pass
+
+
+class InvoiceMetrics:
+    """Series del proceso de facturación"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.issued = registry.counter(
+            'facturas_emitidas_total', 'Facturas emitidas y marcadas como realizadas')
+        self.failed = registry.counter(
+            'facturas_fallidas_total', 'Facturas que fallaron, por motivo', ('reason',))
+        self.skipped = registry.counter(
+            'facturas_omitidas_total', 'Facturas no emitidas en esta ejecución, por motivo', ('reason',))
+        self.step_latency = registry.histogram(
+            'paso_duracion_segundos', 'Duración de cada paso del asistente', ('step',))
+        self.confirmation_strategy = registry.counter(
+            'confirmacion_estrategia_total', 'Estrategias de AlertHandler usadas para confirmar', ('strategy', 'result'))
+        self.download_wait = registry.histogram(
+            'descarga_espera_segundos', 'Espera desde el clic en Imprimir hasta encontrar el PDF')
+        self.ledger_load = registry.histogram(
+            'ledger_carga_segundos', 'Tiempo de carga del Excel de facturas', buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.retries = registry.counter(
+            'reintentos_total', 'Reintentos de RetryPolicy, por clase de error', ('error_class',))
+        self.sessions = registry.counter(
+            'sesiones_total', 'Sesiones preparadas para facturar, por forma (login o cambio de empresa)', ('kind',))
+        self.session_age = registry.gauge(
+            'sesion_navegador_edad_segundos', 'Antigüedad de la sesión del navegador en uso')
+
+
+_current = InvoiceMetrics(NullRegistry())
+
+
+def current():
+    """Métricas activas (no-op mientras no se llame a enable)"""
+    return _current
+
+
+def enable(port=None, host='127.0.0.1'):
+    """
+    Activa las métricas y, si se indica un puerto, las expone por HTTP.
+
+    Llamadas repetidas devuelven las métricas ya activas.
+
+    Returns:
+        InvoiceMetrics
+    """
+    global _current
+    if not _current.registry.enabled:
+        _current = InvoiceMetrics(MetricsRegistry())
+        if port is not None:
+            _current.registry.serve(port, host)
+    return _current
@@ -0,0 +1,321 @@
+"""
+Facturación de varias empresas con un grupo de navegadores compartido.
+
+Un manifiesto (TOML) lista los trabajos: credenciales de login, empresa,
+Excel, punto de venta y carpeta destino. Cada navegador del grupo toma un
+trabajo a la vez; si el siguiente trabajo usa el mismo login, cambia de
+empresa en la sesión abierta (index_bis.jsp) en lugar de volver a iniciar
+sesión.
+
+Ejemplo de manifiesto:
+
+    [[jobs]]
+    cuit = "20111111112"
+    empresa = "LAZZARINI&LAZZARINI S.R.L."
+    ledger = "lazzarini.xlsx"
+    destino = "~/Desktop/Facturas_LAZZARINI"
+
+    [[jobs]]
+    cuit = "20111111112"
+    empresa = "OTRA EMPRESA S.A."
+    punto_venta = "2"
+    ledger = "otra_empresa.xlsx"
+
+    [[jobs]]
+    cuit = "27333333334"
+    password_env = "AFIP_PASSWORD_27333333334"
+    empresa = "TERCERA S.R.L."
+    ledger = "tercera.xlsx"
+
+La clave de cada login se lee de la variable de entorno password_env (por
+defecto AFIP_PASSWORD); nunca del manifiesto. Los datos de la empresa no
+indicados salen de la empresa configurada con el mismo nombre (config.py).
+"""
+import argparse
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from archive_handler import ComprobanteArchive
+from invoice_journal import InvoiceJournal
+from invoice_recovery import archivar_descargas_pendientes
+import config
+import metrics
+from log_config import configure_logging
+from run_lifecycle import RunLifecycle, BATCH
+from step_profiler import StepProfiler
+
+logger = logging.getLogger(__name__)
+
+# Claves de un trabajo que no son de la empresa
+_CLAVES_TRABAJO = {'cuit', 'password_env', 'login_url', 'empresa', 'rows'}
+
+
+@dataclass(frozen=True)
+class Job:
+    """Un lote a facturar: Excel de una empresa con un login determinado"""
+    cuit: str
+    password: str = field(repr=False)
+    empresa: config.EmpresaConfig
+    login_url: str
+    rows: frozenset = None  # filas del Excel a emitir (None = todas las pendientes)
+
+    @property
+    def login(self):
+        """Trabajos con el mismo login pueden compartir la sesión"""
+        return (self.login_url, self.cuit)
+
+
+def load_manifest(path, configuracion=None, environ=None):
+    """
+    Lee el manifiesto de trabajos.
+
+    Args:
+        path: archivo TOML con una tabla [[jobs]] por trabajo
+        configuracion: Config de la que se toman login, CUIT y empresas (por defecto la actual)
+        environ: variables de entorno para las claves (por defecto os.environ)
+
+    Returns:
+        list: Job en el orden del manifiesto
+
+    Raises:
+        ValueError: manifiesto inválido o clave faltante
+    """
+    import tomllib
+
+    configuracion = configuracion or config.current()
+    environ = os.environ if environ is None else environ
+    with open(path, 'rb') as f:
+        datos = tomllib.load(f)
+    if set(datos) - {'jobs'}:
+        raise ValueError(f"{path}: claves desconocidas {sorted(set(datos) - {'jobs'})} (se esperaba [[jobs]])")
+
+    jobs = []
+    for i, entrada in enumerate(datos.get('jobs', []), 1):
+        origen = f"{path}: trabajo {i}"
+        if 'password' in entrada:
+            raise ValueError(f"{origen}: la clave no se guarda en el manifiesto, usar password_env")
+        cuit = str(entrada.get('cuit') or configuracion.cuit or '').strip()
+        variable = entrada.get('password_env', 'AFIP_PASSWORD')
+        password = environ.get(variable) or (configuracion.password if variable == 'AFIP_PASSWORD' else None)
+        if not cuit or not password:
+            raise ValueError(f"{origen}: falta el CUIT o la variable de entorno {variable}")
+
+        nombre = entrada.get('empresa')
+        try:
+            base = configuracion.empresa(nombre)
+        except ValueError:
+            # Empresa que solo figura en el manifiesto
+            base = config.EmpresaConfig(nombre)
+        propios = {k: v for k, v in entrada.items() if k not in _CLAVES_TRABAJO}
+        empresa = config.build_empresa(propios, base=base, origen=origen)
+        rows = frozenset(int(r) for r in entrada['rows']) if 'rows' in entrada else None
+        jobs.append(Job(cuit, password, empresa, entrada.get('login_url') or configuracion.login_url, rows))
+
+    if not jobs:
+        raise ValueError(f"{path}: el manifiesto no tiene trabajos")
+    return jobs
+
+
+def jobs_from_config(configuracion=None):
+    """Un trabajo por empresa configurada, todos con el login de la configuración"""
+    configuracion = configuracion or config.current()
+    if not configuracion.has_credentials:
+        raise ValueError("Definir AFIP_CUIT y AFIP_PASSWORD (variables de entorno o archivo .env)")
+    return [Job(configuracion.cuit, configuracion.password, empresa, configuracion.login_url)
+            for empresa in configuracion.empresas]
+
+
+class Orchestrator:
+    """
+    Reparte los trabajos entre un grupo de navegadores.
+
+    Cada worker tiene su propio Chrome y su propia carpeta de descargas (el
+    PDF de cada factura se busca como el más reciente de la carpeta, así que
+    no se puede compartir). Al elegir el siguiente trabajo un worker prefiere:
+
+        1. uno con el mismo login que su sesión (solo cambia de empresa)
+        2. uno cuyo login no esté usando otro worker
+        3. cualquier otro (se abre otra sesión del mismo login)
+
+    El Excel de cada trabajo lo procesa un único worker, de principio a fin;
+    para repartir un mismo Excel entre varios navegadores se repite el
+    trabajo (las reservas de LedgerLeases evitan emitir dos veces una fila).
+    """
+
+    def __init__(self, jobs, workers=2, headless=True, agrupar=False, lifecycle=None, downloads_folder=None,
+                 dry_run=False, profile=False):
+        """
+        Args:
+            jobs: lista de Job
+            workers: cantidad de navegadores en paralelo (como máximo uno por trabajo)
+            headless: ejecutar Chrome sin ventana
+            agrupar: emitir un solo comprobante por cliente y periodo (varias líneas de detalle)
+            lifecycle: RunLifecycle a usar (por defecto uno en modo lote)
+            downloads_folder: carpeta base de descargas; cada worker usa una subcarpeta
+            dry_run: completar los formularios sin confirmar ninguno (ver main.facturar)
+            profile: medir los pasos de todos los workers y escribir el reporte de tiempos al terminar
+        """
+        self.jobs = list(jobs)
+        self.workers = max(1, min(workers, len(self.jobs)))
+        self.headless = headless
+        self.agrupar = agrupar
+        self.lifecycle = lifecycle or RunLifecycle(BATCH)
+        self.downloads_folder = Path(downloads_folder or config.current().downloads)
+        self.dry_run = dry_run
+        # Con métricas activas se miden los pasos para el histograma de latencias
+        self.profile = profile
+        self.profiler = StepProfiler() if profile or metrics.current().registry.enabled else None
+        self.results = {}
+        # Índices de self.jobs: un trabajo repetido cuenta por separado
+        self._pendientes = list(range(len(self.jobs)))
+        self._logins_en_uso = {}
+        self._lock = threading.Lock()
+
+    def _next_job(self, worker, login):
+        """Toma el próximo trabajo para el worker según la sesión que tiene abierta"""
+        with self._lock:
+            self._logins_en_uso.pop(worker, None)
+            if not self._pendientes or self.lifecycle.stopping:
+                return None
+            en_uso = set(self._logins_en_uso.values())
+            indice = next((i for i in self._pendientes if self.jobs[i].login == login), None)
+            if indice is None:
+                indice = next((i for i in self._pendientes if self.jobs[i].login not in en_uso), self._pendientes[0])
+            self._pendientes.remove(indice)
+            self._logins_en_uso[worker] = self.jobs[indice].login
+            return indice
+
+    def _worker(self, numero):
+        """Procesa trabajos con un navegador propio hasta que no quede ninguno"""
+        # Importados aquí: el manifiesto se puede validar sin la pila del navegador
+        from browser_manager import BrowserManager
+        from diagnostics import Diagnostics
+        from screenshot_store import ScreenshotStore
+        import main as flujo
+
+        descargas = self.downloads_folder / f"worker-{numero}"
+        descargas.mkdir(parents=True, exist_ok=True)
+        browser = None
+        diagnostics = None
+        screenshots = ScreenshotStore()
+        profiler = self.profiler
+        login = None
+        try:
+            while True:
+                indice = self._next_job(numero, login)
+                if indice is None:
+                    break
+                job = self.jobs[indice]
+                empresa = job.empresa
+                logger.info(f"Worker {numero}: {empresa.nombre} (CUIT {job.cuit}, {empresa.ledger})")
+
+                def relogin(d, job=job):
+                    if profiler:
+                        profiler.instrument_driver(d)
+                    flujo.iniciar_sesion(d, job.cuit, job.password, job.login_url, job.empresa, browser)
+
+                self.lifecycle.on_shutdown(
+                    f"descargas pendientes {empresa.ledger}",
+                    lambda e=empresa: archivar_descargas_pendientes(
+                        InvoiceJournal.for_ledger(e.ledger), ComprobanteArchive(), e.destino))
+                try:
+                    if browser is None:
+                        browser = BrowserManager(headless=self.headless, download_dir=str(descargas))
+                        browser.setup_driver()
+                        relogin(browser.driver)
+                        metrics.current().sessions.inc(kind='login')
+                    elif job.login == login and flujo.cambiar_empresa(browser.driver, empresa):
+                        metrics.current().sessions.inc(kind='cambio_empresa')
+                    else:
+                        # Otro login (o falló el cambio): navegador limpio, sin las cookies anteriores
+                        browser.recycle(login=relogin)
+                        metrics.current().sessions.inc(kind='login')
+                    login = job.login
+                    if diagnostics is None:
+                        diagnostics = Diagnostics(browser.driver, screenshots=screenshots)
+                    diagnostics.driver = browser.driver
+
+                    self.results[indice] = flujo.emitir_pendientes(
+                        browser, self.lifecycle, empresa, relogin, downloads_folder=str(descargas),
+                        profiler=profiler, diagnostics=diagnostics, screenshots=screenshots, agrupar=self.agrupar,
+                        rows=job.rows, dry_run=self.dry_run)
+                except Exception as e:
+                    logger.error(f"Worker {numero}: falló el trabajo de {empresa.nombre}: {str(e)}")
+                    self.results[indice] = e
+                    # La sesión quedó en un estado desconocido: el próximo trabajo vuelve a iniciar sesión
+                    login = None
+        finally:
+            if diagnostics:
+                diagnostics.close()
+            screenshots.close()
+            if browser:
+                browser.close_browser()
+            logger.info(f"Worker {numero} terminado")
+
+    def run(self):
+        """
+        Ejecuta todos los trabajos y espera a que terminen.
+
+        Returns:
+            dict: índice en jobs -> filas emitidas, o la excepción si el trabajo falló
+        """
+        self.lifecycle.install_signal_handlers()
+        logger.info(f"{len(self.jobs)} trabajo(s) de {len({j.login for j in self.jobs})} login(s) "
+                    f"en {self.workers} navegador(es)")
+        hilos = [threading.Thread(target=self._worker, args=(n,), name=f'worker-{n}')
+                 for n in range(1, self.workers + 1)]
+        try:
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                # join con timeout para que las señales se atiendan en el hilo principal
+                while hilo.is_alive():
+                    hilo.join(1)
+        finally:
+            if self.profile:
+                self.profiler.write_report()
+            self.lifecycle.shutdown()
+
+        for indice, job in enumerate(self.jobs):
+            resultado = self.results.get(indice)
+            if isinstance(resultado, Exception):
+                logger.error(f"{job.empresa.nombre}: falló ({str(resultado)})")
+            elif resultado is None:
+                logger.warning(f"{job.empresa.nombre}: no se procesó (ejecución detenida)")
+            else:
+                logger.info(f"{job.empresa.nombre}: {resultado} factura(s) emitida(s)")
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Factura los Excel de varias empresas con un grupo de navegadores")
+    parser.add_argument('manifest', nargs='?',
+                        help="Manifiesto TOML de trabajos (por defecto uno por empresa configurada)")
+    parser.add_argument('--workers', type=int, default=2, help="Navegadores en paralelo")
+    parser.add_argument('--headed', action=argparse.BooleanOptionalAction, default=None,
+                        help="Mostrar las ventanas del navegador (por defecto según la configuración)")
+    parser.add_argument('--agrupar', action='store_true',
+                        help="Un comprobante por cliente y periodo, una línea por rendición")
+    parser.add_argument('--metrics-port', type=int, help="Exponer métricas Prometheus en este puerto local")
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    configuracion = config.from_args(args)
+    try:
+        jobs = load_manifest(args.manifest, configuracion) if args.manifest else jobs_from_config(configuracion)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    configure_logging(log_file='facturacion_orquestador.log')
+    if args.metrics_port is not None:
+        metrics.enable(args.metrics_port)
+    headless = configuracion.headless if args.headed is None else not args.headed
+    Orchestrator(jobs, workers=args.workers, headless=headless, agrupar=args.agrupar,
+                 downloads_folder=configuracion.downloads).run()
+
+
+if __name__ == "__main__":
+    main()
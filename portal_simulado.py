@@ -0,0 +1,501 @@
+"""
+Réplica local del portal de Comprobantes en Línea para pruebas y benchmarks sin red.
+
+Reproduce las páginas que recorre el flujo de login_afip / facturar con los
+mismos ids y botones: login (F1:username / F1:password), 'Ver todos',
+'COMPROBANTES EN LÍNEA', selector de empresa, menu_ppal.jsp, los pasos del
+asistente (puntodeventa, universocomprobante, fc, idconcepto, idivareceptor,
+nrodocreceptor, detalle_*), la confirmación con confirm() y la descarga del
+PDF desde imprimirComprobante.do.
+
+Permite inyectar latencia y fallas por página y expirar la sesión.
+
+Uso:
+    python portal_simulado.py --port 8800 --latency 0.3 --jitter 0.2 --failure-rate 0.01
+"""
+import argparse
+import html
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+CUIT_EMISOR = "30714395609"
+EMPRESAS_DEFAULT = ['LAZZARINI&LAZZARINI S.R.L.']
+
+# Funciones que el flujo invoca como fallback por JavaScript
+_SCRIPTS_PORTAL = """
+<script>
+var formulario = document.forms[0];
+function validarCampos() {
+    var doc = document.getElementById('nrodocreceptor');
+    if (doc && !/^\\d{11}$/.test(doc.value)) {
+        alert('El número de documento del receptor no es una CUIT válida');
+        return;
+    }
+    document.forms[0].submit();
+}
+function obtenerDenominacion(form, id) { }
+function actualizarDescripcionTC(index) { }
+function mostrarOcultar(valor) { }
+function calcularSubtotalDetalle(linea) { }
+function agregarLineaDescripcion() {
+    var lineas = document.getElementById('lineas_detalle');
+    var n = lineas.children.length + 1;
+    var fila = lineas.children[0].cloneNode(true);
+    var campos = fila.querySelectorAll('input, select');
+    for (var i = 0; i < campos.length; i++) {
+        var id = campos[i].id.replace(/\\d+$/, n);
+        campos[i].id = id;
+        campos[i].name = id;
+        campos[i].value = '';
+    }
+    lineas.appendChild(fila);
+}
+function confirmar() {
+    if (confirm('¿Está seguro que desea generar el comprobante?')) {
+        document.forms[0].submit();
+    }
+}
+</script>
+"""
+
+
+def _pagina(titulo, cuerpo, scripts=""):
+    return (f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{titulo}</title></head>"
+            f"<body>{cuerpo}{scripts}</body></html>")
+
+
+def _select(element_id, opciones):
+    items = "".join(f"<option value='{v}'>{html.escape(t)}</option>" for v, t in opciones)
+    return f"<select id='{element_id}' name='{element_id}'><option value=''>Seleccionar...</option>{items}</select>"
+
+
+def _input(element_id, tipo='text'):
+    return f"<input type='{tipo}' id='{element_id}' name='{element_id}'>"
+
+
+_CONTINUAR = "<input type='button' value='Continuar >' onclick='validarCampos();'>"
+
+
+def _lineas_detalle(form):
+    """Líneas de detalle cargadas (detalle_descripcion1..n) con su importe"""
+    lineas = []
+    n = 1
+    while f'detalle_descripcion{n}' in form:
+        lineas.append({'descripcion': form[f'detalle_descripcion{n}'],
+                       'precio': form.get(f'detalle_precio{n}', ''),
+                       'tipo_iva': form.get(f'detalle_tipo_iva{n}', '')})
+        n += 1
+    return lineas
+
+
+def _importe(texto):
+    try:
+        return float(str(texto).replace(',', '.'))
+    except ValueError:
+        return 0.0
+
+
+def _pdf(texto):
+    """Genera un PDF mínimo (una página con una línea de texto)"""
+    texto = texto.encode('ascii', 'replace').decode().replace('(', '[').replace(')', ']')
+    contenido = f"BT /F1 11 Tf 40 800 Td ({texto}) Tj ET".encode()
+    objetos = [
+        b"<</Type/Catalog/Pages 2 0 R>>",
+        b"<</Type/Pages/Kids[3 0 R]/Count 1>>",
+        b"<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]/Contents 4 0 R/Resources<</Font<</F1 5 0 R>>>>>>",
+        b"<</Length " + str(len(contenido)).encode() + b">>stream\n" + contenido + b"\nendstream",
+        b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>",
+    ]
+    salida = b"%PDF-1.4\n"
+    offsets = []
+    for numero, objeto in enumerate(objetos, 1):
+        offsets.append(len(salida))
+        salida += f"{numero} 0 obj".encode() + objeto + b"endobj\n"
+    xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    salida += b"".join(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    salida += f"trailer<</Size {len(objetos) + 1}/Root 1 0 R>>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return salida
+
+
+class PortalSimulado:
+    """
+    Servidor HTTP local que imita el portal.
+
+    Args:
+        host, port: dirección de escucha (port=0 elige uno libre)
+        latency: demora base por respuesta en segundos
+        jitter: variación aleatoria máxima sumada a la demora
+        failure_rate: probabilidad de responder 503 en cada página
+        route_latency: demoras por ruta, p. ej. {'imprimirComprobante.do': 1.0}
+        route_failure_rate: probabilidad de falla por ruta
+        session_ttl: segundos de vida de la sesión (None = no expira)
+        empresas: nombres de los botones del selector de empresa
+        seed: semilla para que las fallas sean reproducibles
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 route_latency=None, route_failure_rate=None, session_ttl=None,
+                 empresas=None, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.route_latency = route_latency or {}
+        self.route_failure_rate = route_failure_rate or {}
+        self.session_ttl = session_ttl
+        self.empresas = empresas or list(EMPRESAS_DEFAULT)
+        self.random = random.Random(seed)
+        self.sessions = {}
+        self.comprobantes = []
+        self.requests = 0
+        self._numero = 3000
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def login_url(self):
+        return f"{self.base_url}/contribuyente_/login.xhtml"
+
+    def start(self):
+        """Inicia el servidor en un hilo en segundo plano"""
+        portal = self
+
+        class Handler(_PortalHandler):
+            pass
+        Handler.portal = portal
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="portal-simulado", daemon=True)
+        self._thread.start()
+        logger.info(f"Portal simulado escuchando en {self.base_url}")
+        return self
+
+    def stop(self):
+        """Detiene el servidor"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _siguiente_numero(self):
+        with self._lock:
+            self._numero += 1
+            return self._numero
+
+    def delay_for(self, ruta):
+        base = self.route_latency.get(ruta, self.latency)
+        return base + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def should_fail(self, ruta):
+        rate = self.route_failure_rate.get(ruta, self.failure_rate)
+        return rate > 0 and self.random.random() < rate
+
+
+class _PortalHandler(BaseHTTPRequestHandler):
+    """Atiende las páginas del portal simulado"""
+
+    portal = None
+    server_version = "PortalSimulado/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    # --- utilidades -------------------------------------------------------
+
+    def _session(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        sid = cookie['JSESSIONID'].value if 'JSESSIONID' in cookie else None
+        sesion = self.portal.sessions.get(sid) if sid else None
+        if sesion and self.portal.session_ttl and time.time() - sesion['inicio'] > self.portal.session_ttl:
+            self.portal.sessions.pop(sid, None)
+            sesion = None
+        return sid, sesion
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        datos = parse_qs(self.rfile.read(length).decode('utf-8')) if length else {}
+        return {k: v[-1] for k, v in datos.items()}
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        data = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, location, headers=None):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    # --- despacho ---------------------------------------------------------
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        portal = self.portal
+        with portal._lock:
+            portal.requests += 1
+        ruta = urlparse(self.path).path
+        nombre = ruta.rsplit('/', 1)[-1] or ruta
+
+        if ruta.startswith('/_simulador/'):
+            return self._simulador(ruta)
+
+        demora = portal.delay_for(nombre)
+        if demora > 0:
+            time.sleep(demora)
+        if portal.should_fail(nombre):
+            return self._send(503, _pagina("Error", "<h1>Servicio no disponible</h1>"))
+
+        form = self._form() if method == 'POST' else {}
+        query = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+
+        rutas_publicas = {
+            '/contribuyente_/login.xhtml': self._login,
+            '/contribuyente_/ingresar': self._ingresar,
+        }
+        if ruta in rutas_publicas:
+            return rutas_publicas[ruta](form)
+
+        sid, sesion = self._session()
+        if sesion is None:
+            return self._redirect('/contribuyente_/login.xhtml')
+
+        rutas = {
+            '/portal/app/': self._portal_inicio,
+            '/portal/app/mis-servicios': self._mis_servicios,
+            '/rcel/jsp/index_bis.jsp': self._selector_empresa,
+            '/rcel/jsp/menu_ppal.jsp': self._menu,
+            '/rcel/jsp/buscarPtosVtas.do': self._paso_emisor,
+            '/rcel/jsp/genComDatosOperacion.do': self._paso_operacion,
+            '/rcel/jsp/genComDatosReceptor.do': self._paso_receptor,
+            '/rcel/jsp/genComDetalle.do': self._paso_detalle,
+            '/rcel/jsp/genComResumenDatos.do': self._paso_resumen,
+            '/rcel/jsp/genComComprobanteGenerado.do': self._comprobante_generado,
+            '/rcel/jsp/imprimirComprobante.do': self._imprimir,
+        }
+        handler = rutas.get(ruta)
+        if handler is None:
+            return self._send(404, _pagina("No encontrado", "<h1>404</h1>"))
+        return handler(sesion, form, query)
+
+    # --- páginas ----------------------------------------------------------
+
+    def _login(self, form):
+        cuerpo = """
+        <form id='F1' method='post' action='/contribuyente_/ingresar'>
+          <div id='paso_usuario'>
+            <label>CUIT/CUIL</label><input type='text' id='F1:username' name='username'>
+            <input type='button' id='F1:btnSiguiente' value='Siguiente'
+                   onclick="document.getElementById('paso_usuario').style.display='none';
+                            document.getElementById('paso_clave').style.display='block';">
+          </div>
+          <div id='paso_clave' style='display:none'>
+            <label>Clave</label><input type='password' id='F1:password' name='password'>
+            <input type='button' id='F1:btnIngresar' value='Ingresar' onclick='document.forms[0].submit();'>
+          </div>
+        </form>"""
+        return self._send(200, _pagina("Acceso con Clave Fiscal", cuerpo))
+
+    def _ingresar(self, form):
+        if not form.get('username') or not form.get('password'):
+            return self._redirect('/contribuyente_/login.xhtml')
+        sid = secrets.token_hex(16)
+        self.portal.sessions[sid] = {'cuit': form['username'], 'inicio': time.time(),
+                                     'empresa': None, 'borrador': {}, 'ultimo': None}
+        return self._redirect('/portal/app/', headers={'Set-Cookie': f'JSESSIONID={sid}; Path=/'})
+
+    def _portal_inicio(self, sesion, form, query):
+        cuerpo = "<h2>Mis Servicios</h2><a href='/portal/app/mis-servicios'>Ver todos</a>"
+        return self._send(200, _pagina("Portal", cuerpo))
+
+    def _mis_servicios(self, sesion, form, query):
+        cuerpo = ("<div class='servicio' style='margin-top:1200px'>"
+                  "<h3 style='cursor:pointer' onclick=\"window.open('/rcel/jsp/index_bis.jsp', '_blank');\">"
+                  "COMPROBANTES EN LÍNEA</h3><p>Sistema de emisión de comprobantes</p></div>")
+        return self._send(200, _pagina("Servicios", cuerpo))
+
+    def _selector_empresa(self, sesion, form, query):
+        botones = "".join(
+            f"<input type='button' class='btn_empresa' value='{html.escape(nombre, quote=True)}' "
+            f"onclick=\"location.href='menu_ppal.jsp?empresa={i}'\"><br>"
+            for i, nombre in enumerate(self.portal.empresas))
+        return self._send(200, _pagina("Elegir empresa", f"<h2>Empresas representadas</h2>{botones}"))
+
+    def _menu(self, sesion, form, query):
+        if 'empresa' in query:
+            sesion['empresa'] = self.portal.empresas[int(query['empresa'])]
+        if sesion['empresa'] is None:
+            return self._redirect('index_bis.jsp')
+        sesion['borrador'] = {}
+        cuerpo = (f"<h2>{html.escape(sesion['empresa'])}</h2>"
+                  "<a href='buscarPtosVtas.do'>Generar Comprobantes</a><br>"
+                  "<a href='index_bis.jsp'>Cambiar empresa</a>")
+        return self._send(200, _pagina("Menú Principal", cuerpo))
+
+    def _paso(self, titulo, accion, campos, error=None):
+        errores = f"<div id='mensajes_error' class='error'>{html.escape(error)}</div>" if error else ""
+        cuerpo = (f"<h2>{titulo}</h2>{errores}<form method='post' action='{accion}'>{campos}"
+                  f"<div id='botones'>{_CONTINUAR}</div></form>")
+        return self._send(200, _pagina(titulo, cuerpo, _SCRIPTS_PORTAL))
+
+    def _paso_emisor(self, sesion, form, query):
+        campos = (_select('puntodeventa', [('4', '00004 - Web Services')]) +
+                  _select('universocomprobante', [('10', 'Factura A'), ('19', 'Factura B'), ('11', 'Factura C')]))
+        return self._paso("Punto de Venta y Tipo de Comprobante", 'genComDatosOperacion.do', campos)
+
+    def _paso_operacion(self, sesion, form, query, error=None):
+        sesion['borrador'].update(form)
+        campos = (_input('fc') +
+                  _select('idconcepto', [('1', 'Productos'), ('2', 'Servicios'), ('3', 'Productos y Servicios')]) +
+                  _input('fsd') + _input('fsh') + _input('vencimientopago') +
+                  _select('actiAsociadaId', [('682091', 'Servicios inmobiliarios')]))
+        return self._paso("Datos de emisión", 'genComDatosReceptor.do', campos, error)
+
+    def _paso_receptor(self, sesion, form, query):
+        # Validación del servidor: el error vuelve en la misma página, como texto
+        for campo in ('fc', 'fsd', 'fsh', 'vencimientopago'):
+            try:
+                datetime.strptime(form.get(campo, ''), '%d/%m/%Y')
+            except ValueError:
+                return self._paso_operacion(sesion, {}, query,
+                                            error=f"La fecha {campo} es inválida: '{form.get(campo, '')}'")
+        sesion['borrador'].update(form)
+        campos = (_select('idivareceptor', [('1', 'IVA Responsable Inscripto'), ('4', 'IVA Sujeto Exento'),
+                                            ('5', 'Consumidor Final'), ('6', 'Responsable Monotributo')]) +
+                  _input('nrodocreceptor') +
+                  "<input type='checkbox' id='formadepago1' name='formadepago1' value='1'> Contado")
+        return self._paso("Datos del receptor", 'genComDetalle.do', campos)
+
+    def _paso_detalle(self, sesion, form, query, error=None):
+        sesion['borrador'].update(form)
+        linea = (_input('detalle_descripcion1') +
+                 _select('detalle_medida1', [('7', 'unidades'), ('98', 'otras unidades')]) +
+                 _input('detalle_precio1') +
+                 _select('detalle_tipo_iva1', [('3', '0%'), ('4', '10.5%'), ('5', '21%')]))
+        campos = (f"<div id='lineas_detalle'><div class='linea'>{linea}</div></div>"
+                  "<input type='button' value='Agregar línea descripción' onclick='agregarLineaDescripcion();'>")
+        return self._paso("Datos de la operación", 'genComResumenDatos.do', campos, error)
+
+    def _paso_resumen(self, sesion, form, query):
+        for numero, linea in enumerate(_lineas_detalle(form), 1):
+            if _importe(linea['precio']) <= 0:
+                return self._paso_detalle(sesion, {}, query,
+                                          error=f"El precio unitario de la línea {numero} debe ser mayor a cero")
+        sesion['borrador'].update(form)
+        filas = "".join(f"<tr><td>{html.escape(k)}</td><td>{html.escape(v)}</td></tr>"
+                        for k, v in sorted(sesion['borrador'].items()))
+        cuerpo = ("<h2>Resumen de datos</h2><form method='post' action='genComComprobanteGenerado.do'>"
+                  f"<table>{filas}</table>"
+                  "<input type='button' value='Confirmar Datos...' onclick='confirmar();'></form>")
+        return self._send(200, _pagina("Resumen", cuerpo, _SCRIPTS_PORTAL))
+
+    def _comprobante_generado(self, sesion, form, query):
+        numero = self.portal._siguiente_numero()
+        lineas = _lineas_detalle(sesion['borrador'])
+        comprobante = dict(sesion['borrador'], numero=numero, empresa=sesion['empresa'],
+                           login=sesion['cuit'], emitido=time.time(), lineas=len(lineas),
+                           total=round(sum(_importe(l['precio']) for l in lineas), 2))
+        self.portal.comprobantes.append(comprobante)
+        sesion['ultimo'] = comprobante
+        sesion['borrador'] = {}
+        cuerpo = (f"<h2>Comprobante Generado</h2><p>Número: 00004-{numero:08d}</p>"
+                  "<div id='botones_comprobante'>"
+                  f"<input type='button' value='Imprimir...' "
+                  f"onclick=\"parent.location.href='imprimirComprobante.do?c={numero}'\">"
+                  "</div>"
+                  "<input type='button' value='Menú Principal' onclick=\"parent.location.href='menu_ppal.jsp'\">")
+        return self._send(200, _pagina("Comprobante Generado", cuerpo))
+
+    def _imprimir(self, sesion, form, query):
+        numero = int(query.get('c', 0))
+        comprobante = next((c for c in self.portal.comprobantes if c['numero'] == numero), None)
+        if comprobante is None:
+            return self._send(404, _pagina("No encontrado", "<h1>Comprobante inexistente</h1>"))
+        detalle = " / ".join(f"{l['descripcion']} ${l['precio']}" for l in _lineas_detalle(comprobante))
+        texto = (f"Comprobante 00004-{numero:08d} {comprobante.get('nrodocreceptor', '')} "
+                 f"{detalle} Total ${comprobante['total']}")
+        nombre = f"{CUIT_EMISOR}_001_00004_{numero:08d}.pdf"
+        return self._send(200, _pdf(texto), 'application/pdf',
+                          {'Content-Disposition': f'attachment; filename="{nombre}"'})
+
+    def _simulador(self, ruta):
+        """Endpoints de inspección para pruebas: comprobantes emitidos y contadores"""
+        if ruta == '/_simulador/comprobantes':
+            return self._send(200, json.dumps(self.portal.comprobantes), 'application/json')
+        if ruta == '/_simulador/estado':
+            estado = {'requests': self.portal.requests, 'sesiones': len(self.portal.sessions),
+                      'comprobantes': len(self.portal.comprobantes)}
+            return self._send(200, json.dumps(estado), 'application/json')
+        return self._send(404, "{}", 'application/json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Portal de Comprobantes en Línea simulado")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0.0, help="Demora base por respuesta (s)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Variación aleatoria de la demora (s)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Probabilidad de responder 503")
+    parser.add_argument('--route-latency', action='append', default=[], metavar='RUTA=SEG',
+                        help="Demora para una ruta, p. ej. imprimirComprobante.do=1.5")
+    parser.add_argument('--session-ttl', type=float, help="Segundos hasta que expira la sesión")
+    parser.add_argument('--empresa', action='append', help="Nombre de empresa representada (repetible)")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    route_latency = {}
+    for item in args.route_latency:
+        ruta, _, segundos = item.partition('=')
+        route_latency[ruta] = float(segundos)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    portal = PortalSimulado(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                            failure_rate=args.failure_rate, route_latency=route_latency,
+                            session_ttl=args.session_ttl, empresas=args.empresa, seed=args.seed)
+    portal.start()
+    print(f"Login: {portal.login_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        portal.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import logging
+import random
+import time
+import unicodedata
+from dataclasses import dataclass
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Clases de error
+STALE = 'stale'                      # el DOM cambió bajo el elemento: reintentar enseguida
+TIMEOUT = 'timeout'                  # la página no llegó a tiempo: reintentar con espera creciente
+SESSION_EXPIRED = 'session_expired'  # hay que volver a iniciar sesión: reintentar aquí no sirve
+VALIDATION = 'validation'            # el portal rechazó los datos: reintentar no sirve
+UNKNOWN = 'unknown'
+
+CLASES = [STALE, TIMEOUT, SESSION_EXPIRED, VALIDATION, UNKNOWN]
+
+
+class PortalValidationError(Exception):
+    """El portal rechazó los datos de la factura (falla permanente para esa fila)"""
+
+    def __init__(self, mensaje, campos=None):
+        super().__init__(mensaje)
+        self.campos = campos or []
+
+
+class SessionExpiredError(Exception):
+    """La sesión de AFIP expiró o el navegador dejó de responder"""
+
+
+# Por nombre para no importar selenium en este módulo; se recorre la jerarquía
+# de la excepción, así también se reconocen subclases
+_CLASE_POR_EXCEPCION = {
+    'StaleElementReferenceException': STALE,
+    'ElementClickInterceptedException': STALE,
+    'ElementNotInteractableException': STALE,
+    'TimeoutException': TIMEOUT,
+    'NoSuchElementException': TIMEOUT,
+    'TimeoutError': TIMEOUT,
+    'InvalidSessionIdException': SESSION_EXPIRED,
+    'NoSuchWindowException': SESSION_EXPIRED,
+    'SessionExpiredError': SESSION_EXPIRED,
+    'PortalValidationError': VALIDATION,
+}
+
+# Textos (sin tildes, en minúsculas) de las alertas con que el portal rechaza
+# datos. Una alerta inesperada con otro texto (aviso de sesión, mantenimiento,
+# alerta que quedó abierta) no dice nada de la fila y se reintenta.
+_ALERTA_VALIDACION = ('invalid', 'incorrect', 'debe ', 'obligatori', 'requerid', 'no puede',
+                      'no es valid', 'formato', 'complete', 'ingrese', 'verifique')
+
+# Mensajes de WebDriverException que indican que el navegador ya no sirve
+_SESION_PERDIDA = ('invalid session id', 'disconnected', 'chrome not reachable',
+                   'no such window', 'target window already closed')
+
+# Si tras un timeout el navegador está en el login, la sesión expiró
+_URL_LOGIN = ('login.xhtml', 'auth.afip.gob.ar')
+
+
+def classify(error, driver=None):
+    """
+    Clasifica una excepción del flujo de facturación.
+
+    Args:
+        error: excepción a clasificar
+        driver: WebDriver (opcional); ante un timeout se mira si la página
+                actual es el login, lo que indica una sesión expirada
+
+    Returns:
+        str: una de CLASES
+    """
+    clase = getattr(error, 'error_class', None)
+    if clase:
+        return clase
+    clase = UNKNOWN
+    for tipo in type(error).__mro__:
+        if tipo.__name__ == 'UnexpectedAlertPresentException':
+            # Solo es un rechazo de datos si el texto de la alerta lo dice
+            clase = VALIDATION if es_alerta_de_validacion(getattr(error, 'alert_text', None)) else UNKNOWN
+            break
+        if tipo.__name__ in _CLASE_POR_EXCEPCION:
+            clase = _CLASE_POR_EXCEPCION[tipo.__name__]
+            break
+    if clase in (STALE, TIMEOUT, UNKNOWN):
+        mensaje = str(error).lower()
+        if any(texto in mensaje for texto in _SESION_PERDIDA):
+            return SESSION_EXPIRED
+    if clase == TIMEOUT and driver is not None:
+        try:
+            url = driver.current_url
+        except Exception:
+            return SESSION_EXPIRED
+        if any(texto in url for texto in _URL_LOGIN):
+            return SESSION_EXPIRED
+    return clase
+
+
+def es_alerta_de_validacion(texto):
+    """Indica si el texto de una alerta del portal es un rechazo de los datos ingresados"""
+    if not texto:
+        return False
+    texto = unicodedata.normalize('NFKD', texto.lower()).encode('ascii', 'ignore').decode()
+    return any(patron in texto for patron in _ALERTA_VALIDACION)
+
+
+@dataclass(frozen=True)
+class Backoff:
+    """Reintentos de una clase de error: intentos totales y espera exponencial"""
+    attempts: int
+    delay: float = 0.0
+    factor: float = 2.0
+    max_delay: float = 30.0
+    jitter: float = 0.1
+
+    def wait(self, retry):
+        """Segundos a esperar antes del reintento número retry (desde 1)"""
+        espera = min(self.delay * self.factor ** (retry - 1), self.max_delay)
+        return max(0.0, espera * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+DEFAULT_BACKOFFS = {
+    STALE: Backoff(4, delay=0.25, max_delay=2),
+    TIMEOUT: Backoff(2, delay=2),
+    SESSION_EXPIRED: Backoff(1),
+    VALIDATION: Backoff(1),
+    UNKNOWN: Backoff(2, delay=1),
+}
+
+
+class RetryPolicy:
+    """
+    Reintentos según la clase de error.
+
+    Cada clase tiene su propia cantidad de intentos y espera exponencial; las
+    fallas permanentes (sesión expirada, datos rechazados) se propagan al
+    primer intento. budget limita el tiempo total de una operación: no se
+    empieza un reintento que lo superaría.
+    """
+
+    def __init__(self, backoffs=None, budget=None, sleep=time.sleep, clock=time.monotonic):
+        """
+        Args:
+            backoffs: dict clase -> Backoff que reemplaza a los de DEFAULT_BACKOFFS
+            budget: segundos máximos por operación (None = sin límite)
+            sleep, clock: funciones de espera y reloj (reemplazables en pruebas)
+        """
+        self.backoffs = dict(DEFAULT_BACKOFFS, **(backoffs or {}))
+        self.budget = budget
+        self._sleep = sleep
+        self._clock = clock
+
+    def call(self, fn, description="", driver=None, on_retry=None):
+        """
+        Ejecuta fn reintentando según la clase de cada error.
+
+        Args:
+            fn: función sin argumentos; una excepción indica falla
+            description: descripción de la operación para logging
+            driver: WebDriver para distinguir timeouts de sesión expirada (opcional)
+            on_retry: función (clase, error) llamada antes de cada reintento (opcional)
+
+        Returns:
+            lo que devuelva fn
+
+        Raises:
+            la última excepción de fn, con el atributo error_class asignado
+        """
+        inicio = self._clock()
+        intentos = {}
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                clase = classify(e, driver)
+                e.error_class = clase
+                n = intentos[clase] = intentos.get(clase, 0) + 1
+                backoff = self.backoffs.get(clase, self.backoffs[UNKNOWN])
+                if n >= backoff.attempts:
+                    if backoff.attempts > 1:
+                        logger.warning(f"{description}: {clase} en {n} intentos, se abandona")
+                    raise
+                espera = backoff.wait(n)
+                if self.budget is not None and self._clock() - inicio + espera > self.budget:
+                    logger.warning(f"{description}: se agotó el tiempo de {self.budget}s para reintentar ({clase})")
+                    raise
+                logger.info(f"{description}: {clase} ({str(e).splitlines()[0] if str(e) else type(e).__name__}), "
+                            f"reintento {n} en {espera:.1f}s")
+                metrics.current().retries.inc(error_class=clase)
+                if on_retry:
+                    on_retry(clase, e)
+                self._sleep(espera)
+
+
+# Política por defecto de las interacciones con el portal
+DEFAULT_POLICY = RetryPolicy(budget=45)
+
+# Espera del PDF tras hacer clic en Imprimir: sondeos cada vez más espaciados
+POLITICA_DESCARGA = RetryPolicy({TIMEOUT: Backoff(8, delay=0.5, factor=1.5, max_delay=5, jitter=0)}, budget=30)
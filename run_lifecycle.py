@@ -0,0 +1,119 @@
+import logging
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+
+BATCH = 'batch'
+INTERACTIVE = 'interactive'
+
+
+class RunLifecycle:
+    """
+    Controla el ciclo de vida de una ejecución: modo lote o interactivo,
+    apagado ordenado ante SIGINT/SIGTERM y tareas de vaciado al salir.
+
+    La primera señal solo pide detenerse (la factura en curso termina y el
+    lote se corta antes de la siguiente); una segunda SIGINT fuerza la salida
+    con KeyboardInterrupt.
+    """
+
+    def __init__(self, mode=BATCH):
+        """
+        Inicializa el controlador.
+
+        Args:
+            mode: BATCH (termina al vaciar el lote) o INTERACTIVE (mantiene la sesión abierta)
+        """
+        if mode not in (BATCH, INTERACTIVE):
+            raise ValueError(f"Modo desconocido: {mode}")
+        self.mode = mode
+        self._stop = threading.Event()
+        self._callbacks = {}
+        self._previous_handlers = {}
+        self._shutdown_done = False
+
+    @property
+    def stopping(self):
+        """True si se pidió detener la ejecución"""
+        return self._stop.is_set()
+
+    def request_stop(self):
+        """Pide detener la ejecución de forma ordenada"""
+        self._stop.set()
+
+    def sleep(self, seconds):
+        """
+        Espera seconds segundos o hasta que se pida detener la ejecución.
+
+        Returns:
+            bool: True si se pidió detener
+        """
+        return self._stop.wait(seconds)
+
+    def install_signal_handlers(self):
+        """Conecta SIGINT y SIGTERM (solo posible desde el hilo principal)"""
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("No se instalan manejadores de señales fuera del hilo principal")
+            return
+        for signame in ('SIGINT', 'SIGTERM'):
+            signum = getattr(signal, signame, None)
+            if signum is None:
+                continue
+            self._previous_handlers[signum] = signal.getsignal(signum)
+            signal.signal(signum, self._handle_signal)
+
+    def restore_signal_handlers(self):
+        """Restaura los manejadores de señales anteriores"""
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def _handle_signal(self, signum, frame):
+        """Primera señal: apagado ordenado. Segunda SIGINT: interrupción inmediata"""
+        if self._stop.is_set() and signum == signal.SIGINT:
+            raise KeyboardInterrupt
+        logger.info(f"Señal {signal.Signals(signum).name} recibida, deteniendo al terminar la factura en curso...")
+        self._stop.set()
+
+    def on_shutdown(self, name, callback):
+        """
+        Registra una tarea a ejecutar al salir.
+
+        Args:
+            name: nombre de la tarea (registrar el mismo nombre reemplaza la anterior)
+            callback: función sin argumentos
+        """
+        self._callbacks[name] = callback
+
+    def wait(self):
+        """
+        En modo interactivo bloquea hasta recibir una señal (sin consumir CPU).
+        En modo lote retorna inmediatamente.
+        """
+        if self.mode != INTERACTIVE:
+            return
+        logger.info("Sesión abierta. Presiona Ctrl+C o envía SIGTERM para cerrar.")
+        # wait con timeout para que las señales se atiendan también en Windows
+        while not self._stop.wait(1):
+            pass
+
+    def shutdown(self):
+        """Ejecuta una única vez las tareas de salida registradas"""
+        if self._shutdown_done:
+            return
+        self._shutdown_done = True
+        for name, callback in list(self._callbacks.items()):
+            try:
+                logger.info(f"Ejecutando tarea de salida: {name}")
+                callback()
+            except Exception as e:
+                logger.error(f"Error en tarea de salida {name}: {str(e)}")
+        self.restore_signal_handlers()
+
+    def __enter__(self):
+        self.install_signal_handlers()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
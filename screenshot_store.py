@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from log_config import correlation_id_for
+
+logger = logging.getLogger(__name__)
+
+
+def _slug(texto):
+    """Texto apto para nombre de archivo"""
+    return re.sub(r'[^\w.-]+', '_', str(texto)).strip('_')[:60] or 'x'
+
+
+class ScreenshotStore:
+    """
+    Capturas de pantalla de errores, escritas en segundo plano.
+
+    La imagen se pide al navegador con una sola llamada (base64) y el resto
+    (compresión y escritura) ocurre en un hilo aparte, así el flujo no espera
+    al disco. Cada ejecución usa su propia carpeta y los nombres incluyen la
+    factura y el paso, por lo que ninguna captura pisa a otra. Dos capturas
+    idénticas se guardan una sola vez y el total en disco se mantiene por
+    debajo de max_bytes borrando las capturas más viejas.
+    """
+
+    def __init__(self, folder="capturas", max_bytes=200 * 1024 * 1024, jpeg_quality=70):
+        """
+        Args:
+            folder: carpeta base de las capturas (una subcarpeta por ejecución)
+            max_bytes: espacio máximo que pueden ocupar todas las capturas
+            jpeg_quality: calidad JPEG al recomprimir (requiere Pillow)
+        """
+        self.folder = folder
+        self.run_dir = os.path.join(folder, datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self.max_bytes = max_bytes
+        self.jpeg_quality = jpeg_quality
+        self._hashes = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='capturas')
+
+    def capture(self, driver, step, factura=None):
+        """
+        Toma una captura y la encola para escribirla.
+
+        Args:
+            driver: WebDriver
+            step: paso del flujo en el que se toma la captura
+            factura: factura en curso (opcional)
+
+        Returns:
+            Future con la ruta final de la captura (None si no se guardó)
+        """
+        try:
+            data = driver.get_screenshot_as_base64()
+        except Exception as e:
+            logger.error(f"Error tomando captura de pantalla: {str(e)}")
+            return None
+        return self.submit(data, step, factura)
+
+    def submit(self, data_base64, step, factura=None):
+        """Encola una captura ya obtenida en base64"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        invoice = correlation_id_for(factura) if factura is not None else 'general'
+        nombre = f"{seq:04d}_{_slug(invoice)}_{_slug(step)}"
+        return self._executor.submit(self._write, data_base64, nombre)
+
+    def _compress(self, png):
+        """Recomprime a JPEG si Pillow está instalado; si no, deja el PNG"""
+        try:
+            from PIL import Image
+        except ImportError:
+            return png, 'png'
+        try:
+            with Image.open(io.BytesIO(png)) as img:
+                salida = io.BytesIO()
+                img.convert('RGB').save(salida, 'JPEG', quality=self.jpeg_quality, optimize=True)
+            return salida.getvalue(), 'jpg'
+        except Exception as e:
+            logger.warning(f"No se pudo comprimir la captura: {str(e)}")
+            return png, 'png'
+
+    def _write(self, data_base64, nombre):
+        """Escribe la captura (se ejecuta en el hilo de capturas)"""
+        try:
+            png = base64.b64decode(data_base64)
+            digest = hashlib.sha256(png).hexdigest()
+            if digest in self._hashes:
+                logger.info(f"Captura {nombre} idéntica a {self._hashes[digest]}, no se duplica")
+                return self._hashes[digest]
+
+            data, extension = self._compress(png)
+            if not self._make_room(len(data)):
+                logger.warning(f"Captura {nombre} descartada: se alcanzó el límite de {self.max_bytes} bytes")
+                return None
+
+            os.makedirs(self.run_dir, exist_ok=True)
+            path = os.path.join(self.run_dir, f"{nombre}.{extension}")
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._hashes[digest] = path
+            logger.info(f"Captura de pantalla guardada: {path}")
+            return path
+        except Exception as e:
+            logger.error(f"Error guardando captura {nombre}: {str(e)}")
+            return None
+
+    def _make_room(self, size):
+        """Borra las capturas más viejas hasta que entre una nueva de 'size' bytes"""
+        if size > self.max_bytes:
+            return False
+        archivos = []
+        for raiz, _, nombres in os.walk(self.folder):
+            for nombre in nombres:
+                path = os.path.join(raiz, nombre)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                archivos.append((st.st_mtime, st.st_size, path))
+        total = sum(a[1] for a in archivos)
+        for _, tamano, path in sorted(archivos):
+            if total + size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= tamano
+                self._hashes = {h: p for h, p in self._hashes.items() if p != path}
+            except OSError:
+                continue
+        return total + size <= self.max_bytes
+
+    def close(self):
+        """Espera a que terminen de escribirse las capturas pendientes"""
+        self._executor.shutdown(wait=True)
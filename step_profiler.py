@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano (None si no hay valores)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class _StepRecord:
+    """Medición de un paso en curso"""
+
+    __slots__ = ('invoice', 'step', 'start', 'commands_start', 'retries', 'fallbacks', 'ok')
+
+    def __init__(self, invoice, step, commands_start):
+        self.invoice = invoice
+        self.step = step
+        self.start = time.perf_counter()
+        self.commands_start = commands_start
+        self.retries = 0
+        self.fallbacks = 0
+        self.ok = True
+
+
+class StepProfiler:
+    """
+    Mide cada paso del flujo de facturación: tiempo, comandos WebDriver,
+    reintentos y uso de fallbacks, por paso y por factura.
+
+    Los pasos se pueden anidar (un paso de InvoiceProcessor contiene varios
+    safe_click); reintentos y fallbacks se atribuyen al paso más interno.
+
+    Los pasos y los comandos se cuentan por hilo, así un mismo profiler sirve a
+    varios workers (cada uno con su navegador) sin mezclar sus comandos.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.invoices = []
+        self._commands = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return True
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+            self._local.invoice = None
+        return self._local.stack
+
+    def _thread_commands(self):
+        """Comandos WebDriver enviados desde el hilo actual"""
+        return getattr(self._local, 'commands', 0)
+
+    def instrument_driver(self, driver):
+        """
+        Cuenta los comandos WebDriver del driver.
+
+        Todos los comandos (find_element, click, execute_script...) pasan por
+        WebDriver.execute, que se envuelve en la instancia.
+        """
+        original = driver.execute
+
+        def execute(driver_command, params=None):
+            self._local.commands = self._thread_commands() + 1
+            with self._lock:
+                self._commands += 1
+            return original(driver_command, params)
+
+        driver.execute = execute
+        return driver
+
+    @property
+    def command_count(self):
+        """Comandos WebDriver de todos los hilos"""
+        return self._commands
+
+    def begin_invoice(self, factura):
+        """Empieza a agrupar las mediciones bajo una factura"""
+        self._stack()
+        self._local.invoice = f"{factura.cliente} #{factura.rendicion}"
+        self._local.invoice_start = (time.perf_counter(), self._thread_commands())
+
+    def end_invoice(self, ok=True):
+        """Cierra la factura abierta con begin_invoice"""
+        self._stack()
+        if self._local.invoice is None:
+            return
+        self.checkpoint(None)
+        inicio, comandos = self._local.invoice_start
+        with self._lock:
+            self.invoices.append({
+                'invoice': self._local.invoice,
+                'wall_s': time.perf_counter() - inicio,
+                'commands': self._thread_commands() - comandos,
+                'ok': ok
+            })
+        self._local.invoice = None
+
+    @contextmanager
+    def invoice(self, factura):
+        """Agrupa los pasos medidos dentro del bloque bajo una factura"""
+        self.begin_invoice(factura)
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.end_invoice(ok)
+
+    @contextmanager
+    def step(self, name):
+        """Mide el bloque como un paso con nombre"""
+        stack = self._stack()
+        record = _StepRecord(self._local.invoice, name, self._thread_commands())
+        stack.append(record)
+        try:
+            yield record
+        except BaseException:
+            record.ok = False
+            raise
+        finally:
+            stack.pop()
+            self._finish(record)
+
+    def checkpoint(self, name):
+        """
+        Cierra el tramo abierto por el checkpoint anterior y abre uno nuevo.
+
+        Pensado para código lineal largo (como main.facturar) donde envolver
+        cada bloque con 'with' no es práctico. checkpoint(None) solo cierra.
+        """
+        self._stack()
+        abierto = getattr(self._local, 'checkpoint', None)
+        if abierto is not None:
+            self._finish(abierto)
+        self._local.checkpoint = _StepRecord(self._local.invoice, name, self._thread_commands()) if name else None
+
+    def note_retry(self):
+        """Registra un reintento en el paso más interno"""
+        stack = self._stack()
+        if stack:
+            stack[-1].retries += 1
+
+    def note_fallback(self):
+        """Registra el uso de un fallback (JavaScript, Actions...) en el paso más interno"""
+        stack = self._stack()
+        if stack:
+            stack[-1].fallbacks += 1
+
+    def mark_failed(self):
+        """Marca como fallido el paso más interno aunque no haya lanzado excepción"""
+        stack = self._stack()
+        if stack:
+            stack[-1].ok = False
+
+    def _finish(self, record):
+        wall = time.perf_counter() - record.start
+        comandos = self._thread_commands() - record.commands_start
+        metrics.current().step_latency.observe(wall, step=record.step)
+        with self._lock:
+            self.records.append({
+                'invoice': record.invoice,
+                'step': record.step,
+                'wall_s': wall,
+                'commands': comandos,
+                'retries': record.retries,
+                'fallbacks': record.fallbacks,
+                'ok': record.ok
+            })
+
+    def summary(self):
+        """Estadísticas por paso: p50, p95 y máximo de tiempo, comandos, reintentos y fallbacks"""
+        por_paso = {}
+        for r in self.records:
+            por_paso.setdefault(r['step'], []).append(r)
+
+        pasos = {}
+        for step, records in sorted(por_paso.items()):
+            tiempos = [r['wall_s'] for r in records]
+            pasos[step] = {
+                'count': len(records),
+                'p50_s': percentile(tiempos, 50),
+                'p95_s': percentile(tiempos, 95),
+                'max_s': max(tiempos),
+                'commands_mean': sum(r['commands'] for r in records) / len(records),
+                'retries': sum(r['retries'] for r in records),
+                'fallbacks': sum(r['fallbacks'] for r in records),
+                'failures': sum(1 for r in records if not r['ok'])
+            }
+
+        tiempos_factura = [i['wall_s'] for i in self.invoices]
+        return {
+            'steps': pasos,
+            'invoices': {
+                'count': len(self.invoices),
+                'p50_s': percentile(tiempos_factura, 50),
+                'p95_s': percentile(tiempos_factura, 95),
+                'max_s': max(tiempos_factura) if tiempos_factura else None,
+                'commands_total': sum(i['commands'] for i in self.invoices)
+            }
+        }
+
+    def write_report(self, folder="perfiles"):
+        """
+        Escribe el reporte de la ejecución (resumen + mediciones crudas) en JSON.
+
+        Returns:
+            str: ruta del reporte, o None si no hubo mediciones
+        """
+        self.checkpoint(None)
+        if not self.records:
+            return None
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"perfil_{datetime.now():%Y%m%d_%H%M%S}.json")
+        resumen = self.summary()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'summary': resumen, 'invoices': self.invoices, 'steps': self.records},
+                      f, ensure_ascii=False, indent=2)
+
+        logger.info(f"{'paso':<50}{'n':>5}{'p50':>8}{'p95':>8}{'max':>8}{'cmd':>6}{'reint':>6}{'fallb':>6}")
+        for step, st in resumen['steps'].items():
+            logger.info(f"{step[:49]:<50}{st['count']:>5}{st['p50_s']:>8.2f}{st['p95_s']:>8.2f}"
+                        f"{st['max_s']:>8.2f}{st['commands_mean']:>6.1f}{st['retries']:>6}{st['fallbacks']:>6}")
+        logger.info(f"Reporte de tiempos guardado en {path}")
+        return path
+
+
+class NullProfiler:
+    """Profiler que no mide nada; se usa cuando no se pidió instrumentación"""
+
+    enabled = False
+    command_count = 0
+
+    def instrument_driver(self, driver):
+        return driver
+
+    def begin_invoice(self, factura):
+        pass
+
+    def end_invoice(self, ok=True):
+        pass
+
+    @contextmanager
+    def invoice(self, factura):
+        yield
+
+    @contextmanager
+    def step(self, name):
+        yield None
+
+    def checkpoint(self, name):
+        pass
+
+    def note_retry(self):
+        pass
+
+    def note_fallback(self):
+        pass
+
+    def mark_failed(self):
+        pass
+
+    def write_report(self, folder="perfiles"):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
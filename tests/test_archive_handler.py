@@ -0,0 +1,63 @@
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+from archive_handler import ComprobanteArchive
+from invoice_pipeline import ReceptorCache
+
+
+def factura(rendicion, cuit="20123456786", cliente="CLIENTE SA", cond_iva="RI"):
+    return SimpleNamespace(cliente=cliente, cuit=cuit, cond_iva=cond_iva, rendicion=rendicion,
+                           periodo="ENERO 2025", fecha=datetime(2025, 1, 31), row_index=2)
+
+
+def pdf(tmp_path, nombre, contenido):
+    path = tmp_path / nombre
+    path.write_bytes(contenido)
+    return path
+
+
+def test_dos_archivos_sobre_la_misma_raiz_no_pierden_entradas(tmp_path):
+    raiz = tmp_path / "archivo"
+    a, b = ComprobanteArchive(raiz), ComprobanteArchive(raiz)
+
+    a.store(pdf(tmp_path, "1.pdf", b"%PDF-1"), factura("1"))
+    b.store(pdf(tmp_path, "2.pdf", b"%PDF-2"), factura("2"))
+
+    nuevo = ComprobanteArchive(raiz)
+    assert len(nuevo) == 2
+    assert nuevo.is_invoiced(factura("1")) and nuevo.is_invoiced(factura("2"))
+    # Cada instancia ve también lo que guardó la otra
+    assert a.is_invoiced(factura("2")) and b.is_invoiced(factura("1"))
+
+
+def test_archivos_concurrentes(tmp_path):
+    raiz = tmp_path / "archivo"
+    archivos = [ComprobanteArchive(raiz) for _ in range(4)]
+
+    def emitir(n, archivo):
+        for i in range(10):
+            rendicion = f"{n}{i:02d}"
+            archivo.store(pdf(tmp_path, f"{rendicion}.pdf", rendicion.encode()), factura(rendicion))
+
+    hilos = [threading.Thread(target=emitir, args=(n, a)) for n, a in enumerate(archivos, 1)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(ComprobanteArchive(raiz)) == 40
+
+
+def test_receptores_de_dos_procesos_se_combinan(tmp_path):
+    path = tmp_path / "receptores.json"
+    a, b = ReceptorCache(path), ReceptorCache(path)
+    a.record(factura("1", cuit="20111111112"))
+    b.record(factura("2", cuit="20222222223", cond_iva="CF"))
+    a.save()
+    b.save()
+
+    nueva = ReceptorCache(path)
+    assert nueva.check(factura("3", cuit="20111111112", cond_iva="CF"))
+    assert nueva.check(factura("4", cuit="20222222223", cond_iva="RI"))
+    assert list(tmp_path.glob("*.tmp")) == []
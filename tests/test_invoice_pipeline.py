@@ -0,0 +1,28 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from invoice_pipeline import agrupar_facturas
+
+
+def factura(rendicion, fecha, cliente="CLIENTE SA"):
+    return SimpleNamespace(cliente=cliente, cuit="20123456786", cond_iva="RI", rendicion=rendicion,
+                           periodo="ENERO 2025", fecha=fecha, row_index=int(rendicion) + 1)
+
+
+def test_filas_con_distinta_fecha_van_en_comprobantes_distintos():
+    facturas = [
+        factura("1", datetime(2025, 1, 31)),
+        factura("2", datetime(2025, 2, 15)),
+        factura("3", datetime(2025, 1, 31)),
+    ]
+
+    grupos = agrupar_facturas(facturas)
+
+    assert [[f.rendicion for f in g] for g in grupos] == [["1", "3"], ["2"]]
+    for grupo in grupos:
+        assert len({f.fecha for f in grupo}) == 1
+
+
+def test_misma_fecha_con_distinta_hora_se_agrupa():
+    grupos = agrupar_facturas([factura("1", datetime(2025, 1, 31)), factura("2", datetime(2025, 1, 31, 12))])
+    assert len(grupos) == 1
@@ -0,0 +1,33 @@
+import retry_policy
+from retry_policy import RetryPolicy, classify
+
+
+class UnexpectedAlertPresentException(Exception):
+    """Mismo nombre y atributo alert_text que la excepción de selenium"""
+
+    def __init__(self, msg="", alert_text=None):
+        super().__init__(msg)
+        self.alert_text = alert_text
+
+
+def test_alerta_con_mensaje_de_validacion_es_permanente():
+    error = UnexpectedAlertPresentException(alert_text="El CUIT ingresado es inválido")
+    assert classify(error) == retry_policy.VALIDATION
+
+
+def test_alerta_sin_mensaje_de_validacion_se_reintenta():
+    assert classify(UnexpectedAlertPresentException(alert_text="Aguarde un momento")) == retry_policy.UNKNOWN
+    assert classify(UnexpectedAlertPresentException()) == retry_policy.UNKNOWN
+
+
+def test_alerta_transitoria_se_reintenta_con_la_politica():
+    intentos = []
+
+    def paso():
+        intentos.append(1)
+        if len(intentos) == 1:
+            raise UnexpectedAlertPresentException(alert_text="Procesando...")
+        return "ok"
+
+    assert RetryPolicy(sleep=lambda s: None).call(paso, "paso") == "ok"
+    assert len(intentos) == 2